@@ -17,13 +17,15 @@
 # but in the form of a proxy. For instance, it serves as the single subscriber to
 # all publishers. On the other hand, it serves as the single publisher to all the subscribers. 
 import argparse # for argument parsing
+import json # for the egress counters
 import configparser # for configuration parsing
 import logging # for logging. Use it in place of print statements.
 import time   # for sleep
-from topic_selector import TopicSelector
 
 # Now import our CS6381 Middleware
 from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.Common import BrokerRing, ConnectionManager
+from CS6381_MW import LogUtil
 # We also need the message formats to handle incoming responses.
 from CS6381_MW import discovery_pb2
 
@@ -43,8 +45,17 @@ class BrokerAppln():
     def __init__(self,logger):
         self.state = self.State.INITIALIZE # state that are we in
         self.name = None # our name (some unique name)
-        self.num_topics=0
-        self.topiclist = None # the different topics
+        self.topiclist = None # every topic there is; we forward the ones we own
+        self.pub_topics = {} # publisher -> the topics it publishes
+        self.owned = [] # the topics that hash to us on the broker ring
+        self.refresh = None # msec between refreshes of the publisher set
+        self.page_size = None # most publishers we take per LookupAll response
+        self.forwarding = None # how the middleware forwards publications
+        self.egress = None # how the middleware sends to subscribers
+        self.stats_file = None # where the per subscriber egress counters go
+        self.log_dir = None # where the topic log is kept, if we keep one
+        self.pub_version = 0 # discovery registry version we have applied
+        self.connections = None # the publishers we are connected to
         self.mw_obj = None # handle to the underlying Middleware object
         self.logger = logger  # internal logger for print statements
 
@@ -55,18 +66,24 @@ class BrokerAppln():
             self.state = self.State.CONFIGURE
             # initialize our variables
             self.name = args.name # our name
-            self.num_topics = args.num_topics
-
-            # Now get our topic list of interest
-            self.logger.debug ("BrokerAppln::configure - selecting our topic list")
-            ts = TopicSelector ()
-            self.topiclist = ts.interest (self.num_topics)  # let topic selector give us the desired num of topics
+            self.refresh = int (args.refresh * 1000)
+            self.page_size = args.page_size
+            self.forwarding = args.forwarding
+            self.egress = args.egress
+            self.log_dir = args.log_dir
+            self.stats_file = args.stats_file or "{}_egress.json".format (self.name)
+
+            # The topics there are, hierarchical ones included, come with the
+            # publishers; which of them we forward depends on how many other
+            # brokers there are, which discovery tells us with every refresh
+            self.topiclist = []
     
             # Now setup up our underlying middleware object to which we delegate
             # everything
             self.logger.debug ("BrokerAppln::configure - initialize the middleware object")
             self.mw_obj = BrokerMW (self.logger)
             self.mw_obj.configure (args) # pass remainder of the args to the m/w object
+            self.connections = ConnectionManager (self.mw_obj.connect_pub, self.mw_obj.disconnect_pub)
 
             self.logger.info ("BrokerAppln::configure - configuration complete")
       
@@ -102,7 +119,7 @@ class BrokerAppln():
             if (self.state == self.State.REGISTER):
                 # send a register msg to discovery service
                 self.logger.debug ("BrokerAppln::invoke_operation - register with the discovery service")
-                self.mw_obj.register (self.name,self.topiclist)
+                self.mw_obj.register (self.name,[])
 
                 return None
 
@@ -115,12 +132,19 @@ class BrokerAppln():
             elif (self.state == self.State.LOOKUP):
 
                 self.logger.debug ("BrokerAppln::invoke_operation - look up from discovery about publishers") 
-                self.mw_obj.lookall_publisher() #send look up request
+                self.mw_obj.lookall_publisher(self.pub_version,self.page_size) #send look up request
 
                 return None
             
             elif (self.state == self.State.DISSEMINATE):
-                self.logger.debug ("BrokerAppln::invoke_operation - start Disseminating")
+                # the middleware keeps forwarding; periodically we ask discovery what
+                # changed in the publisher set since the version we already applied
+                self.logger.debug ("BrokerAppln::invoke_operation - refresh publishers since version {}".format (self.pub_version))
+                self.mw_obj.lookall_publisher(self.pub_version,self.page_size)
+
+                # the egress counters are brought up to date on the same timer
+                if self.egress == "managed":
+                    self.save_stats ()
         
                 return None
 
@@ -182,21 +206,65 @@ class BrokerAppln():
         try:
             if lookall_resp.status == discovery_pb2.STATUS_SUCCESS:
                 self.logger.info ("BrokerAppln::lookall_response")
-                #return publishers which send topic to us
+                #the response only carries the change since the version we sent
+                added={}
                 for publisherInfo in lookall_resp.publisherInfos:
-                    # temporary store publishers in this structure
-                    self.mw_obj.connect_pub(str(publisherInfo.addr)+':'+str(publisherInfo.port))
-
+                    # over ipc or inproc when it shares our host or process
+                    added[publisherInfo.id]=self.mw_obj.endpoint(publisherInfo)
+                    self.pub_topics[publisherInfo.id]=list(publisherInfo.topiclist)
+                # the data path knows the topics by the ids discovery gave them
+                self.mw_obj.intern(lookall_resp.topic_ids)
+                for pubname in lookall_resp.removed:
+                    self.pub_topics.pop(pubname,None)
+                self.connections.apply(added,lookall_resp.removed)
+                self.topiclist=sorted(set(topic for topics in self.pub_topics.values() for topic in topics))
+
+                self.update_owned(lookall_resp.brokers)
+
+                self.logger.debug ("BrokerAppln::lookall_response - at version {} with {} publishers".format (lookall_resp.version, len (self.connections)))
+                self.pub_version=lookall_resp.version
                 self.state = self.State.DISSEMINATE
-                # return a timeout of zero so that the event loop in its next iteration will immediately make
-                # an upcall to us
-                return 0
+                if lookall_resp.more:
+                    # we are already connected to this page; go get the next one
+                    # right away
+                    return 0
+                # come back for the next delta after the refresh interval
+                return self.refresh
             else:
                 self.logger.debug ("BrokerAppln::lookall_response - lookall is a failure")
                 raise ValueError ("Broker needs cannot get publishers")
             
         except Exception as e:
             raise e
+    def update_owned(self,brokers):
+        ''' work out our slice of the topics from the broker tier '''
+        try:
+            ring=BrokerRing()
+            for brokerInfo in brokers:
+                ring.add(brokerInfo.id,brokerInfo.addr,brokerInfo.port)
+            if len(ring)==0:
+                # discovery does not know about us (yet); keep what we have
+                return
+            owned=ring.owned(self.name,self.topiclist)
+            if owned!=self.owned:
+                self.logger.info ("BrokerAppln::update_owned - {} brokers, we now own {}".format (len (ring), owned))
+                self.owned=owned
+                self.mw_obj.set_topics(owned)
+
+        except Exception as e:
+            raise e
+
+    def save_stats (self):
+        ''' write sent, dropped and queued per subscriber and topic '''
+        try:
+            stats = self.mw_obj.egress_stats ()
+            with open (self.stats_file, "w") as f:
+                json.dump (stats, f, indent=1)
+            dropped = sum (counts["dropped"] for topics in stats.values () for counts in topics.values ())
+            self.logger.debug ("BrokerAppln::save_stats - {} subscribers, {} dropped so far".format (len (stats), dropped))
+        except Exception as e:
+            raise e
+
     ########################################
     # dump the contents of the object 
     ########################################
@@ -207,8 +275,11 @@ class BrokerAppln():
             self.logger.info ("BrokerAppln::dump")
             self.logger.info ("------------------------------")
             self.logger.info ("     Name: {}".format (self.name))
-            self.logger.info ("     Num Topics: {}".format (self.num_topics))
-            self.logger.info ("     TopicList: {}".format (self.topiclist))
+            self.logger.info ("     Refresh (msec): {}".format (self.refresh))
+            self.logger.info ("     Page size: {}".format (self.page_size))
+            self.logger.info ("     Forwarding: {}".format (self.forwarding))
+            self.logger.info ("     Egress: {}".format (self.egress))
+            self.logger.info ("     Topic log: {}".format (self.log_dir))
             self.logger.info ("**********************************")
 
         except Exception as e:
@@ -234,11 +305,36 @@ def parseCmdLineArgs ():
     
     parser.add_argument ("-c", "--config", default="config.ini", help="configuration file (default: config.ini)")
 
-    parser.add_argument ("-T", "--num_topics", type=int, choices=range(1,10), default=1, help="Number of topics to publish, currently restricted to max of 9")
+    parser.add_argument ("-r", "--refresh", type=float, default=5.0, help="Seconds between asking discovery for changes to the publisher set, default 5")
+
+    parser.add_argument ("-F", "--forwarding", choices=["proxy","device"], default="proxy", help="proxy: forward in our event loop; device: XSUB/XPUB forwarding on its own thread with subscriptions passed upstream, default proxy")
+
+    parser.add_argument ("-e", "--egress", choices=["pub","managed"], default="pub", help="pub: a PUB socket, which drops whatever a slow subscriber cannot take once its HWM is hit; managed: per subscriber and topic queues under the QoS each subscriber registers with (SubscriberAppln -Q), proxy forwarding only, default pub")
+
+    parser.add_argument ("-w", "--hwm", type=int, default=1000, help="With managed egress, most samples queued per subscriber and topic unless its QoS says otherwise, at least 1, default 1000")
+
+    parser.add_argument ("-S", "--stats_file", default=None, help="With managed egress, where the sent/dropped/queued counters per subscriber and topic are written every refresh, default <name>_egress.json")
+
+    parser.add_argument ("-D", "--log_dir", default=None, help="Keep a durable per topic log of everything we forward in this directory and serve replays from it, proxy forwarding only, default no log")
+
+    parser.add_argument ("-M", "--segment_bytes", type=int, default=64*1024*1024, help="Start a new log segment once the current one is this big, default 64 MiB")
+
+    parser.add_argument ("-R", "--replay_port", type=int, default=0, help="Port on which replays from the log are served, default our port + 1")
+
+    parser.add_argument ("-b", "--budget", type=int, default=100, help="Most publications forwarded per wakeup before other sockets get their turn, default 100")
+
+    parser.add_argument ("-g", "--page_size", type=int, default=1000, help="Most publishers to receive per LookupAll response (0 = whatever discovery allows), default 1000")
     
-    parser.add_argument ("-l", "--loglevel", type=int, default=logging.DEBUG, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+    parser.add_argument ("-x", "--transports", default="inproc,ipc", help="Local transports besides tcp, comma separated inproc,ipc: we listen on them for subscribers, and connect over them to publishers, on our host (ipc) or in our process (inproc). \"tcp\" turns them off. Default inproc,ipc")
+
+    parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    # a queue limit of 0 would have every sample dropped, and drop-oldest
+    # popping from an empty queue
+    if args.hwm < 1:
+        parser.error ("-w/--hwm must be at least 1, got {}".format (args.hwm))
+    return args
 
 ###################################
 #
@@ -284,9 +380,9 @@ def main ():
 ###################################
 if __name__ == "__main__":
 
-  # set underlying default logging capabilities
-  logging.basicConfig (level=logging.DEBUG,
-                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+  # set underlying default logging capabilities; records are written out by
+  # a thread of their own so that logging never holds up the messaging
+  LogUtil.start (level=logging.DEBUG, fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 
   main ()
\ No newline at end of file
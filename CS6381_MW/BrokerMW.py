@@ -19,11 +19,29 @@
 # behalf of the real publishers and subscribers. So this will have the logic of
 # both publisher and subscriber middleware.
 
+import threading  # the device forwards on its own thread
 import zmq  # ZMQ sockets
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
-#from CS6381_MW import topic_pb2  # you will need this eventually
+from CS6381_MW.Common import poll_deadline, poll_remaining, deadline_expired, drain
+from CS6381_MW.Common import DiscoveryCodec, LastValueCache, TopicIds
+from CS6381_MW.Common import parse_transports, local_endpoints, bind_endpoints, choose_endpoint
+from CS6381_MW.Egress import ManagedEgress
+from CS6381_MW.LogUtil import Lazy, hot_path
+from CS6381_MW.TopicLog import TopicLog, ReplayService
+
+# With managed egress ZMQ itself only queues this many messages per
+# subscriber; anything beyond waits in our own queues, where the
+# subscriber's QoS decides what gets dropped
+EGRESS_PIPE_HWM = 100
+
+# msec between attempts to send to a subscriber whose pipe is full
+EGRESS_RETRY = 1
+
+# msec a message may sit in the topic log's buffers before it is flushed and
+# can be replayed
+LOG_FLUSH = 10
 
 class BrokerMW():
     def __init__ (self, logger):
@@ -31,11 +49,27 @@ class BrokerMW():
         self.req = None # will be a ZMQ REP socket
         self.pub = None
         self.sub = None
+        self.forwarding = None # proxy (our event loop forwards) or device (own thread)
+        self.context = None # the ZMQ context, shared with the device thread
+        self.ctrl = None # PAIR socket over which we tell the device what to do
+        self.device = None # the device thread
+        self.ids = TopicIds () # the topics discovery told us about and their ids
+        self.owned = set () # topic frames of the topics that hash to us on the broker ring
+        self.egress = None # per subscriber queues, when egress is managed
+        self.lvc = LastValueCache () # latest message per topic, for subscribers that join late
+        self.log = None # durable per topic log of what we forward, if we keep one
+        self.replay = None # serves replays from the log on its own thread
+        self.replay_port = None # where the replay requests come in
         self.poller = None # used to wait on incoming replies
+        self.codec = DiscoveryCodec () # builds and parses our discovery messages
         self.addr = None # our advertised IP address
         self.port = None # port num
+        self.transports = [] # the local transports we listen and connect on besides tcp
+        self.endpoints = [] # our local endpoints, for subscribers on our host or in our process
+        self.budget = None # most messages forwarded per wakeup
         self.upcall_obj = None # handle to appln obj to handle appln-specific data
         self.handle_events = True # in general we keep going thru the event loop
+        self.trace = False # whether we log every forwarded batch (only at DEBUG)
 
     def configure (self, args):
         ''' Initialize the object '''
@@ -44,13 +78,22 @@ class BrokerMW():
             # Here we initialize any internal variables
             self.logger.info ("BrokerMW::configure")
 
+            # checked once here rather than by the logger for every batch
+            self.trace = hot_path (self.logger)
+
             # First retrieve our advertised IP addr and the publication port num
             self.port = args.port
             self.addr = args.addr
+            self.budget = args.budget
+            self.transports = parse_transports (args.transports)
+            self.endpoints = local_endpoints (self.addr, self.port, self.transports)
 
             # Next get the ZMQ context
+            self.forwarding = args.forwarding
+
             self.logger.debug ("BrokerMW::configure - obtain ZMQ context")
-            context = zmq.Context ()  # returns a singleton object
+            context = zmq.Context.instance ()  # returns a singleton object
+            self.context = context
 
             # get the ZMQ poller object
             self.logger.debug ("BrokerMW::configure - obtain the poller")
@@ -58,12 +101,47 @@ class BrokerMW():
 
             self.logger.debug ("BrokerMW::configure - obtain REP sockets")
             self.req = context.socket (zmq.REQ)
-            self.pub = context.socket (zmq.PUB)
-            self.sub = context.socket (zmq.SUB)
 
             self.logger.debug ("BrokerMW::configure - register the REQ socket for incoming replies")
             self.poller.register (self.req, zmq.POLLIN)
-            self.poller.register (self.sub, zmq.POLLIN)
+
+            if args.egress == "managed" and self.forwarding == "device":
+                raise ValueError ("Managed egress needs the proxy forwarding")
+            if args.log_dir and self.forwarding == "device":
+                raise ValueError ("The topic log needs the proxy forwarding")
+
+            if self.forwarding == "device":
+                # the device owns the data path sockets on its own thread; we only
+                # keep the control socket to it
+                self.logger.debug ("BrokerMW::configure - start the forwarding device")
+                ctrl_str = "inproc://broker-ctrl-{}".format (id (self))
+                self.ctrl = context.socket (zmq.PAIR)
+                self.ctrl.bind (ctrl_str)
+                self.device = threading.Thread (target=self.device_loop, args=(ctrl_str, ["tcp://*:" + str(self.port)] + self.endpoints), daemon=True)
+                self.device.start ()
+                # wait until the device has bound its XPUB socket
+                reply = self.ctrl.recv ()
+                if reply != b"ok":
+                    raise ValueError ("Forwarding device failed to start: {}".format (str (reply, "utf-8")))
+            else:
+                self.sub = context.socket (zmq.SUB)
+                self.poller.register (self.sub, zmq.POLLIN)
+                if args.egress == "managed":
+                    # subscribers connect a DEALER socket and send their
+                    # registration as a hello; what they cannot take right away
+                    # is queued per subscriber and topic under their QoS
+                    self.logger.debug ("BrokerMW::configure - managed egress")
+                    self.pub = context.socket (zmq.ROUTER)
+                    self.pub.setsockopt (zmq.ROUTER_MANDATORY, 1)
+                    self.pub.setsockopt (zmq.SNDHWM, EGRESS_PIPE_HWM)
+                    self.poller.register (self.pub, zmq.POLLIN)
+                    self.egress = ManagedEgress (self.pub, args.hwm, self.ids)
+                else:
+                    # XPUB rather than PUB so that we see every new subscription
+                    # and can send it the latest value of its topics
+                    self.pub = context.socket (zmq.XPUB)
+                    self.pub.setsockopt (zmq.XPUB_VERBOSE, 1)
+                    self.poller.register (self.pub, zmq.POLLIN)
 
             self.logger.debug ("BrokerMW::configure - connect to Discovery service")
             # For our assignments we will use TCP. The connect string is made up of
@@ -71,10 +149,21 @@ class BrokerMW():
             connect_str = "tcp://" + args.discovery
             self.req.connect (connect_str)
 
-            self.logger.debug ("BrokerMW::configure - bind to the pub socket")
-            
-            bind_string = "tcp://*:" + str(self.port)
-            self.pub.bind (bind_string)
+            if self.pub is not None:
+                self.logger.debug ("BrokerMW::configure - bind to the pub socket")
+
+                bind_string = "tcp://*:" + str(self.port)
+                self.pub.bind (bind_string)
+                bind_endpoints (self.pub, self.endpoints)
+
+            if args.log_dir:
+                # everything we forward is appended to the log; a thread of its
+                # own answers the replay requests from it
+                self.logger.debug ("BrokerMW::configure - topic log in {}".format (args.log_dir))
+                self.log = TopicLog (args.log_dir, args.segment_bytes, LOG_FLUSH)
+                self.replay_port = args.replay_port or self.port + 1
+                self.replay = ReplayService (self.log, self.logger)
+                self.replay.start (context, "tcp://*:" + str (self.replay_port))
     
             self.logger.info ("BrokerMW::configure completed")
 
@@ -85,16 +174,42 @@ class BrokerMW():
         try:
             self.logger.info ("BrokerMW::event_loop - run the event loop")
 
+            # publications keep the sub socket busy, so the timeout from the appln is
+            # kept as a deadline; otherwise the periodic publisher refresh would never
+            # get its upcall while traffic is flowing
+            deadline = poll_deadline (timeout)
             while self.handle_events:  
-                events = dict (self.poller.poll (timeout=timeout))
-                if not events:
-                    timeout = self.upcall_obj.invoke_operation ()
-                elif self.req in events:
-                    timeout = self.handle_reply ()
-                elif self.sub in events:
-                    timeout = self.proxy ()
-                else:
+                # a subscriber whose pipe is full gets its backlog retried shortly
+                wakeup = deadline
+                if self.egress is not None and self.egress.backlog:
+                    retry = poll_deadline (EGRESS_RETRY)
+                    if wakeup is None or retry < wakeup:
+                        wakeup = retry
+                # and so do log appends that are due to be flushed
+                if self.log is not None and self.log.deadline is not None:
+                    if wakeup is None or self.log.deadline < wakeup:
+                        wakeup = self.log.deadline
+                events = dict (self.poller.poll (timeout=poll_remaining (wakeup)))
+                # every ready socket gets its turn: the budgeted proxy () leaves
+                # the SUB socket readable under sustained traffic, which must not
+                # keep new subscribers on the PUB socket waiting
+                if self.req in events:
+                    deadline = poll_deadline (self.handle_reply ())
+                if self.sub in events:
+                    self.proxy ()
+                if self.pub in events:
+                    if self.egress is not None:
+                        self.hello ()
+                    else:
+                        self.subscription ()
+                if any (socket not in (self.req, self.sub, self.pub) for socket in events):
                     raise Exception ("Unknown event after poll")
+                if self.egress is not None and self.egress.backlog:
+                    self.flush_egress ()
+                if self.log is not None and deadline_expired (self.log.deadline):
+                    self.log.flush ()
+                if deadline_expired (deadline):
+                    deadline = poll_deadline (self.upcall_obj.invoke_operation ())
             self.logger.info ("BrokerMW::event_loop - out of the event loop")
         except Exception as e:
             raise e
@@ -103,8 +218,7 @@ class BrokerMW():
         try:
             self.logger.info ("BrokerMW::handle_reply")
             bytesRcvd = self.req.recv ()
-            disc_resp = discovery_pb2.DiscoveryResp ()
-            disc_resp.ParseFromString (bytesRcvd)
+            disc_resp = self.codec.decode_resp (bytesRcvd)
             if (disc_resp.msg_type == discovery_pb2.TYPE_REGISTER):
                 timeout = self.upcall_obj.register_response (disc_resp.register_resp)
             elif (disc_resp.msg_type == discovery_pb2.TYPE_LOOKUP_ALL_PUBS):
@@ -123,37 +237,9 @@ class BrokerMW():
 
         try:
             self.logger.info ("BrokerMW::register")
-            self.logger.debug ("BrokerMW::register - populate the Registrant Info")
-            reg_info = discovery_pb2.RegistrantInfo () # allocate
-            reg_info.id = name  # our id
-            reg_info.addr = self.addr
-            reg_info.port = self.port 
-            self.logger.debug ("BrokerMW::register - done populating the Registrant Info")
-
-            # Next build a RegisterReq message
-            self.logger.debug ("BrokerMW::register - populate the nested register req")
-            register_req = discovery_pb2.RegisterReq ()  # allocate 
-            register_req.role = discovery_pb2.ROLE_BOTH
-            register_req.info.CopyFrom (reg_info)  # copy contents of inner structure
-            register_req.topiclist[:] = topiclist   # this is how repeated entries are added (or use append() or extend ()
-            self.logger.debug ("BrokerMW::register - done populating nested RegisterReq")
-
-            # Finally, build the outer layer DiscoveryReq Message
-            self.logger.debug ("BrokerMW::register - build the outer DiscoveryReq message")
-            disc_req = discovery_pb2.DiscoveryReq ()  # allocate
-            disc_req.msg_type = discovery_pb2.TYPE_REGISTER  # set message type
-            disc_req.dht_type=discovery_pb2.TYPE_INITIAL
-            disc_req.register_req.CopyFrom (register_req)
-            self.logger.debug ("BrokerMW::register - done building the outer message")
-
-            # now let us stringify the buffer and print it. This is actually a sequence of bytes and not
-            # a real string
-            buf2send = disc_req.SerializeToString ()
-            self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
-
-            #VERY IMPORTANT!!!
-            for item in topiclist:
-                self.sub.setsockopt(zmq.SUBSCRIBE, bytes(item, "utf-8"))
+            self.logger.debug ("BrokerMW::register - build the DiscoveryReq message")
+            buf2send = self.codec.register_req (discovery_pb2.ROLE_BOTH, name, self.addr, self.port, topiclist, replay_port=self.replay_port, endpoints=self.endpoints)
+            self.logger.debug (Lazy ("Stringified serialized buf = {}", buf2send))
 
             # now send this to our discovery service
             self.logger.debug ("BrokerMW::register - send stringified buffer to Discovery service")
@@ -171,26 +257,8 @@ class BrokerMW():
         try:
             self.logger.info ("BrokerMW::is_ready")
 
-            # first build a IsReady message
-            self.logger.debug ("BrokerMW::is_ready - populate the nested IsReady msg")
-            isready_req = discovery_pb2.IsReadyReq ()  # allocate 
-            # actually, there is nothing inside that msg declaration.
-            self.logger.debug ("BrokerMW::is_ready - done populating nested IsReady msg")
-
-            # Build the outer layer Discovery Message
-            self.logger.debug ("BrokerMW::is_ready - build the outer DiscoveryReq message")
-            disc_req = discovery_pb2.DiscoveryReq ()
-            disc_req.msg_type = discovery_pb2.TYPE_ISREADY
-            disc_req.dht_type=discovery_pb2.TYPE_INITIAL
-            # It was observed that we cannot directly assign the nested field here.
-            # A way around is to use the CopyFrom method as shown
-            disc_req.isready_req.CopyFrom (isready_req)
-            self.logger.debug ("BrokerMW::is_ready - done building the outer message")
-
-            # now let us stringify the buffer and print it. This is actually a sequence of bytes and not
-            # a real string
-            buf2send = disc_req.SerializeToString ()
-            self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+            # the IsReady request is always the same bytes
+            buf2send = self.codec.isready_req ()
 
             # now send this to our discovery service
             self.logger.debug ("BrokerMW::is_ready - send stringified buffer to Discovery service")
@@ -202,27 +270,14 @@ class BrokerMW():
         except Exception as e:
             raise e
         
-    def lookall_publisher(self):
-        #send topic list to discovery
-        #look all like register
+    def lookall_publisher(self, version, page_size):
+        #send the registry version we have applied so far to discovery
+        #and get back only what changed since then, at most page_size at a time
         try:
             self.logger.info ("BrokerMW::lookup")
-            self.logger.debug ("BrokerMW::lookup_req - populate the LookupAllPubReq")
-            lookall_req = discovery_pb2.LookupAllPubReq () # allocate
-            self.logger.debug ("BrokerMW::lookup - done populating nested LookupAllPubReq")
-
-            # Finally, build the outer layer DiscoveryReq Message
-            self.logger.debug ("BrokerMW::lookup - build the outer DiscoveryReq message")
-            disc_req = discovery_pb2.DiscoveryReq ()  # allocate
-            disc_req.msg_type = discovery_pb2.TYPE_LOOKUP_ALL_PUBS  # set message type
-            disc_req.dht_type=discovery_pb2.TYPE_INITIAL
-            disc_req.lookall_req.CopyFrom (lookall_req)
-            self.logger.debug ("BrokerMW::lookup - done building the outer message")
-
-            # now let us stringify the buffer and print it. This is actually a sequence of bytes and not
-            # a real string
-            buf2send = disc_req.SerializeToString ()
-            self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+            self.logger.debug ("BrokerMW::lookup - build the DiscoveryReq message")
+            buf2send = self.codec.lookall_req (version, page_size)
+            self.logger.debug (Lazy ("Stringified serialized buf = {}", buf2send))
 
             # now send this to our discovery service
             self.logger.debug ("BrokerMW::lookup - send stringified buffer to Discovery service")
@@ -234,39 +289,231 @@ class BrokerMW():
         except Exception as e:
             raise e
     
-    def connect_pub (self, pubaddr):
+    def intern (self, topic_ids):
+        ''' the ids of the publishers' topics, as discovery handed them out '''
+        try:
+            added = self.ids.update (topic_ids)
+            if added:
+                self.logger.debug ("BrokerMW::intern - {}".format (added))
+        except Exception as e:
+            raise e
+
+    def set_topics (self, topiclist):
+        ''' the topics we own on the broker ring; only those are taken from the publishers '''
         try:
-            self.logger.info ("BrokerMW::lookup - connect to publisher")
+            self.logger.info ("BrokerMW::set_topics - {}".format (topiclist))
+            owned = set (self.ids.frame (topic) for topic in topiclist)
+            if self.ctrl is not None:
+                # the device works out the upstream subscriptions itself
+                self.ctrl.send_multipart ([b"own"] + sorted (owned))
+            else:
+                #VERY IMPORTANT!!!
+                for topic in owned - self.owned:
+                    self.sub.setsockopt (zmq.SUBSCRIBE, topic)
+                for topic in self.owned - owned:
+                    self.sub.setsockopt (zmq.UNSUBSCRIBE, topic)
+            self.owned = owned
+        except Exception as e:
+            raise e
+
+    def endpoint (self, info):
+        ''' where to connect to a publisher in a lookall response: its inproc
+        or ipc endpoint when it is in our process or on our host '''
+        return choose_endpoint (self.context, self.transports, self.addr, info.addr, info.port, info.endpoints)
+
+    def connect_pub (self, endpoint):
+        try:
+            self.logger.info ("BrokerMW::lookup - connect to publisher at {}".format (endpoint))
             self.logger.debug ("BrokerMW::lookup - connect to the pub socket")
 
-            connect_string = "tcp://" + str(pubaddr)
-            self.sub.connect (connect_string)
+            connect_string = endpoint
+            if self.ctrl is not None:
+                # the device thread owns the XSUB socket, so it does the connect
+                self.ctrl.send_multipart ([b"connect", bytes (connect_string, "utf-8")])
+            else:
+                self.sub.connect (connect_string)
  
             self.logger.debug ("BrokerMW::connect complete")
         except Exception as e:
             raise e
-        
 
-    def proxy (self):
+    def disconnect_pub (self, endpoint):
         try:
-            self.logger.info ("BrokerMW::disseminating - connect to publisher")
+            self.logger.info ("BrokerMW::disconnect_pub - disconnect from publisher at {}".format (endpoint))
+
+            disconnect_string = endpoint
+            if self.ctrl is not None:
+                self.ctrl.send_multipart ([b"disconnect", bytes (disconnect_string, "utf-8")])
+            else:
+                self.sub.disconnect (disconnect_string)
+
+            self.logger.debug ("BrokerMW::disconnect complete")
+        except Exception as e:
+            raise e
+
+    def device_loop (self, ctrl_str, bind_strings):
+        ''' XSUB/XPUB forwarding, run on the device thread
+
+        Publications go from the XSUB socket to the XPUB socket and the
+        subscriptions of our subscribers go the other way, so publishers only
+        send us what somebody wants. Frames are passed on as they are, without
+        being copied or decoded. zmq.proxy would do the forwarding as well, but
+        it cannot be told to connect to a new publisher while it runs, which
+        is what the control socket is for.
 
-            data=self.sub.recv_string ()
-            self.print_data(data)
-            
-            self.pub.send(bytes(data,"utf-8"))
+        With several brokers, a subscription only goes upstream for the topics
+        we own: the other brokers carry the rest.
 
-            self.logger.debug ("BrokerMW::proxy complete")
+        The latest message of every topic is kept, and a new subscription
+        gets those of its topics at once. '''
+        ctrl = self.context.socket (zmq.PAIR)
+        ctrl.connect (ctrl_str)
+        try:
+            xsub = self.context.socket (zmq.XSUB)
+            xpub = self.context.socket (zmq.XPUB)
+            # every subscription, not just the first to a topic, so that each
+            # new subscriber gets its snapshot
+            xpub.setsockopt (zmq.XPUB_VERBOSE, 1)
+            bind_endpoints (xpub, bind_strings)
+        except Exception as e:
+            ctrl.send (bytes (str (e), "utf-8"))
+            return
+        ctrl.send (b"ok")
+
+        wanted = set () # subscription prefixes of our subscribers
+        owned = set () # topics we own
+        upstream = set () # topics we are subscribed to at the publishers
+        lvc = LastValueCache () # latest message per topic
+
+        def resubscribe ():
+            # a topic goes upstream when we own it and some subscriber wants it
+            nonlocal upstream
+            topics = set (topic for topic in owned if any (topic.startswith (prefix) for prefix in wanted))
+            for topic in topics - upstream:
+                xsub.send (b"\x01" + topic)
+            for topic in upstream - topics:
+                xsub.send (b"\x00" + topic)
+            upstream = topics
+
+        poller = zmq.Poller ()
+        poller.register (xsub, zmq.POLLIN)
+        poller.register (xpub, zmq.POLLIN)
+        poller.register (ctrl, zmq.POLLIN)
+        try:
+            while True:
+                events = dict (poller.poll ())
+                if xsub in events:
+                    batch = drain (xsub, self.budget)
+                    lvc.update (batch)
+                    for frames in batch:
+                        xpub.send_multipart (frames, copy=False)
+                if xpub in events:
+                    # a (un)subscription from one of our subscribers: a leading 1
+                    # byte subscribes, a 0 byte unsubscribes
+                    message = xpub.recv ()
+                    if message[:1] == b"\x01":
+                        wanted.add (message[1:])
+                        for frames in lvc.snapshot (message[1:]):
+                            xpub.send_multipart (frames, copy=False)
+                    elif message[:1] == b"\x00":
+                        wanted.discard (message[1:])
+                    resubscribe ()
+                if ctrl in events:
+                    command = ctrl.recv_multipart ()
+                    if command[0] == b"own":
+                        owned = set (command[1:])
+                        resubscribe ()
+                    elif command[0] == b"connect":
+                        xsub.connect (str (command[1], "utf-8"))
+                    elif command[0] == b"disconnect":
+                        xsub.disconnect (str (command[1], "utf-8"))
+                    elif command[0] == b"stop":
+                        break
+                    self.logger.debug ("BrokerMW::device_loop - {} {}".format (str (command[0], "utf-8"), command[1:]))
+        except Exception as e:
+            self.logger.error ("BrokerMW::device_loop - forwarding stopped: {}".format (e))
+        finally:
+            xsub.close (linger=0)
+            xpub.close (linger=0)
+            ctrl.close (linger=0)
+
+    def stop_device (self):
+        ''' stop the device thread and wait for it to be gone '''
+        if self.device is not None:
+            self.ctrl.send_multipart ([b"stop"])
+            self.device.join ()
+            self.device = None
+
+    def proxy (self):
+        try:
+            # the broker never looks inside a Publication; the topic frame and the
+            # payload frame are passed on as they came in, everything queued (up
+            # to our budget) in one go
+            batch=drain (self.sub, self.budget)
+            self.lvc.update (batch)
+            if self.log is not None:
+                self.log.append (batch)
+            if self.egress is not None:
+                # queued for each subscriber; the event loop sends them on
+                self.egress.push (batch)
+            else:
+                self.forward (batch)
+            if self.trace:
+                self.print_data(batch)
         except Exception as e:
             raise e
         
-    def print_data (self,data):
+    def forward (self, batch):
+        ''' send on a list of messages, each a list of frames '''
+        send = self.pub.send_multipart
+        for frames in batch:
+            send (frames, copy=False)
+
+    def hello (self):
+        ''' a subscriber's registration, with its QoS, over managed egress '''
+        try:
+            identity, buf = self.pub.recv_multipart ()
+            register_req = self.codec.decode_req (buf).register_req
+            self.egress.hello (identity, register_req, self.lvc.snapshot (b""))
+            qos = [(qos.topic, discovery_pb2.QosPolicy.Name (qos.policy), qos.hwm) for qos in register_req.qos]
+            predicates = ["{}.{}{}{}".format (p.topic, p.field, p.op, p.operand) for p in register_req.predicates]
+            self.logger.info ("BrokerMW::hello - subscriber {} for {}, QoS {}, predicates {}".format (register_req.info.id, list (register_req.topiclist), qos, predicates))
+        except Exception as e:
+            raise e
+
+    def subscription (self):
+        ''' a subscription arrived on our XPUB socket; the new subscriber gets
+        the latest value of every topic it matches right away '''
+        try:
+            message = self.pub.recv ()
+            # a leading 1 byte subscribes, a 0 byte unsubscribes
+            if message[:1] == b"\x01":
+                snapshot = self.lvc.snapshot (message[1:])
+                self.forward (snapshot)
+                self.logger.debug ("BrokerMW::subscription - {}, {} cached values sent".format (message[1:], len (snapshot)))
+        except Exception as e:
+            raise e
+
+    def flush_egress (self):
+        ''' send the subscribers what they can take now '''
+        try:
+            for subscriber in self.egress.flush ():
+                self.logger.info ("BrokerMW::flush_egress - subscriber {} is gone".format (subscriber.name))
+        except Exception as e:
+            raise e
+
+    def egress_stats (self):
+        ''' sent, dropped and queued per subscriber and topic (empty unless egress is managed) '''
+        return self.egress.stats () if self.egress is not None else {}
+
+    def print_data (self,batch):
         ''' Pretty print '''
         try:
             self.logger.info ("**********************************")
             self.logger.info ("BrokerMW::proxy print")
             self.logger.info ("------------------------------")
-            self.logger.info ("     data: {}".format (data))
+            self.logger.info ("     messages: {}".format (len (batch)))
+            self.logger.info ("     topics: {}".format (sorted (set (str (self.ids.name (frames[0].bytes)) for frames in batch))))
             self.logger.info ("**********************************")
 
         except Exception as e:
@@ -279,4 +526,8 @@ class BrokerMW():
 
     def disable_event_loop (self):
         ''' disable event loop '''
-        self.handle_events = False
\ No newline at end of file
+        self.handle_events = False
+        self.stop_device ()
+        if self.replay is not None:
+            self.replay.stop ()
+            self.log.close ()
\ No newline at end of file
@@ -15,3 +15,861 @@
 # the role we are playing and any other common things that we need across
 # all our middleware objects. Make sure then to import this file in those files once
 # some content is added here that is needed by others. 
+
+import bisect  # for searching the ring
+import hashlib  # for the secure hash library
+import lzma  # batch compression
+import math  # for ceil
+import os  # for the ipc directory
+import struct  # for the topic ids
+import tempfile  # for the ipc directory
+import time  # for the monotonic clock
+import zlib  # batch compression
+import zmq  # ZMQ sockets
+
+try:
+  import zstandard  # zstd batch compression, if installed
+except ImportError:
+  zstandard = None
+
+# serialization logic shared by all the middleware objects
+from CS6381_MW import discovery_pb2
+from CS6381_MW import topic_pb2
+
+# The event loops hand the timeout returned by the appln upcalls to the poller.
+# When data keeps arriving on a socket, every poll returns early and a plain
+# relative timeout would keep getting restarted, so the upcall never fires.
+# These two helpers let an event loop remember the timeout as an absolute
+# deadline instead and hand the poller only what is left of it.
+def poll_deadline (timeout):
+  ''' absolute deadline for a timeout in msec (None means wait forever) '''
+  return None if timeout is None else time.monotonic () + timeout/1000.0
+
+def poll_remaining (deadline):
+  ''' msec left until the deadline, in the form the poller expects '''
+  if deadline is None:
+    return None
+  return max (0, math.ceil ((deadline - time.monotonic ()) * 1000))
+
+def deadline_expired (deadline):
+  ''' whether the appln should get its invoke_operation upcall now '''
+  return deadline is not None and time.monotonic () >= deadline
+
+# When the poller says a data socket is readable there are usually many more
+# messages queued behind the first. Taking them all (up to a budget, so the
+# other sockets still get their turn) spreads the cost of the poll and of the
+# upcall over the whole lot.
+def drain (socket, budget):
+  ''' up to budget multipart messages already waiting on a socket, without blocking '''
+  messages = []
+  recv = socket.recv_multipart
+  try:
+    while len (messages) < budget:
+      messages.append (recv (zmq.NOBLOCK, copy=False))
+  except zmq.Again:
+    pass
+  return messages
+
+##################################
+#       Publication scheduler
+#
+# Round k of publication is due at start + k/rate, worked out from k every
+# time rather than by adding up periods, so late wakeups never push the
+# schedule back. Rounds are tokens in a bucket that holds at most burst of
+# them: after a late wakeup up to burst overdue rounds go out back to back,
+# and if we are further behind than that the oldest ones are skipped. At
+# high rates a single wakeup typically finds several rounds due.
+##################################
+class PublicationScheduler ():
+
+  def __init__ (self, rate, burst=1):
+    if rate <= 0:
+      raise ValueError ("Publication rate must be positive, got {}".format (rate))
+    self.period = 1.0 / rate # seconds between rounds
+    self.burst = max (1, burst) # most rounds taken in one go
+    self.start_time = None # monotonic time round 0 is due
+    self.rounds = 0 # rounds handed out or skipped so far
+    self.skipped = 0 # rounds dropped because we were too far behind
+
+  def start (self, now=None):
+    self.start_time = time.monotonic () if now is None else now
+    self.rounds = 0
+    self.skipped = 0
+
+  def take (self, now=None):
+    ''' number of rounds to publish now '''
+    if now is None:
+      now = time.monotonic ()
+    due = int ((now - self.start_time) / self.period) + 1 - self.rounds
+    if due <= 0:
+      return 0
+    if due > self.burst:
+      self.skipped += due - self.burst
+      self.rounds += due - self.burst
+      due = self.burst
+    self.rounds += due
+    return due
+
+  def next_deadline (self):
+    ''' monotonic time the next round is due '''
+    return self.start_time + self.rounds * self.period
+
+  def timeout (self):
+    ''' msec until the next round, as an upcall returns it to the event loop '''
+    return max (0.0, (self.next_deadline () - time.monotonic ()) * 1000.0)
+
+##################################
+#       Hash ring
+#
+# The DHT places discovery nodes and topics on a ring of 2^bits positions by
+# the leading bits of their sha256. The broker tier shares the same ring: a
+# broker sits at the hash of its name and owns every topic whose hash falls
+# between its predecessor (exclusive) and itself (inclusive).
+##################################
+def ring_hash (key, bits=48):
+  ''' position of a string on a ring of 2^bits positions '''
+  hash_digest = hashlib.sha256 (bytes (key, "utf-8")).digest ()
+  return int.from_bytes (hash_digest[:bits // 8], "big")
+
+class BrokerRing ():
+
+  def __init__ (self, bits=48):
+    self.bits = bits
+    self.hashes = []  # sorted ring positions of the brokers
+    self.brokers = {}  # ring position -> (name, addr, port)
+
+  def __len__ (self):
+    return len (self.hashes)
+
+  def add (self, name, addr, port):
+    key = ring_hash (name, self.bits)
+    if key not in self.brokers:
+      bisect.insort (self.hashes, key)
+    self.brokers[key] = (name, addr, port)
+
+  def remove (self, name):
+    key = ring_hash (name, self.bits)
+    if key in self.brokers:
+      del self.brokers[key]
+      self.hashes.remove (key)
+
+  def members (self):
+    ''' (name, addr, port) of every broker in ring order '''
+    return [self.brokers[key] for key in self.hashes]
+
+  def owner (self, topic):
+    ''' (name, addr, port) of the broker owning a topic, None without brokers '''
+    if not self.hashes:
+      return None
+    index = bisect.bisect_left (self.hashes, ring_hash (topic, self.bits))
+    return self.brokers[self.hashes[index % len (self.hashes)]]
+
+  def owned (self, name, topics):
+    ''' the topics among the given ones that a broker owns '''
+    return [topic for topic in topics if self.owner (topic)[0] == name]
+
+##################################
+#       Connection manager
+#
+# Subscribers and the broker are told which publishers (or brokers) to talk
+# to over and over again. Connecting a ZMQ socket to an endpoint it is already
+# connected to opens a second connection, so the manager remembers where we
+# are connected and only connects or disconnects what changed.
+##################################
+class ConnectionManager ():
+
+  def __init__ (self, connect, disconnect):
+    self.connect = connect  # called with each endpoint to connect to
+    self.disconnect = disconnect  # called with each endpoint to drop
+    self.endpoints = {}  # name -> endpoint we are connected to
+
+  def __len__ (self):
+    return len (self.endpoints)
+
+  def update (self, endpoints):
+    ''' endpoints (name -> endpoint) is the whole set we should be connected to '''
+    return self.apply (endpoints, [name for name in self.endpoints if name not in endpoints])
+
+  def apply (self, added, removed):
+    ''' connect the name -> endpoint in added and drop the names in removed;
+    returns the endpoints connected and disconnected '''
+    connected = []
+    disconnected = []
+    for name in removed:
+      endpoint = self.endpoints.pop (name, None)
+      if endpoint is not None:
+        self.disconnect (endpoint)
+        disconnected.append (endpoint)
+    for name, endpoint in added.items ():
+      old_endpoint = self.endpoints.get (name)
+      if old_endpoint == endpoint:
+        continue
+      if old_endpoint is not None:
+        self.disconnect (old_endpoint)
+        disconnected.append (old_endpoint)
+      self.connect (endpoint)
+      connected.append (endpoint)
+      self.endpoints[name] = endpoint
+    return connected, disconnected
+
+##################################
+#       Transports
+#
+# Everybody listens on tcp and, unless told otherwise (-x), also on ipc, a
+# unix domain socket for peers on the same host, and inproc, for peers in the
+# same process and ZMQ context. The local endpoints are named after the tcp
+# address and port, which no two listeners share, and go to discovery in the
+# RegistrantInfo, which hands them on in its lookup responses. Whoever
+# connects picks the cheapest endpoint it can reach: inproc if the endpoint
+# is bound in its own context, ipc if the peer advertised the same IP address
+# as we did, and tcp otherwise.
+##################################
+LOCAL_TRANSPORTS = ("inproc", "ipc")  # cheapest first
+IPC_DIR = os.path.join (tempfile.gettempdir (), "cs6381")
+bound_inproc = {}  # inproc endpoint -> the context it is bound in
+
+def parse_transports (spec):
+  ''' the local transports to listen on besides tcp, e.g. inproc,ipc; tcp
+  alone (or nothing) means none '''
+  transports = set (name.strip () for name in spec.split (",") if name.strip ()) - {"tcp"}
+  unknown = transports - set (LOCAL_TRANSPORTS)
+  if unknown:
+    raise ValueError ("Unknown transports {}, choose from tcp,{}".format (sorted (unknown), ",".join (LOCAL_TRANSPORTS)))
+  if "ipc" in transports and not zmq.has ("ipc"):
+    # not on every platform
+    transports.discard ("ipc")
+  return [name for name in LOCAL_TRANSPORTS if name in transports]
+
+def local_endpoints (addr, port, transports):
+  ''' the local endpoints of whoever listens on tcp at addr:port '''
+  endpoints = []
+  for transport in transports:
+    if transport == "inproc":
+      endpoints.append ("inproc://{}-{}".format (addr, port))
+    elif transport == "ipc":
+      endpoints.append ("ipc://{}/{}-{}".format (IPC_DIR, addr, port))
+  return endpoints
+
+def bind_endpoints (socket, endpoints):
+  ''' bind a socket to every one of its endpoints '''
+  for endpoint in endpoints:
+    if endpoint.startswith ("ipc://"):
+      os.makedirs (IPC_DIR, exist_ok=True)
+    socket.bind (endpoint)
+    if endpoint.startswith ("inproc://"):
+      bound_inproc[endpoint] = socket.context
+
+def choose_endpoint (context, transports, our_addr, addr, port, endpoints=()):
+  ''' the cheapest of a peer's endpoints that we can reach from context, using
+  no local transports but the given ones '''
+  if "inproc" in transports:
+    for endpoint in endpoints:
+      if endpoint.startswith ("inproc://") and bound_inproc.get (endpoint) is context:
+        return endpoint
+  if "ipc" in transports and addr == our_addr:
+    for endpoint in endpoints:
+      if endpoint.startswith ("ipc://"):
+        return endpoint
+  return "tcp://{}:{}".format (addr, port)
+
+##################################
+#       Discovery message codec
+#
+# Every middleware used to allocate the nested message, fill it, allocate the
+# outer DiscoveryReq/DiscoveryResp and then CopyFrom the nested one into it.
+# The codec instead keeps one outer message per direction as a template,
+# clears it and fills the nested fields in place. Requests that never change
+# (IsReady, the two IsReady answers, a subscriber's lookup of its topic list)
+# are serialized once and the bytes are handed out from then on.
+#
+# Each middleware object owns its own codec. Decoding does not reuse a
+# message: with the upb protobuf runtime, parsing into a fresh message is
+# cheaper than clearing and refilling an old one (see mw_benchmark.py).
+##################################
+class DiscoveryCodec ():
+
+  # the empty IsReady request is the same for everyone
+  _isready_req = None
+
+  def __init__ (self):
+    self.req = discovery_pb2.DiscoveryReq ()  # template for outgoing requests
+    self.resp = discovery_pb2.DiscoveryResp ()  # template for outgoing responses
+    self.env = discovery_pb2.RelayEnvelope ()  # template for relay envelopes
+    self.lookup_cache = {}  # tuple of topics -> serialized lookup request
+    self.isready_resp_cache = {}  # status -> serialized isready response
+
+  ########################################
+  # requests sent by publishers, subscribers and the broker
+  ########################################
+  def register_req (self, role, name, addr, port, topiclist, msg_type=discovery_pb2.TYPE_REGISTER, qos=(), replay_port=None, codecs=(), predicates=(), endpoints=()):
+    ''' register (or deregister) request; qos is a subscriber's (topic, policy, hwm)
+    tuples, replay_port where a broker with a topic log takes replay requests,
+    codecs the compression codecs we can undo (or would use, preferred first),
+    predicates a subscriber's (topic, field, op, operand) tuples, endpoints the
+    local endpoints we listen on besides tcp '''
+    req = self.req
+    req.Clear ()
+    req.msg_type = msg_type
+    req.node_type = discovery_pb2.TYPE_INITIAL
+    register_req = req.register_req
+    register_req.role = role
+    info = register_req.info
+    info.id = name
+    if addr is not None:
+      info.addr = addr
+    if port is not None:
+      info.port = port
+    if replay_port is not None:
+      info.replay_port = replay_port
+    info.endpoints.extend (endpoints)
+    register_req.topiclist.extend (topiclist)
+    add = register_req.qos.add
+    for topic, policy, hwm in qos:
+      add (topic=topic or "", policy=policy, hwm=hwm)
+    register_req.codecs.extend (codecs)
+    add = register_req.predicates.add
+    for topic, field, op, operand in predicates:
+      add (topic=topic, field=field, op=op, operand=str (operand))
+    return req.SerializeToString ()
+
+  def isready_req (self):
+    ''' the IsReady request never changes so it is only ever serialized once '''
+    if DiscoveryCodec._isready_req is None:
+      req = discovery_pb2.DiscoveryReq ()
+      req.msg_type = discovery_pb2.TYPE_ISREADY
+      req.node_type = discovery_pb2.TYPE_INITIAL
+      req.isready_req.SetInParent ()
+      DiscoveryCodec._isready_req = req.SerializeToString ()
+    return DiscoveryCodec._isready_req
+
+  def lookup_req (self, topiclist, version=0):
+    ''' lookup request; a subscriber always asks about the same topics, and
+    the registry version it has only changes when the publishers do '''
+    key = (tuple (topiclist), version)
+    buf = self.lookup_cache.get (key)
+    if buf is None:
+      if len (self.lookup_cache) >= 16:
+        # older versions are never asked about again
+        self.lookup_cache.clear ()
+      req = self.req
+      req.Clear ()
+      req.msg_type = discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC
+      req.node_type = discovery_pb2.TYPE_INITIAL
+      req.lookup_req.topiclist.extend (topiclist)
+      req.lookup_req.version = version
+      buf = req.SerializeToString ()
+      self.lookup_cache[key] = buf
+    return buf
+
+  def lookall_req (self, version, page_size):
+    ''' lookup-all request for the changes since a registry version '''
+    req = self.req
+    req.Clear ()
+    req.msg_type = discovery_pb2.TYPE_LOOKUP_ALL_PUBS
+    req.node_type = discovery_pb2.TYPE_INITIAL
+    lookall_req = req.lookall_req
+    lookall_req.SetInParent ()
+    lookall_req.version = version
+    lookall_req.max_entries = page_size
+    return req.SerializeToString ()
+
+  ########################################
+  # responses sent by discovery
+  ########################################
+  def register_resp (self, status, reason, msg_type=discovery_pb2.TYPE_REGISTER, topic_ids=()):
+    ''' topic_ids are the (topic, id) of the registered topics '''
+    resp = self.resp
+    resp.Clear ()
+    resp.msg_type = msg_type
+    register_resp = resp.register_resp
+    register_resp.status = status
+    if reason is not None:
+      register_resp.reason = reason
+    add = register_resp.topic_ids.add
+    for topic, id in topic_ids:
+      add (topic=topic, id=id)
+    return resp.SerializeToString ()
+
+  def isready_resp (self, is_ready, codecs=None, filters=None):
+    ''' only two possible answers, each serialized once, unless the answer
+    carries the compression codecs (topic -> codecs) every subscriber can undo
+    or the subscribers' filters (name -> Predicates) '''
+    if codecs or filters:
+      resp = self.resp
+      resp.Clear ()
+      resp.msg_type = discovery_pb2.TYPE_ISREADY
+      resp.isready_resp.status = is_ready
+      add = resp.isready_resp.codecs.add
+      for topic, names in (codecs or {}).items ():
+        add (topic=topic, codecs=sorted (names))
+      add = resp.isready_resp.filters.add
+      for name, predicates in (filters or {}).items ():
+        add (subscriber=name, predicates=predicates)
+      return resp.SerializeToString ()
+    buf = self.isready_resp_cache.get (is_ready)
+    if buf is None:
+      resp = self.resp
+      resp.Clear ()
+      resp.msg_type = discovery_pb2.TYPE_ISREADY
+      resp.isready_resp.status = is_ready
+      resp.isready_resp.SetInParent ()
+      buf = resp.SerializeToString ()
+      self.isready_resp_cache[is_ready] = buf
+    return buf
+
+  def lookup_resp (self, publisherInfos, version=0, unchanged=False, topic_ids=(), endpoints=None):
+    ''' publisherInfos are (id, addr, port) tuples, added straight into the message;
+    a broker comes with a fourth element, the topics it serves, and a fifth, its
+    replay port (0 if it keeps no topic log); topic_ids are (topic, id) and
+    endpoints the local endpoints of each id that has any '''
+    resp = self.resp
+    resp.Clear ()
+    resp.msg_type = discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC
+    lookup_resp = resp.lookup_resp
+    lookup_resp.status = discovery_pb2.STATUS_SUCCESS
+    lookup_resp.version = version
+    lookup_resp.unchanged = unchanged
+    add = lookup_resp.publisherInfos.add
+    for info in publisherInfos:
+      if len (info) > 4 and info[4]:
+        add (id=info[0], addr=info[1], port=info[2], topiclist=info[3], replay_port=info[4])
+      elif len (info) > 3:
+        add (id=info[0], addr=info[1], port=info[2], topiclist=info[3])
+      else:
+        add (id=info[0], addr=info[1], port=info[2])
+    if endpoints:
+      self.add_endpoints (lookup_resp.publisherInfos, endpoints)
+    add = lookup_resp.topic_ids.add
+    for topic, id in topic_ids:
+      add (topic=topic, id=id)
+    return resp.SerializeToString ()
+
+  def lookall_resp (self, publisherInfos, removed, version, more, brokers=(), topic_ids=(), endpoints=None):
+    ''' one page of a publisher-set delta plus the broker tier, all as (id, addr, port);
+    a publisher comes with a fourth element, its topics; topic_ids are (topic, id)
+    and endpoints the local endpoints of each publisher that has any '''
+    resp = self.resp
+    resp.Clear ()
+    resp.msg_type = discovery_pb2.TYPE_LOOKUP_ALL_PUBS
+    lookall_resp = resp.lookall_resp
+    lookall_resp.status = discovery_pb2.STATUS_SUCCESS
+    lookall_resp.version = version
+    lookall_resp.more = more
+    lookall_resp.removed.extend (removed)
+    add = lookall_resp.publisherInfos.add
+    for info in publisherInfos:
+      if len (info) > 3:
+        add (id=info[0], addr=info[1], port=info[2], topiclist=info[3])
+      else:
+        add (id=info[0], addr=info[1], port=info[2])
+    if endpoints:
+      self.add_endpoints (lookall_resp.publisherInfos, endpoints)
+    add = lookall_resp.brokers.add
+    for name, addr, port in brokers:
+      add (id=name, addr=addr, port=port)
+    add = lookall_resp.topic_ids.add
+    for topic, id in topic_ids:
+      add (topic=topic, id=id)
+    return resp.SerializeToString ()
+
+  @staticmethod
+  def add_endpoints (infos, endpoints):
+    ''' endpoints is id -> the local endpoints of that entity '''
+    for info in infos:
+      info.endpoints.extend (endpoints.get (info.id, ()))
+
+  ########################################
+  # discovery to discovery relaying
+  ########################################
+  def relay_envelope (self, node_type, msg_type, key):
+    ''' envelope frame that goes in front of a relayed payload '''
+    env = self.env
+    env.Clear ()
+    env.node_type = node_type
+    env.msg_type = msg_type
+    if key is not None:
+      env.key = key
+    return env.SerializeToString ()
+
+  ########################################
+  # decoding
+  ########################################
+  def decode_req (self, buf):
+    ''' parse a DiscoveryReq (bytes or a buffer from a zmq frame) '''
+    return discovery_pb2.DiscoveryReq.FromString (buf)
+
+  def decode_resp (self, buf):
+    ''' parse a DiscoveryResp '''
+    return discovery_pb2.DiscoveryResp.FromString (buf)
+
+##################################
+#       Topic ids
+#
+# On the data path a topic goes by a 4 byte id rather than its name, which
+# with hierarchical names would otherwise travel with every message and be
+# what every SUB socket compares its subscriptions with. Being of fixed
+# width, a subscription to an id matches that one topic and no other.
+#
+# Discovery hands out the ids: publishers and subscribers get those of their
+# topics in the RegisterResp, subscribers those of the topics their wildcard
+# subscriptions stand for in the LookupPubByTopicResp and brokers those of
+# the publishers' topics in the LookupAllPubResp. An id is the 32 bit hash of
+# the name, so every discovery node, and every run, gives a topic the same
+# one (which keeps a broker's topic log valid); discovery refuses to register
+# a topic whose id another topic already has. The appln objects only ever
+# see names.
+##################################
+TOPIC_ID = struct.Struct (">I")  # the topic frame
+
+def topic_id (topic):
+  ''' the id discovery gives a topic '''
+  return ring_hash (topic, 32)
+
+def topic_frame (topic):
+  ''' the topic frame of a topic's messages '''
+  return TOPIC_ID.pack (topic_id (topic))
+
+class TopicIds ():
+  ''' the topics we know of by name, id and topic frame '''
+
+  def __init__ (self):
+    self.ids = {}  # name -> id
+    self.frames = {}  # name -> topic frame
+    self.names = {}  # topic frame -> name
+
+  def __contains__ (self, topic):
+    return topic in self.ids
+
+  def add (self, topic, id=None):
+    ''' learn the id of a topic, by default the one discovery gives it; raises
+    ValueError if another topic has it '''
+    if id is None:
+      id = topic_id (topic)
+    known = self.ids.get (topic)
+    if known is not None and known != id:
+      raise ValueError ("Topic {} has id {} already, not {}".format (topic, known, id))
+    frame = TOPIC_ID.pack (id)
+    other = self.names.get (frame)
+    if other is not None and other != topic:
+      raise ValueError ("Topics {} and {} would have the same id {}".format (topic, other, id))
+    self.ids[topic] = id
+    self.frames[topic] = frame
+    self.names[frame] = topic
+    return id
+
+  def update (self, topic_ids):
+    ''' the TopicId entries of a discovery response; returns the topics new to us '''
+    added = []
+    for entry in topic_ids:
+      if entry.topic not in self.ids:
+        self.add (entry.topic, entry.id)
+        added.append (entry.topic)
+    return added
+
+  def id (self, topic):
+    id = self.ids.get (topic)
+    return self.add (topic) if id is None else id
+
+  def frame (self, topic):
+    frame = self.frames.get (topic)
+    if frame is None:
+      self.add (topic)
+      frame = self.frames[topic]
+    return frame
+
+  def name (self, frame):
+    ''' the name of a topic frame, None if we do not know it '''
+    return self.names.get (bytes (frame))
+
+##################################
+#       Publication codec
+#
+# The data path sends every sample as two frames: the topic id (see above),
+# on which the SUB sockets filter, followed by a serialized Publication
+# (topic.proto). A batch of samples of one topic is sent as three frames: the
+# topic id, an encoding tag and the serialized PublicationBatch, compressed
+# if the tag says so (see Batch compression below).
+# The publisher side keeps one Publication as a template and the sequence
+# number of the samples it has sent so far, and learns the ids of its topics
+# from discovery; a topic it was not told about gets the id discovery would
+# give it.
+##################################
+BATCH_TAG = b"b"  # middle frame of a [topic, tag, PublicationBatch] message
+SNAPSHOT_TAG = b"s"  # second frame of a cached message replayed to a new subscriber
+
+class PublicationCodec ():
+
+  # which oneof member carries a value of a given python type
+  payload_fields = {str: "str_val", float: "double_val", int: "int_val", bytes: "bytes_val"}
+
+  def __init__ (self):
+    self.pub = topic_pb2.Publication ()  # template for outgoing samples
+    self.seq = 0  # sequence number of the last sample we encoded
+    self.topics = TopicIds ()  # ids of the topics we encode
+
+  def topic_frame (self, topic):
+    return self.topics.frame (topic)
+
+  def fill (self, pub, pub_id, topic_id, value, timestamp=None):
+    ''' number a sample and fill it into an empty Publication; the timestamp defaults to now '''
+    field = self.payload_fields.get (type (value))
+    if field is None:
+      raise ValueError ("Cannot publish a value of type {}".format (type (value).__name__))
+    self.seq += 1
+    pub.topic_id = topic_id
+    pub.pub_id = pub_id
+    pub.seq = self.seq
+    pub.timestamp = time.time_ns () if timestamp is None else timestamp
+    setattr (pub, field, value)
+
+  def encode (self, pub_id, topic, value, timestamp=None):
+    ''' the two frames of one sample '''
+    frame = self.topics.frame (topic)
+    pub = self.pub
+    pub.Clear ()
+    self.fill (pub, pub_id, self.topics.ids[topic], value, timestamp)
+    return [frame, pub.SerializeToString ()]
+
+  def size (self, pub_id, topic, value):
+    ''' the bytes a sample would take on the wire, without numbering it '''
+    pub = self.pub
+    pub.Clear ()
+    pub.topic_id = self.topics.id (topic)
+    pub.pub_id = pub_id
+    pub.seq = self.seq + 1
+    pub.timestamp = 1  # fixed64, so any time takes as much
+    setattr (pub, self.payload_fields[type (value)], value)
+    return len (self.topic_frame (topic)) + pub.ByteSize ()
+
+  @staticmethod
+  def decode (buf):
+    ''' parse the Publication frame (bytes or a buffer from a zmq frame) '''
+    return topic_pb2.Publication.FromString (buf)
+
+  @staticmethod
+  def decode_batch (buf):
+    ''' the samples of a PublicationBatch frame (uncompressed) '''
+    return topic_pb2.PublicationBatch.FromString (buf).pubs
+
+  @staticmethod
+  def value (pub):
+    ''' the payload in its natural type, None if there is none '''
+    field = pub.WhichOneof ("Payload")
+    return None if field is None else getattr (pub, field)
+
+##################################
+#       Last value cache
+#
+# Keeps the latest message (single sample or batch, frames as they were
+# sent) of every topic that went through. When a subscriber joins, it is
+# sent the cached messages of its topics right away instead of waiting for
+# the next publication. A replayed message carries the snapshot tag as its
+# second frame, [topic, tag, <the frames after the topic>], so receivers
+# can tell it from live data: whoever already had live data of the topic
+# drops it, and nobody counts its age as latency.
+##################################
+class LastValueCache ():
+
+  def __init__ (self):
+    self.values = {}  # topic (bytes) -> frames of its latest message
+
+  def put (self, topic, frames):
+    self.values[topic] = frames
+
+  def update (self, batch):
+    ''' messages received with copy=False, each a list of zmq frames '''
+    values = self.values
+    for frames in batch:
+      values[frames[0].bytes] = frames
+
+  @staticmethod
+  def tagged (frames):
+    ''' the frames with the snapshot tag put in, unless a publisher's cache already did '''
+    second = frames[1]
+    if len (second) == len (SNAPSHOT_TAG) and bytes (second) == SNAPSHOT_TAG:
+      return frames
+    return [frames[0], SNAPSHOT_TAG] + list (frames[1:])
+
+  def snapshot (self, prefix):
+    ''' tagged messages of every cached topic a subscription to prefix matches '''
+    return [self.tagged (frames) for topic, frames in self.values.items () if topic.startswith (prefix)]
+
+##################################
+#       Batch compression
+#
+# The values of a topic's batch look much alike, and between hosts it is
+# bandwidth rather than CPU that runs out, so a publisher may compress its
+# batches. A compressed batch travels as [topic, tag, compressed
+# PublicationBatch], the tag being the batch tag followed by the codec's
+# letter, so a receiver knows how to undo it without asking anyone; batches
+# below the publisher's threshold, or that do not get any smaller, go out as
+# they are. Which codec a publisher may use is settled through discovery:
+# every subscriber registers the codecs it can undo and, once the system is
+# ready, the IsReadyResp tells the publishers per topic what all of that
+# topic's subscribers have in common. zstd is only there when the zstandard
+# package is installed.
+##################################
+class Compression ():
+
+  def __init__ (self, name, letter, compress, decompress):
+    self.name = name
+    self.tag = BATCH_TAG + letter  # middle frame of a batch compressed with us
+    self.compress = compress  # bytes -> bytes
+    self.decompress = decompress  # bytes or buffer -> bytes
+
+COMPRESSION = {
+  "zlib": Compression ("zlib", b"z", zlib.compress, zlib.decompress),
+  "lzma": Compression ("lzma", b"x", lzma.compress, lzma.decompress),
+}
+if zstandard is not None:
+  COMPRESSION["zstd"] = Compression ("zstd", b"Z", zstandard.ZstdCompressor ().compress, zstandard.ZstdDecompressor ().decompress)
+
+# tag -> how to undo a batch sent with it, None if it is not compressed
+BATCH_TAGS = {BATCH_TAG: None}
+BATCH_TAGS.update ((compression.tag, compression) for compression in COMPRESSION.values ())
+
+def parse_compression (spec):
+  ''' "[topic=]codec,..." -> {topic or None: [codecs, preferred first]}, the
+  entries without a topic being for the topics that have none of their own '''
+  codecs = {}
+  for item in filter (None, (item.strip () for item in spec.split (","))):
+    topic, _, name = item.rpartition ("=")
+    if name not in ("zlib", "lzma", "zstd"):
+      raise ValueError ("Unknown compression {}".format (name))
+    entries = codecs.setdefault (topic or None, [])
+    # zstd without the zstandard package leaves the next preference
+    if name in COMPRESSION:
+      entries.append (name)
+  return codecs
+
+class CompressionStats ():
+  ''' per topic, bytes before and after compression and the CPU time spent on it '''
+
+  def __init__ (self):
+    self.topics = {}  # topic -> [batches, compressed ones, bytes before, bytes after, CPU ns]
+
+  def add (self, topic, raw, wire, cpu, compressed=True):
+    entry = self.topics.get (topic)
+    if entry is None:
+      entry = self.topics[topic] = [0, 0, 0, 0, 0]
+    entry[0] += 1
+    entry[1] += compressed
+    entry[2] += raw
+    entry[3] += wire
+    entry[4] += cpu
+
+  def summary (self):
+    ''' topic -> counts, ratio (bytes before / after) and CPU usec per batch '''
+    return {topic: {"batches": batches, "compressed": compressed, "raw_bytes": raw, "wire_bytes": wire,
+                    "ratio": raw / wire if wire else 1.0, "cpu_usec": cpu / 1000 / batches if batches else 0.0}
+            for topic, (batches, compressed, raw, wire, cpu) in self.topics.items ()}
+
+##################################
+#       Publication batcher
+#
+# Collects the samples of each topic into a PublicationBatch and hands back
+# the frames to send once a batch holds max_count samples, has grown past
+# max_bytes, or its first sample has waited linger msec. The sender is
+# expected to call expired () whenever it gets the chance and flush () when
+# it is done. Batches of topics with a Compression in compression are
+# compressed once they have at least compress_min bytes.
+##################################
+class PublicationBatcher ():
+
+  def __init__ (self, codec, max_count, max_bytes, linger, compress_min=0):
+    self.codec = codec  # numbers and fills the samples
+    self.max_count = max_count
+    self.max_bytes = max_bytes
+    self.linger = linger  # msec
+    self.compress_min = compress_min  # smaller batches go out uncompressed
+    self.compression = {}  # topic -> Compression its batches get
+    self.stats = CompressionStats ()  # of the topics in compression
+    self.batches = {}  # topic -> PublicationBatch being filled
+    self.sizes = {}  # topic -> approximate serialized size of its batch
+    self.deadlines = {}  # topic -> monotonic time by which its batch goes out
+
+  def add (self, pub_id, topic, value, timestamp=None):
+    ''' add one sample; returns the frames of its batch if that is now full, else None '''
+    batch = self.batches.get (topic)
+    if batch is None:
+      batch = topic_pb2.PublicationBatch ()
+      self.batches[topic] = batch
+      self.sizes[topic] = 0
+    if not batch.pubs:
+      self.deadlines[topic] = poll_deadline (self.linger)
+    pub = batch.pubs.add ()
+    self.codec.fill (pub, pub_id, self.codec.topics.id (topic), value, timestamp)
+    # the size of the sample plus its tag and length prefix
+    self.sizes[topic] += pub.ByteSize () + 3
+    if len (batch.pubs) >= self.max_count or self.sizes[topic] >= self.max_bytes:
+      return self.take (topic)
+    return None
+
+  def take (self, topic):
+    ''' the frames of a topic's batch, which starts over empty '''
+    batch = self.batches[topic]
+    tag = BATCH_TAG
+    buf = batch.SerializeToString ()
+    compression = self.compression.get (topic)
+    if compression is not None:
+      size = len (buf)
+      compressed = False
+      start = time.thread_time_ns ()
+      if size >= self.compress_min:
+        packed = compression.compress (buf)
+        # not worth it if it gets no smaller
+        if len (packed) < size:
+          tag, buf, compressed = compression.tag, packed, True
+      self.stats.add (topic, size, len (buf), time.thread_time_ns () - start, compressed)
+    frames = [self.codec.topic_frame (topic), tag, buf]
+    batch.Clear ()
+    self.sizes[topic] = 0
+    del self.deadlines[topic]
+    return frames
+
+  def expired (self):
+    ''' frames of every batch whose linger is up '''
+    return [self.take (topic) for topic, deadline in list (self.deadlines.items ()) if deadline_expired (deadline)]
+
+  def flush (self):
+    ''' frames of every batch that has anything in it '''
+    return [self.take (topic) for topic in list (self.deadlines)]
+
+  def next_deadline (self):
+    ''' when the next batch has to go out, None if nothing is waiting '''
+    return min (self.deadlines.values ()) if self.deadlines else None
+
+##################################
+#       Subscriber QoS
+#
+# A broker with managed egress (BrokerAppln -e managed, see Egress.py) keeps
+# a queue per subscriber and topic and lets the subscriber say, per topic,
+# what to do once it cannot keep up: drop the oldest queued sample (the
+# default), drop the newest, or conflate to only the latest value. The
+# subscriber puts its QoS (SubscriberAppln -Q) in its RegisterReq, which it
+# sends to discovery and, over a DEALER socket, to every broker it connects
+# to.
+##################################
+QOS_POLICIES = {
+  "drop-oldest": discovery_pb2.QOS_DROP_OLDEST,
+  "drop-newest": discovery_pb2.QOS_DROP_NEWEST,
+  "conflate": discovery_pb2.QOS_CONFLATE,
+}
+
+def parse_qos (spec):
+  ''' "[topic=]policy[:hwm],..." as (topic, policy, hwm) tuples; an entry
+  without a topic (None) is the default for all our topics '''
+  qos = []
+  for entry in spec.split (","):
+    entry = entry.strip ()
+    if not entry:
+      continue
+    topic, _, rest = entry.rpartition ("=")
+    name, _, hwm = rest.partition (":")
+    if name not in QOS_POLICIES:
+      raise ValueError ("Unknown QoS policy {}, choose from {}".format (name, ", ".join (QOS_POLICIES)))
+    # without an hwm (0) the broker's own applies
+    if hwm and int (hwm) < 1:
+      raise ValueError ("Bad QoS hwm {} in {}, must be at least 1".format (hwm, entry))
+    qos.append ((topic or None, QOS_POLICIES[name], int (hwm or 0)))
+  return qos
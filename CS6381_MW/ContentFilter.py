@@ -0,0 +1,173 @@
+###############################################
+#
+# Purpose: Content based filtering of samples by predicates subscribers
+# register along with their topics
+#
+###############################################
+
+# A SUB socket only filters on the topic prefix, so a subscriber that only
+# wants temperature > 50 would otherwise get, decode and drop every sample.
+# Subscribers instead register predicates, field op operand, on their
+# topics (SubscriberAppln -P "temperature>50"); all of a subscriber's
+# predicates on a topic have to hold for it to want a sample. The fields are
+# the sample's value and the pub_id of its publisher, the operators ==, !=,
+# <, <=, > and >=, and an operand is a number or else a string. A value
+# only satisfies predicates whose operand is of its own kind, so
+# "weather>10" is never true.
+#
+# Once the system is ready, discovery hands every publisher (and broker)
+# the predicates of the topics whose subscribers all filter. The publisher
+# then only sends a sample that some subscriber wants, and a broker with
+# managed egress queues a sample only for the subscribers that want it. A
+# subscriber still applies its own predicates to whatever reaches it, as a
+# sample sent for one subscriber goes to all of a topic's subscribers over
+# a PUB socket.
+#
+# The PredicateIndex keeps, per topic and field, the predicates of all
+# filters with the operands of each operator sorted, so a value finds every
+# predicate it satisfies with a bisect per operator instead of trying each
+# predicate in turn; a filter matches once all of its predicates were found.
+
+import bisect # for the sorted operands
+import re # for parsing predicates
+
+OPERATORS = ("==", "!=", "<", "<=", ">", ">=")
+FIELDS = ("value", "pub_id")
+
+PREDICATE = re.compile (r"^([^.<>=!]+?)(?:\.(\w+))?\s*(==|!=|<=|>=|<|>)\s*(.+)$")
+
+def literal (text):
+  ''' an operand: int, float, or else the string itself '''
+  for convert in (int, float):
+    try:
+      return convert (text)
+    except ValueError:
+      pass
+  return text
+
+def parse_predicates (spec):
+  ''' "topic[.field]op operand,..." as (topic, field, op, operand) tuples '''
+  predicates = []
+  for item in filter (None, (item.strip () for item in spec.split (","))):
+    match = PREDICATE.match (item)
+    if match is None:
+      raise ValueError ("Cannot parse predicate {}".format (item))
+    topic, field, op, operand = match.groups ()
+    field = field or "value"
+    if field not in FIELDS:
+      raise ValueError ("Cannot filter on {}, choose from {}".format (field, ", ".join (FIELDS)))
+    predicates.append ((topic.strip (), field, op, literal (operand.strip ())))
+  return predicates
+
+def kind (value):
+  ''' which operands a value is compared with: str, float (any number) or None '''
+  if isinstance (value, str):
+    return str
+  if isinstance (value, (int, float)):
+    return float
+  return None
+
+##################################
+#       One field of one topic
+##################################
+class FieldIndex ():
+
+  def __init__ (self, predicates):
+    ''' predicates are (op, operand, name of the filter) with operands of one kind '''
+    self.eq = {} # operand -> names
+    self.ne = [] # (operand, name)
+    self.ordered = {} # op -> (sorted operands, names in the same order)
+    ordered = {}
+    for op, operand, name in predicates:
+      if op == "==":
+        self.eq.setdefault (operand, []).append (name)
+      elif op == "!=":
+        self.ne.append ((operand, name))
+      else:
+        ordered.setdefault (op, []).append ((operand, name))
+    for op, entries in ordered.items ():
+      entries.sort (key=lambda entry: entry[0])
+      self.ordered[op] = ([operand for operand, name in entries], [name for operand, name in entries])
+
+  def satisfied (self, value):
+    ''' the filter names of the predicates the value satisfies, one per predicate '''
+    names = list (self.eq.get (value, ()))
+    for operand, name in self.ne:
+      if value != operand:
+        names.append (name)
+    for op, (operands, names_of) in self.ordered.items ():
+      if op == ">":
+        # every operand below the value
+        names.extend (names_of[:bisect.bisect_left (operands, value)])
+      elif op == ">=":
+        names.extend (names_of[:bisect.bisect_right (operands, value)])
+      elif op == "<":
+        # every operand above the value
+        names.extend (names_of[bisect.bisect_right (operands, value):])
+      else:
+        names.extend (names_of[bisect.bisect_left (operands, value):])
+    return names
+
+##################################
+#       One topic
+##################################
+class TopicIndex ():
+
+  def __init__ (self, filters):
+    ''' filters maps a name to its set of (field, op, operand) '''
+    self.need = {name: len (predicates) for name, predicates in filters.items ()}
+    grouped = {}
+    for name, predicates in filters.items ():
+      for field, op, operand in predicates:
+        grouped.setdefault ((field, kind (operand)), []).append ((op, operand, name))
+    self.fields = [(field, of_kind, FieldIndex (predicates)) for (field, of_kind), predicates in grouped.items ()]
+
+  def matching (self, value, pub_id):
+    hits = {}
+    for field, of_kind, index in self.fields:
+      operand = value if field == "value" else pub_id
+      if kind (operand) is of_kind:
+        for name in index.satisfied (operand):
+          hits[name] = hits.get (name, 0) + 1
+    need = self.need
+    return {name for name, count in hits.items () if count == need[name]}
+
+##################################
+#       All topics
+##################################
+class PredicateIndex ():
+
+  def __init__ (self):
+    self.filters = {} # topic -> name -> set of (field, op, operand)
+    self.topics = {} # topic -> its TopicIndex
+
+  def __len__ (self):
+    return len (self.topics)
+
+  def add (self, name, topic, predicates):
+    ''' the (field, op, operand) predicates of a filter (say a subscriber) on a topic '''
+    self.filters.setdefault (topic, {})[name] = set (predicates)
+    self.topics[topic] = TopicIndex (self.filters[topic])
+
+  def remove (self, name):
+    for topic in list (self.filters):
+      filters = self.filters[topic]
+      if filters.pop (name, None) is not None:
+        if filters:
+          self.topics[topic] = TopicIndex (filters)
+        else:
+          del self.filters[topic]
+          del self.topics[topic]
+
+  def filtered (self, topic):
+    ''' whether the samples of a topic are filtered at all '''
+    return topic in self.topics
+
+  def has (self, name, topic):
+    ''' whether a filter has predicates on a topic '''
+    return name in self.filters.get (topic, ())
+
+  def matching (self, topic, value, pub_id):
+    ''' names of the filters that want a sample, None if the topic is not filtered '''
+    index = self.topics.get (topic)
+    return None if index is None else index.matching (value, pub_id)
@@ -21,6 +21,9 @@ import zmq  # ZMQ sockets
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
+from CS6381_MW.Common import DiscoveryCodec
+from CS6381_MW.Common import parse_transports, local_endpoints, bind_endpoints, choose_endpoint
+from CS6381_MW.LogUtil import Lazy
 #from CS6381_MW import topic_pb2  # you will need this eventually
 
 class DiscoveryMW():
@@ -29,13 +32,16 @@ class DiscoveryMW():
         self.rep = None # will be a ZMQ REP socket
         self.req = [] # will be a ZMQ REQ socket
         self.poller = None # used to wait on incoming replies
+        self.codec = DiscoveryCodec () # builds and parses our discovery messages
         self.addr = None # our advertised IP address
         self.port = None # port num
+        self.context = None # the ZMQ context
+        self.transports = [] # the local transports we listen and connect on besides tcp
         self.upcall_obj = None # handle to appln obj to handle appln-specific data
         self.handle_events = True # in general we keep going thru the event loop
         self.m=48  #hash_bit
 
-    def configure (self, addr, port):
+    def configure (self, addr, port, transports="inproc,ipc"):
         ''' Initialize the object '''
 
         try:
@@ -45,10 +51,12 @@ class DiscoveryMW():
             # First retrieve our advertised IP addr and the publication port num
             self.port = port
             self.addr = addr
+            self.transports = parse_transports (transports)
 
             # Next get the ZMQ context
             self.logger.debug ("DiscoveryMW::configure - obtain ZMQ context")
-            context = zmq.Context ()  # returns a singleton object
+            context = zmq.Context.instance ()  # returns a singleton object
+            self.context = context
 
             # get the ZMQ poller object
             self.logger.debug ("DiscoveryMW::configure - obtain the poller")
@@ -69,6 +77,8 @@ class DiscoveryMW():
             # tcp:// followed by IP addr:port number.
             bind_str = "tcp://"+self.addr+":" + str(self.port)
             self.rep.bind (bind_str)
+            # and on the local transports, for the nodes that share our host
+            bind_endpoints (self.rep, local_endpoints (self.addr, self.port, self.transports))
             self.logger.info ("DiscoveryMW::configure completed")
 
         except Exception as e:
@@ -79,7 +89,11 @@ class DiscoveryMW():
             self.logger.info ("DiscoveryMW::connect_disc - connect to finger node {}".format(discaddr))
             self.logger.debug ("DiscoveryMW::connect_disc - connect to the disc socket")
 
-            connect_string = "tcp://" + str(discaddr)
+            # a node on our host is reached over ipc; every node of the DHT
+            # is expected to listen on the same local transports as we do
+            addr, port = str(discaddr).rsplit (":", 1)
+            connect_string = choose_endpoint (self.context, self.transports, self.addr, addr, port, local_endpoints (addr, port, self.transports))
+            self.logger.debug ("DiscoveryMW::connect_disc - over {}".format (connect_string))
             self.req[index].connect (connect_string)
  
             self.logger.debug ("DiscoveryMW::connect_disc complete")
@@ -94,13 +108,13 @@ class DiscoveryMW():
                 events = dict (self.poller.poll (timeout=timeout))
                 if not events:
                     timeout = self.upcall_obj.invoke_operation ()
-                elif self.rep in events:
+                    continue
+                # a request and replies from finger nodes can show up together
+                if self.rep in events:
                     timeout = self.handle_request ()
                 for i in range (len (self.req)):
                     if self.req[i] in events:
                         timeout = self.handle_reply (i)
-                else:
-                    raise Exception ("Unknown event after poll")
             self.logger.info ("DiscoveryMW::event_loop - out of the event loop")
         except Exception as e:
             raise e
@@ -108,28 +122,23 @@ class DiscoveryMW():
     def handle_request (self):
         try:
             self.logger.info ("DiscoveryMW::handle_request")
-            bytesRcvd = self.rep.recv ()
-            disc_req = discovery_pb2.DiscoveryReq ()
-            disc_req.ParseFromString (bytesRcvd)
-            if(disc_req.dht_type==discovery_pb2.TYPE_SUCCESSOR):
-                if (disc_req.msg_type == discovery_pb2.TYPE_REGISTER):
-                    timeout = self.upcall_obj.register_request (disc_req.register_req)
-                elif (disc_req.msg_type == discovery_pb2.TYPE_ISREADY):
-                    timeout = self.upcall_obj.isready_request (disc_req.isready_req)
-                elif (disc_req.msg_type == discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC):
-                    timeout = self.upcall_obj.lookup_request (disc_req.lookup_req)
-                elif (disc_req.msg_type == discovery_pb2.TYPE_LOOKUP_ALL_PUBS):
-                    timeout = self.upcall_obj.lookall_request (disc_req.lookall_req)
-            elif(disc_req.dht_type==discovery_pb2.TYPE_RELAY):
-                if (disc_req.msg_type == discovery_pb2.TYPE_REGISTER or disc_req.msg_type == discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC):
-                    timeout = self.upcall_obj.chord_algurithm (disc_req.register_req, disc_req.key)
-                elif (disc_req.msg_type == discovery_pb2.TYPE_ISREADY):
-                    timeout = self.upcall_obj.isready_iterate_chord (disc_req.isready_req, disc_req.key)
-                elif (disc_req.msg_type == discovery_pb2.TYPE_LOOKUP_ALL_PUBS):
-                    timeout = self.upcall_obj.lookall_iterate_chord (disc_req.lookall_req, disc_req.key)
-            elif(disc_req.dht_type==discovery_pb2.TYPE_INITIAL):
+            # clients send a single DiscoveryReq frame; other discovery nodes send
+            # an envelope frame followed by the nested request they are relaying
+            frames = self.rep.recv_multipart (copy=False)
+            if len (frames) == 2:
+                return self.handle_relayed (frames[0], frames[1])
+
+            disc_req = self.codec.decode_req (frames[0].buffer)
+            if(disc_req.node_type==discovery_pb2.TYPE_SUCCESSOR):
+                content = disc_req.WhichOneof ("Content")
+                if content is None:
+                    raise ValueError ("Request carries no content")
+                timeout = self.dispatch_local (disc_req.msg_type, getattr (disc_req, content))
+            elif(disc_req.node_type==discovery_pb2.TYPE_INITIAL):
                 if (disc_req.msg_type == discovery_pb2.TYPE_REGISTER):
                     timeout = self.upcall_obj.register_request_encode (disc_req.register_req)
+                elif (disc_req.msg_type == discovery_pb2.TYPE_DEREGISTER):
+                    timeout = self.upcall_obj.deregister_request_encode (disc_req.register_req)
                 elif (disc_req.msg_type == discovery_pb2.TYPE_ISREADY):
                     timeout = self.upcall_obj.isready_request_encode (disc_req.isready_req)
                 elif (disc_req.msg_type == discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC):
@@ -142,105 +151,126 @@ class DiscoveryMW():
         except Exception as e:
             raise e
 
+    def handle_relayed (self, envelope_frame, payload):
+        ''' a request relayed by another discovery node '''
+        try:
+            envelope = discovery_pb2.RelayEnvelope ()
+            envelope.ParseFromString (envelope_frame.bytes)
+            if(envelope.node_type==discovery_pb2.TYPE_SUCCESSOR):
+                # we own the key, so only now is the payload decoded
+                return self.dispatch_local (envelope.msg_type, self.decode_payload (envelope.msg_type, payload))
+            elif(envelope.node_type==discovery_pb2.TYPE_RELAY):
+                if (envelope.msg_type == discovery_pb2.TYPE_REGISTER or envelope.msg_type == discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC):
+                    # routing only looks at the key; the payload frame goes on untouched
+                    return self.upcall_obj.chord_algurithm (envelope.msg_type, payload, envelope.key)
+                elif (envelope.msg_type == discovery_pb2.TYPE_ISREADY):
+                    # every hop adds its own counts, so this one has to be decoded
+                    return self.upcall_obj.isready_iterate_chord (self.decode_payload (envelope.msg_type, payload), envelope.key)
+                elif (envelope.msg_type == discovery_pb2.TYPE_LOOKUP_ALL_PUBS):
+                    return self.upcall_obj.lookall_iterate_chord (self.decode_payload (envelope.msg_type, payload), envelope.key)
+            raise ValueError ("Unrecognized relayed message")
+        except Exception as e:
+            raise e
+
+    def decode_payload (self, msg_type, payload):
+        ''' parse the nested request carried in a relayed payload frame '''
+        if (msg_type == discovery_pb2.TYPE_REGISTER or msg_type == discovery_pb2.TYPE_DEREGISTER):
+            inner = discovery_pb2.RegisterReq ()
+        elif (msg_type == discovery_pb2.TYPE_ISREADY):
+            inner = discovery_pb2.IsReadyReq ()
+        elif (msg_type == discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC):
+            inner = discovery_pb2.LookupPubByTopicReq ()
+        elif (msg_type == discovery_pb2.TYPE_LOOKUP_ALL_PUBS):
+            inner = discovery_pb2.LookupAllPubReq ()
+        else:
+            raise ValueError ("Unrecognized relayed message")
+        inner.ParseFromString (payload.buffer)
+        return inner
+
+    def dispatch_local (self, msg_type, inner):
+        ''' hand a request that this node owns to the appln '''
+        if (msg_type == discovery_pb2.TYPE_REGISTER):
+            return self.upcall_obj.register_request (inner)
+        elif (msg_type == discovery_pb2.TYPE_DEREGISTER):
+            return self.upcall_obj.deregister_request (inner)
+        elif (msg_type == discovery_pb2.TYPE_ISREADY):
+            return self.upcall_obj.isready_request (inner)
+        elif (msg_type == discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC):
+            return self.upcall_obj.lookup_request (inner)
+        elif (msg_type == discovery_pb2.TYPE_LOOKUP_ALL_PUBS):
+            return self.upcall_obj.lookall_request (inner)
+        raise ValueError ("Unrecognized request message")
+
     def handle_reply (self, index):
         try:
             self.logger.info ("DiscoveryMW::handle_reply")
-            bytesRcvd = self.req[index].recv ()
-            # relay response here
+            # relay the reply back to whoever asked us without copying it into
+            # a bytes object of our own
+            frame = self.req[index].recv (copy=False)
             self.logger.debug ("DiscoveryMW::transmit DHT data")
-            self.rep.send(bytesRcvd)
+            self.rep.send (frame, copy=False)
             return None
         except Exception as e:
             raise e
 
-    def relay_register_req(self,index,node_type,key,register_req):
-        self.logger.info ("DiscoveryMW::relay_chord_req")
+    def send_relay (self, index, node_type, msg_type, key, payload):
+        ''' send an envelope plus payload (bytes or a received frame) to a finger node '''
+        self.req[index].send (self.codec.relay_envelope (node_type, msg_type, key), zmq.SNDMORE)
+        self.req[index].send (payload, copy=False)
 
-        self.logger.debug ("DiscoveryMW::relay_chord_req - build the outer DiscoveryReq message")
-        disc_req = discovery_pb2.DiscoveryReq ()  # allocate
-        disc_req.node_type=node_type
-        disc_req.msg_type = discovery_pb2.TYPE_REGISTER
-        disc_req.key=key
-        disc_req.register_req.CopyFrom (register_req)
-        self.logger.debug ("DiscoveryMW::send DHT register request - done building the outer message")
-
-        buf2send = disc_req.SerializeToString ()
-        self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+    def relay_register_req(self,index,node_type,msg_type,key,payload):
+        ''' forward a relayed register/lookup payload frame one hop further '''
+        self.logger.info ("DiscoveryMW::relay_chord_req")
 
-        # now send this to our discovery service
-        self.logger.debug ("DiscoveryMW::end DHT register request - send stringified buffer")
-        self.req[index].send (buf2send)  # we use the "send" method of ZMQ that sends the bytes
+        # only the envelope is new; the payload frame we received goes out as is
+        self.logger.debug ("DiscoveryMW::relay_chord_req - forward to finger {}".format (index))
+        self.send_relay (index, node_type, msg_type, key, payload)
 
         # now go to our event loop to receive a response to this request
-        self.logger.info ("DiscoveryMW::end relay_chord_req - sent response message")
+        self.logger.info ("DiscoveryMW::end relay_chord_req - relayed request")
 
-    def relay_isready_req(self,pubnum,subnum,broker,node_type,key):
+    def relay_isready_req(self,pubnum,subnum,broker,brokernum,node_type,key):
         self.logger.info ("DiscoveryMW::relay_isready_req")
 
-        self.logger.debug ("DiscoveryMW::relay_isready_req - populate the nested IsReady msg")
+        self.logger.debug ("DiscoveryMW::relay_isready_req - populate the IsReady msg")
         isready_req = discovery_pb2.IsReadyReq ()  # allocate 
         isready_req.pubnum=pubnum
         isready_req.subnum=subnum
         isready_req.broker=broker
-        self.logger.debug ("DiscoveryMW::relay_isready_req - done populating nested IsReady msg")
+        isready_req.brokernum=brokernum
+        self.logger.debug ("DiscoveryMW::relay_isready_req - done populating IsReady msg")
 
-        self.logger.debug ("DiscoveryMW::relay DHT request - build the outer DiscoveryReq message")
-        disc_req = discovery_pb2.DiscoveryReq ()  # allocate
-        disc_req.node_type=node_type
-        disc_req.msg_type = discovery_pb2.TYPE_ISREADY
-        disc_req.isready_req.CopyFrom (isready_req)
-        self.logger.debug ("DiscoveryMW::send DHT register request - done building the outer message")
-
-        buf2send = disc_req.SerializeToString ()
-        self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
-
-        # now send this to our discovery service
-        self.logger.debug ("DiscoveryMW::end DHT register request - send stringified buffer")
-        self.req[0].send (buf2send)  # we use the "send" method of ZMQ that sends the bytes
+        # now send this to our successor
+        self.logger.debug ("DiscoveryMW::relay_isready_req - send envelope and payload")
+        self.send_relay (0, node_type, discovery_pb2.TYPE_ISREADY, key, isready_req.SerializeToString ())
 
         # now go to our event loop to receive a response to this request
-        self.logger.info ("DiscoveryMW::isready_relay_req - sent response message")
+        self.logger.info ("DiscoveryMW::isready_relay_req - relayed request")
 
     def send_chord_register_req(self,index,node_type,hash_value,register_req,topic):
         self.logger.info ("DiscoveryMW::send DHT register request")
 
-        self.logger.debug ("DiscoveryMW::send DHT register request - build the outer DiscoveryReq message")
-        disc_req = discovery_pb2.DiscoveryReq ()  # allocate
-        disc_req.msg_type=discovery_pb2.TYPE_REGISTER
-        disc_req.node_type=node_type
-        disc_req.key=hash_value
-        register_req.topiclist=topic
-        disc_req.register_req.CopyFrom (register_req)
-        self.logger.debug ("DiscoveryMW::send DHT register request - done building the outer message")
-
-        buf2send = disc_req.SerializeToString ()
-        self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+        # the first hop is the only one that encodes the payload; every later hop
+        # forwards these bytes unchanged
+        self.logger.debug ("DiscoveryMW::send DHT register request - encode payload for topic {}".format (topic))
+        register_req.topiclist[:]=[topic]
+        buf2send = register_req.SerializeToString ()
 
         # now send this to our discovery service
-        self.logger.debug ("DiscoveryMW::end DHT register request - send stringified buffer")
-        self.req[index].send (buf2send)  # we use the "send" method of ZMQ that sends the bytes
+        self.logger.debug ("DiscoveryMW::end DHT register request - send envelope and payload")
+        self.send_relay (index, node_type, discovery_pb2.TYPE_REGISTER, hash_value, buf2send)
 
         # now go to our event loop to receive a response to this request
-        self.logger.info ("DiscoveryMW::end DHT register request - sent response message")
+        self.logger.info ("DiscoveryMW::end DHT register request - sent request")
 
-    def send_register_resp(self,status,reason):
+    def send_register_resp(self,status,reason,msg_type=discovery_pb2.TYPE_REGISTER,topic_ids=()):
+        ''' topic_ids are the (topic, id) of the registered topics '''
         self.logger.info ("DiscoveryMW::send register response")
-        register_resp=discovery_pb2.RegisterResp ()
-        register_resp.status=status
-        if reason is not None:
-            register_resp.reason=reason
-
-        # Finally, build the outer layer DiscoveryResp Message
-        self.logger.debug ("DiscoveryMW::register response - build the outer DiscoveryResp message")
-        disc_resp = discovery_pb2.DiscoveryResp ()  # allocate
-        disc_resp.msg_type = discovery_pb2.TYPE_REGISTER  # set message type
-        # It was observed that we cannot directly assign the nested field here.
-        # A way around is to use the CopyFrom method as shown
-        disc_resp.register_resp.CopyFrom (register_resp)
-        self.logger.debug ("DiscoveryMW::register response - done building the outer message")
-    
-        buf2send = disc_resp.SerializeToString ()
-        self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+
+        # the codec fills the nested RegisterResp in place in its DiscoveryResp
+        self.logger.debug ("DiscoveryMW::register response - build the DiscoveryResp message")
+        buf2send = self.codec.register_resp (status, reason, msg_type, topic_ids)
+        self.logger.debug (Lazy ("Stringified serialized buf = {}", buf2send))
 
         # now send this to our discovery service
         self.logger.debug ("DiscoveryMW::register response - send stringified buffer")
@@ -249,23 +279,14 @@ class DiscoveryMW():
         # now go to our event loop to receive a response to this request
         self.logger.info ("DiscoveryMW::register response - sent response message")
 
-    def send_isready_resp(self,is_ready):
+    def send_isready_resp(self,is_ready,codecs=None,filters=None):
+        ''' codecs maps a topic to the compression codecs all its subscribers can
+        undo, filters a subscriber to its Predicates on topics that are filtered '''
         self.logger.info ("DiscoveryMW::send isready response")
-        isready_resp=discovery_pb2.IsReadyResp ()
-        isready_resp.status=is_ready
-        
 
-        # Finally, build the outer layer DiscoveryResp Message
-        self.logger.debug ("DiscoveryMW::isready response - build the outer DiscoveryResp message")
-        disc_resp = discovery_pb2.DiscoveryResp ()  # allocate
-        disc_resp.msg_type = discovery_pb2.TYPE_ISREADY  # set message type
-        # It was observed that we cannot directly assign the nested field here.
-        # A way around is to use the CopyFrom method as shown
-        disc_resp.isready_resp.CopyFrom (isready_resp)
-        self.logger.debug ("DiscoveryMW::isready response - done building the outer message")
-    
-        buf2send = disc_resp.SerializeToString ()
-        self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+        # without codecs or filters there are only two possible answers and
+        # the codec keeps the bytes of both
+        buf2send = self.codec.isready_resp (is_ready, codecs, filters)
 
         # now send this to our discovery service
         self.logger.debug ("DiscoveryMW::isready response - send stringified buffer")
@@ -274,29 +295,15 @@ class DiscoveryMW():
         # now go to our event loop to receive a response to this request
         self.logger.info ("DiscoveryMW::isready response - sent response message")
 
-    def send_lookup_resp(self,publisherInfos):
+    def send_lookup_resp(self,publisherInfos,version=0,unchanged=False,topic_ids=(),endpoints=None):
+        ''' publisherInfos are (id, addr, port) tuples, with the topics served added for a broker;
+        topic_ids the (topic, id) of the topics asked about, endpoints id -> local endpoints '''
         self.logger.info ("DiscoveryMW::send lookup response")
-        lookup_resp=discovery_pb2.LookupPubByTopicResp ()
-        lookup_resp.status=discovery_pb2.STATUS_SUCCESS
-        
-        for publisherInfo in publisherInfos:
-            newPublisherInfo=discovery_pb2.RegistrantInfo()
-            newPublisherInfo.id=publisherInfo.id
-            newPublisherInfo.addr=publisherInfo.addr
-            newPublisherInfo.port=publisherInfo.port
-            lookup_resp.publisherInfos.append(newPublisherInfo)
-
-        # Finally, build the outer layer DiscoveryResp Message
-        self.logger.debug ("DiscoveryMW::lookup response - build the outer DiscoveryResp message")
-        disc_resp = discovery_pb2.DiscoveryResp ()  # allocate
-        disc_resp.msg_type = discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC  # set message type
-        # It was observed that we cannot directly assign the nested field here.
-        # A way around is to use the CopyFrom method as shown
-        disc_resp.lookup_resp.CopyFrom (lookup_resp)
-        self.logger.debug ("DiscoveryMW::lookup response - done building the outer message")
-    
-        buf2send = disc_resp.SerializeToString ()
-        self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+
+        # each publisher entry is created once, directly inside the response
+        self.logger.debug ("DiscoveryMW::lookup response - build the DiscoveryResp message")
+        buf2send = self.codec.lookup_resp (publisherInfos, version, unchanged, topic_ids, endpoints)
+        self.logger.debug (Lazy ("Stringified serialized buf = {}", buf2send))
 
         # now send this to our discovery service
         self.logger.debug ("DiscoveryMW::lookup response - send stringified buffer")
@@ -305,29 +312,14 @@ class DiscoveryMW():
         # now go to our event loop to receive a response to this request
         self.logger.info ("DiscoveryMW::lookup response - sent response message")
 
-    def send_lookall_resp(self,publisherInfos):
+    def send_lookall_resp(self,publisherInfos,removed,version,more,brokers=(),topic_ids=(),endpoints=None):
+        ''' publisherInfos is one page of (id, addr, port, topics) tuples, brokers the whole
+        broker tier, topic_ids the (topic, id) of the publishers' topics, endpoints
+        id -> local endpoints '''
         self.logger.info ("DiscoveryMW::send lookall response")
-        lookall_resp=discovery_pb2.LookupAllPubResp ()
-        lookall_resp.status=discovery_pb2.STATUS_SUCCESS
-        
-        for publisherInfo in publisherInfos:
-            newPublisherInfo=discovery_pb2.RegistrantInfo()
-            newPublisherInfo.id=publisherInfo.id
-            newPublisherInfo.addr=publisherInfo.addr
-            newPublisherInfo.port=publisherInfo.port
-            lookall_resp.publisherInfos.append(newPublisherInfo)
-
-        # Finally, build the outer layer DiscoveryResp Message
-        self.logger.debug ("DiscoveryMW::lookall response - build the outer DiscoveryResp message")
-        disc_resp = discovery_pb2.DiscoveryResp ()  # allocate
-        disc_resp.msg_type = discovery_pb2.TYPE_LOOKUP_ALL_PUBS  # set message type
-        # It was observed that we cannot directly assign the nested field here.
-        # A way around is to use the CopyFrom method as shown
-        disc_resp.lookall_resp.CopyFrom (lookall_resp)
-        self.logger.debug ("DiscoveryMW::lookall response - done building the outer message")
-    
-        buf2send = disc_resp.SerializeToString ()
-        self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+
+        self.logger.debug ("DiscoveryMW::lookall response - build the DiscoveryResp message with {} publishers".format (len (publisherInfos)))
+        buf2send = self.codec.lookall_resp (publisherInfos, removed, version, more, brokers, topic_ids, endpoints)
 
         # now send this to our discovery service
         self.logger.debug ("DiscoveryMW::lookall response - send stringified buffer")
@@ -0,0 +1,260 @@
+###############################################
+#
+# Purpose: Managed egress of the broker, its queues per subscriber and topic
+#
+###############################################
+
+# With a plain PUB socket a slow subscriber backs up until the socket's HWM
+# is reached, and from then on ZMQ drops whatever comes next for it. A
+# broker with managed egress (BrokerAppln -e managed) instead sends over a
+# ROUTER socket and keeps a queue per subscriber and topic, which the
+# subscriber's QoS (see parse_qos in Common.py) bounds: drop the oldest
+# queued sample (the default), drop the newest, or conflate to only the
+# latest value. The subscriber sends its RegisterReq, QoS and all, over a
+# DEALER socket to every broker it connects to.
+# Its predicates (SubscriberAppln -P, see ContentFilter.py) come along, and
+# of a topic it filters only the samples it wants are queued for it; a
+# batch it only wants part of is packed anew for it. Its topics may be
+# wildcard subscriptions (see TopicTrie.py), so which subscribers a topic
+# goes to is matched by its name once per topic as it first comes in, and a
+# queue is only made for a wildcard's topic once it does. Queues are keyed by
+# topic frame, the id of the topic.
+
+import collections  # for the egress queues
+import zmq  # ZMQ sockets
+
+from CS6381_MW import discovery_pb2
+from CS6381_MW import topic_pb2
+from CS6381_MW.Common import PublicationCodec, BATCH_TAGS
+from CS6381_MW.ContentFilter import PredicateIndex, literal
+from CS6381_MW.TopicTrie import TopicTrie, is_pattern, matches
+
+class SubscriberQueues ():
+  ''' what the managed egress has queued for one subscriber, per topic '''
+
+  def __init__ (self, name, identity, register_req, hwm):
+    self.name = name
+    self.identity = identity  # routing id of the subscriber on the ROUTER socket
+    self.topics = list (register_req.topiclist)  # its topics and wildcard subscriptions
+    self.default = (discovery_pb2.QOS_DROP_OLDEST, hwm)
+    self.rules = []  # (topic or subscription, policy, hwm); the last one matching a topic wins
+    for qos in register_req.qos:
+      if not qos.topic:
+        self.default = (qos.policy, qos.hwm or hwm)
+      else:
+        self.rules.append ((qos.topic, qos.policy, qos.hwm or hwm))
+    self.names = {}  # topic frame -> topic
+    self.qos = {}  # topic frame -> (policy, hwm)
+    self.queues = {}  # topic frame -> its queued messages
+    self.ready = collections.deque ()  # topics with something queued, served round robin
+    self.sent = {}
+    self.dropped = {}
+    self.filtered = {}  # samples its predicates ruled out
+    self.saved = {}  # bytes that spared its link
+
+  def add_topic (self, topic, name):
+    ''' give a topic (frame and name) its subscriptions match a queue '''
+    if topic not in self.qos:
+      self.names[topic] = name
+      qos = self.default
+      for rule, policy, hwm in self.rules:
+        if matches (rule, name):
+          qos = (policy, hwm)
+      self.qos[topic] = qos
+      self.queues[topic] = collections.deque ()
+      self.sent[topic] = self.dropped[topic] = self.filtered[topic] = self.saved[topic] = 0
+
+  def put (self, topic, frames):
+    queue = self.queues[topic]
+    policy, hwm = self.qos[topic]
+    if policy == discovery_pb2.QOS_CONFLATE:
+      if queue:
+        # the sample still waiting is superseded
+        self.dropped[topic] += 1
+        queue[0] = frames
+        return
+    elif len (queue) >= hwm:
+      self.dropped[topic] += 1
+      if policy == discovery_pb2.QOS_DROP_NEWEST:
+        return
+      queue.popleft ()
+    if not queue:
+      self.ready.append (topic)
+    queue.append (frames)
+
+  def skip (self, topic, samples, size):
+    ''' samples of a message it does not want, taking up size bytes '''
+    self.filtered[topic] += samples
+    self.saved[topic] += size
+
+  def send (self, socket):
+    ''' send what is queued until the pipe to the subscriber fills up; raises
+    zmq.Again when it does and EHOSTUNREACH when the subscriber is gone '''
+    ready = self.ready
+    while ready:
+      topic = ready[0]
+      queue = self.queues[topic]
+      # with ROUTER_MANDATORY the routing id is refused if the pipe is full
+      socket.send (self.identity, zmq.SNDMORE | zmq.NOBLOCK)
+      socket.send_multipart (queue.popleft (), zmq.NOBLOCK, copy=False)
+      self.sent[topic] += 1
+      if queue:
+        ready.rotate (-1)
+      else:
+        ready.popleft ()
+
+  def stats (self):
+    return {self.names[topic]: {"sent": self.sent[topic], "dropped": self.dropped[topic], "queued": len (self.queues[topic]),
+                                   "filtered": self.filtered[topic], "saved_bytes": self.saved[topic]} for topic in self.qos}
+
+class ManagedEgress ():
+  ''' per subscriber queues in front of a ROUTER socket '''
+
+  def __init__ (self, socket, hwm, ids):
+    self.socket = socket  # ROUTER socket with ROUTER_MANDATORY set
+    self.hwm = hwm  # queue limit for topics whose QoS leaves it to us
+    self.ids = ids  # TopicIds of the topics we forward
+    self.subscribers = {}  # routing id -> SubscriberQueues
+    self.topics = TopicTrie ()  # the subscribers' topics and wildcard subscriptions -> their SubscriberQueues
+    self.interest = {}  # topic frame -> SubscriberQueues that want it, filled in as topics come in
+    self.backlog = set ()  # SubscriberQueues with anything queued
+    self.gone = {}  # name -> stats of subscribers we lost
+    self.filters = PredicateIndex ()  # the subscribers' predicates, by their SubscriberQueues
+
+  def hello (self, identity, register_req, snapshot=()):
+    ''' a subscriber (or one reconnecting) told us its topics and QoS; the
+    snapshot messages of its topics are queued for it ahead of anything live '''
+    self.remove (identity)
+    subscriber = SubscriberQueues (register_req.info.id, identity, register_req, self.hwm)
+    self.subscribers[identity] = subscriber
+    for topic in subscriber.topics:
+      if not is_pattern (topic):
+        subscriber.add_topic (self.ids.frame (topic), topic)
+    conditions = {}
+    for predicate in register_req.predicates:
+      conditions.setdefault (predicate.topic, []).append ((predicate.field, predicate.op, literal (predicate.operand)))
+    for topic, predicates in conditions.items ():
+      if topic in subscriber.topics:
+        self.filters.add (subscriber, self.ids.frame (topic), predicates)
+    self.index ()
+    for frames in snapshot:
+      topic = frames[0].bytes
+      if subscriber in self.subscribers_of (topic):
+        subscriber.put (topic, frames)
+        self.backlog.add (subscriber)
+
+  def remove (self, identity):
+    subscriber = self.subscribers.pop (identity, None)
+    if subscriber is not None:
+      self.backlog.discard (subscriber)
+      self.filters.remove (subscriber)
+      self.gone[subscriber.name] = subscriber.stats ()
+      self.index ()
+    return subscriber
+
+  def index (self):
+    topics = TopicTrie ()
+    for subscriber in self.subscribers.values ():
+      for topic in subscriber.topics:
+        topics.add (topic, subscriber)
+    self.topics = topics
+    self.interest = {}
+
+  def subscribers_of (self, topic):
+    ''' the SubscriberQueues whose subscriptions match a topic (frame) '''
+    subscribers = self.interest.get (topic)
+    if subscribers is None:
+      name = self.ids.name (topic)
+      if name is None:
+        # not a topic we were told about
+        return ()
+      matched = self.topics.match (name)
+      # in the order they said hello
+      subscribers = [subscriber for subscriber in self.subscribers.values () if subscriber in matched]
+      for subscriber in subscribers:
+        subscriber.add_topic (topic, name)
+      self.interest[topic] = subscribers
+    return subscribers
+
+  def push (self, batch):
+    ''' queue a list of messages, each a list of frames, for everyone who wants them '''
+    interest = self.interest
+    backlog = self.backlog
+    filtered = self.filters.filtered
+    for frames in batch:
+      topic = frames[0].bytes
+      subscribers = interest.get (topic)
+      if subscribers is None:
+        subscribers = self.subscribers_of (topic)
+      if subscribers and filtered (topic):
+        self.push_filtered (topic, frames, subscribers)
+        continue
+      for subscriber in subscribers:
+        subscriber.put (topic, frames)
+        backlog.add (subscriber)
+
+  def push_filtered (self, topic, frames, subscribers):
+    ''' queue a message of a topic some subscribers filter: to each of them
+    only the samples it wants, to the others all of it '''
+    compression = None
+    if len (frames) == 2:
+      pubs = [PublicationCodec.decode (frames[1].buffer)]
+    elif len (frames) == 3 and frames[1].bytes in BATCH_TAGS:
+      compression = BATCH_TAGS[frames[1].bytes]
+      buf = frames[2].buffer if compression is None else compression.decompress (frames[2].buffer)
+      pubs = PublicationCodec.decode_batch (buf)
+    else:
+      # a cached value goes to everyone; the subscriber filters it itself
+      pubs = None
+    if pubs is not None:
+      matching = self.filters.matching
+      wanted = [matching (topic, PublicationCodec.value (pub), pub.pub_id) for pub in pubs]
+      size = sum (len (frame) for frame in frames[1:])
+    parts = {}  # indices of the samples wanted -> frames with just those
+    for subscriber in subscribers:
+      out = frames
+      if pubs is not None and self.filters.has (subscriber, topic):
+        keep = tuple (i for i, names in enumerate (wanted) if subscriber in names)
+        if not keep:
+          subscriber.skip (topic, len (pubs), size)
+          continue
+        if len (keep) < len (pubs):
+          out = parts.get (keep)
+          if out is None:
+            out = parts[keep] = self.repack (frames, [pubs[i] for i in keep], compression)
+          subscriber.skip (topic, len (pubs) - len (keep), size - len (out[1]) - len (out[2]))
+      subscriber.put (topic, out)
+      self.backlog.add (subscriber)
+
+  @staticmethod
+  def repack (frames, pubs, compression):
+    ''' the frames of a batch with only some of its samples, compressed as it was '''
+    batch = topic_pb2.PublicationBatch ()
+    batch.pubs.extend (pubs)
+    buf = batch.SerializeToString ()
+    if compression is not None:
+      buf = compression.compress (buf)
+    return [frames[0], frames[1], buf]
+
+  def flush (self):
+    ''' send as much as every subscriber takes; returns the subscribers found gone '''
+    gone = []
+    for subscriber in list (self.backlog):
+      try:
+        subscriber.send (self.socket)
+        self.backlog.discard (subscriber)
+      except zmq.Again:
+        # its pipe is full; the rest waits for the next flush
+        pass
+      except zmq.ZMQError as e:
+        if e.errno != zmq.EHOSTUNREACH:
+          raise
+        gone.append (self.remove (subscriber.identity))
+    return gone
+
+  def stats (self):
+    ''' sent, dropped and queued per subscriber and topic '''
+    stats = dict (self.gone)
+    for subscriber in self.subscribers.values ():
+      stats[subscriber.name] = subscriber.stats ()
+    return stats
@@ -0,0 +1,129 @@
+###############################################
+#
+# Purpose: Logging for the publisher, subscriber, broker and discovery
+# processes that stays off the messaging hot paths
+#
+###############################################
+
+# Four pieces:
+#
+# (1) start () hangs a QueueHandler off the root logger and lets a
+# QueueListener thread do the actual writing, so a log call costs the
+# caller building the record and a queue put, never a write to the terminal.
+# That is a bound, not a saving: into a sink that takes writes at once (a
+# file, /dev/null) the queue costs the caller more than a plain
+# StreamHandler would (see the logging table of mw_benchmark.py). What it
+# buys is that a slow or blocked sink, a terminal over ssh or a full pipe,
+# never holds up the messaging; the records wait in the queue instead.
+#
+# (2) Lazy is a message whose str.format only happens if the record is
+# actually emitted, for things like dumping a serialized buffer at DEBUG:
+#
+#    self.logger.debug (Lazy ("Stringified serialized buf = {}", buf2send))
+#
+# (3) RateSampler lets at most so many records per second through from each
+# call site (file and line), and tells in the next record that gets through
+# how many it dropped. Warnings and errors always get through.
+#
+# (4) hot_path (logger) is the guard for per message logging:
+#
+#    self.trace = hot_path (self.logger)    # once, when configuring
+#    ...
+#    if self.trace:                         # per message
+#      self.logger.debug (...)
+#
+# At INFO and above the per message cost is a single attribute test. Run
+# python with -O and __debug__ is a compile time False, so the guard is
+# False no matter what the level is.
+
+import atexit # to drain the queue on the way out
+import logging # for logging. Use it in place of print statements.
+import logging.handlers # queue handler and listener
+import queue # the queue between the two
+import time # for the sampling windows
+
+# what the applications have always logged with
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# records per second let through from one call site
+DEFAULT_RATE = 100
+
+##################################
+#       Lazy message
+##################################
+class Lazy ():
+
+  __slots__ = ("fmt", "args", "kwargs")
+
+  def __init__ (self, fmt, *args, **kwargs):
+    self.fmt = fmt
+    self.args = args
+    self.kwargs = kwargs
+
+  def __str__ (self):
+    return self.fmt.format (*self.args, **self.kwargs)
+
+##################################
+#       Per call site rate sampling
+##################################
+class RateSampler (logging.Filter):
+
+  def __init__ (self, rate=DEFAULT_RATE):
+    super ().__init__ ()
+    self.rate = rate # records per second per call site (0 = no limit)
+    self.sites = {} # (pathname, lineno) -> [window start, passed, dropped]
+
+  def filter (self, record):
+    if not self.rate or record.levelno >= logging.WARNING:
+      return True
+    key = (record.pathname, record.lineno)
+    site = self.sites.get (key)
+    now = time.monotonic ()
+    if site is None:
+      site = [now, 0, 0]
+      self.sites[key] = site
+    elif now - site[0] >= 1.0:
+      site[0] = now
+      site[1] = 0
+    if site[1] >= self.rate:
+      site[2] += 1
+      return False
+    site[1] += 1
+    if site[2]:
+      # the message is built here, in the thread that logged, as the queue
+      # handler would do anyway
+      record.msg = "{} [{} similar dropped]".format (record.getMessage (), site[2])
+      record.args = None
+      site[2] = 0
+    return True
+
+##################################
+#       Hot path guard
+##################################
+def hot_path (logger):
+  ''' whether per message logging is on for this logger; test the result, not the logger, per message '''
+  return __debug__ and logger.isEnabledFor (logging.DEBUG)
+
+##################################
+#       Queue backed logging
+##################################
+def start (level=logging.DEBUG, fmt=FORMAT, rate=DEFAULT_RATE, stream=None):
+  ''' in place of logging.basicConfig: the root logger hands its records to a
+  queue and a listener thread writes them out; returns the listener '''
+  records = queue.SimpleQueue ()
+  handler = logging.StreamHandler (stream)
+  handler.setFormatter (logging.Formatter (fmt))
+  listener = logging.handlers.QueueListener (records, handler, respect_handler_level=True)
+
+  queue_handler = logging.handlers.QueueHandler (records)
+  queue_handler.addFilter (RateSampler (rate))
+  root = logging.getLogger ()
+  for old in root.handlers[:]:
+    root.removeHandler (old)
+  root.addHandler (queue_handler)
+  root.setLevel (level)
+
+  listener.start ()
+  # whatever is still queued gets written before the process ends
+  atexit.register (listener.stop)
+  return listener
@@ -32,7 +32,12 @@ import zmq  # ZMQ sockets
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
-#from CS6381_MW import topic_pb2  # you will need this eventually
+from CS6381_MW.Common import DiscoveryCodec, PublicationCodec, PublicationBatcher, LastValueCache
+from CS6381_MW.Common import COMPRESSION, parse_compression
+from CS6381_MW.Common import parse_transports, local_endpoints, bind_endpoints
+from CS6381_MW.ContentFilter import PredicateIndex, literal
+from CS6381_MW.Common import poll_deadline, poll_remaining, deadline_expired
+from CS6381_MW.LogUtil import Lazy, hot_path
 
 # import any other packages you need.
 
@@ -49,45 +54,74 @@ class PublisherMW ():
     self.req = None # will be a ZMQ REQ socket to talk to Discovery service
     self.pub = None # will be a ZMQ PUB socket for dissemination
     self.poller = None # used to wait on incoming replies
+    self.reactor = None # the Reactor running our event loop along with others, if any
+    self.deadline = None # monotonic time the next upcall is due (None = when a reply comes)
+    self.codec = DiscoveryCodec () # builds and parses our discovery messages
+    self.pub_codec = PublicationCodec () # encodes our samples and numbers them
+    self.batcher = None # packs samples into batches when batching is turned on
+    self.lvc = None # our latest message per topic, when new subscribers are to get it
+    self.compress = {} # topic (None for the rest) -> codecs we would compress its batches with, preferred first
+    self.filters = None # PredicateIndex of our subscribers' predicates, if any of our topics is filtered
+    self.filtered = {} # topic -> [samples nobody wanted, bytes they would have taken]
     self.addr = None # our advertised IP address
     self.port = None # port num where we are going to publish our topics
+    self.endpoints = [] # local endpoints we also publish on, for peers on our host or in our process
     self.upcall_obj = None # handle to appln obj to handle appln-specific data
     self.handle_events = True # in general we keep going thru the event loop
+    self.trace = False # whether we log every sample (only at DEBUG)
 
   ########################################
   # configure/initialize
   ########################################
-  def configure (self, args):
-    ''' Initialize the object '''
+  def configure (self, args, reactor=None):
+    ''' Initialize the object; with a Reactor, we use its context and it runs
+    our event loop '''
 
     try:
       # Here we initialize any internal variables
       self.logger.info ("PublisherMW::configure")
 
+      # checked once here rather than by the logger for every sample
+      self.trace = hot_path (self.logger)
+
       # First retrieve our advertised IP addr and the publication port num
       self.port = args.port
       self.addr = args.addr
       
       # Next get the ZMQ context
       self.logger.debug ("PublisherMW::configure - obtain ZMQ context")
-      context = zmq.Context ()  # returns a singleton object
+      self.reactor = reactor
+      if reactor is None:
+        context = zmq.Context.instance ()  # returns a singleton object
+      else:
+        context = reactor.context  # shared by everyone the reactor hosts
 
       # get the ZMQ poller object
       self.logger.debug ("PublisherMW::configure - obtain the poller")
-      self.poller = zmq.Poller ()
+      self.poller = zmq.Poller () if reactor is None else reactor.poller_for (self)
       
       # Now acquire the REQ and PUB sockets
       # REQ is needed because we are the client of the Discovery service
       # PUB is needed because we publish topic data
       self.logger.debug ("PublisherMW::configure - obtain REQ and PUB sockets")
       self.req = context.socket (zmq.REQ)
-      self.pub = context.socket (zmq.PUB)
+      if args.lvc:
+        # an XPUB socket tells us about every new subscription, which then
+        # gets our latest sample of its topics
+        self.pub = context.socket (zmq.XPUB)
+        self.pub.setsockopt (zmq.XPUB_VERBOSE, 1)
+        self.lvc = LastValueCache ()
+      else:
+        self.pub = context.socket (zmq.PUB)
 
       # Since are using the event loop approach, register the REQ socket for incoming events
-      # Note that nothing ever will be received on the PUB socket and so it does not make
-      # any sense to register it with the poller for an incoming message.
+      # Note that nothing ever will be received on a PUB socket and so it does not make
+      # any sense to register it with the poller for an incoming message. An XPUB
+      # socket receives the subscriptions.
       self.logger.debug ("PublisherMW::configure - register the REQ socket for incoming replies")
       self.poller.register (self.req, zmq.POLLIN)
+      if self.lvc is not None:
+        self.poller.register (self.pub, zmq.POLLIN)
       
       # Now connect ourselves to the discovery service. Recall that the IP/port were
       # supplied in our argument parsing. Best practices of ZQM suggest that the
@@ -106,6 +140,17 @@ class PublisherMW ():
       # Since port is an integer, we convert it to string to make it part of the URL
       bind_string = "tcp://*:" + str(self.port)
       self.pub.bind (bind_string)
+      # and on the cheaper transports that peers on our host or in our
+      # process pick instead
+      self.endpoints = local_endpoints (self.addr, self.port, parse_transports (args.transports))
+      bind_endpoints (self.pub, self.endpoints)
+
+      # batching trades latency (up to the linger time) for fewer, bigger messages
+      if args.batch > 1:
+        self.logger.debug ("PublisherMW::configure - batch up to {} samples, {} bytes, {} msec".format (args.batch, args.batch_bytes, args.linger))
+        self.batcher = PublicationBatcher (self.pub_codec, args.batch, args.batch_bytes, args.linger, args.compress_min)
+      # which codec each topic gets is only known once discovery says we are ready
+      self.compress = parse_compression (args.compress)
       
       self.logger.info ("PublisherMW::configure completed")
 
@@ -120,39 +165,71 @@ class PublisherMW ():
     try:
       self.logger.info ("PublisherMW::event_loop - run the event loop")
 
+      # The timeout the appln hands us is kept as an absolute deadline. While
+      # we publish, the appln returns the time until its next round is due, and
+      # a reply from discovery in the meantime must not push that back.
+      self.begin (timeout)
+
       # we are using a class variable called "handle_events" which is set to
       # True but can be set out of band to False in order to exit this forever
       # loop
       while self.handle_events:  # it starts with a True value
-        # poll for events. We give it an infinite timeout.
+        # poll for events for whatever is left until our next wakeup.
         # The return value is a socket to event mask mapping
-        events = dict (self.poller.poll (timeout=timeout))
-
-        # Unlike the previous starter code, here we are never returning from
-        # the event loop but handle everything in the same locus of control
-        # Notice, also that after handling the event, we retrieve a new value
-        # for timeout which is used in the next iteration of the poll
-        
-        # check if a timeout has occurred. We know this is the case when
-        # the event mask is empty
-        if not events:
-          # timeout has occurred so it is time for us to make appln-level
-          # method invocation. Make an upcall to the generic "invoke_operation"
-          # which takes action depending on what state the application
-          # object is in.
-          timeout = self.upcall_obj.invoke_operation ()
-          
-        elif self.req in events:  # this is the only socket on which we should be receiving replies
-
-          # handle the incoming reply from remote entity and return the result
-          timeout = self.handle_reply ()
-          
-        else:
-          raise Exception ("Unknown event after poll")
+        events = dict (self.poller.poll (timeout=poll_remaining (self.wakeup ())))
+        self.dispatch (events)
 
       self.logger.info ("PublisherMW::event_loop - out of the event loop")
     except Exception as e:
       raise e
+
+  #################################################################
+  # one time round the event loop, split up so that a Reactor (see
+  # Reactor.py) can run the loops of many of us at once
+  #################################################################
+  def begin (self, timeout):
+    ''' the first upcall is due after timeout msec '''
+    self.deadline = poll_deadline (timeout)
+
+  def wakeup (self):
+    ''' when we have to be called back even if nothing comes in '''
+    # a batch whose linger runs out before the appln's deadline has to
+    # wake us up as well
+    wakeup = self.deadline
+    if self.batcher is not None:
+      linger = self.batcher.next_deadline ()
+      if linger is not None and (wakeup is None or linger < wakeup):
+        wakeup = linger
+    return wakeup
+
+  def dispatch (self, events):
+    ''' handle the events (socket -> event mask) of our sockets, and our
+    deadlines that have come '''
+    try:
+      if self.req in events:  # this is the only socket on which we should be receiving replies
+
+        # handle the incoming reply from remote entity and return the result
+        self.deadline = poll_deadline (self.handle_reply ())
+
+      elif self.pub in events:
+        # somebody subscribed to us
+        self.subscription ()
+
+      elif events:
+        raise Exception ("Unknown event after poll")
+
+      # batches whose linger is up go out now
+      if self.batcher is not None:
+        self.send_expired ()
+
+      # once the deadline has passed it is time for us to make appln-level
+      # method invocation. Make an upcall to the generic "invoke_operation"
+      # which takes action depending on what state the application
+      # object is in.
+      if deadline_expired (self.deadline):
+        self.deadline = poll_deadline (self.upcall_obj.invoke_operation ())
+    except Exception as e:
+      raise e
             
   #################################################################
   # handle an incoming reply
@@ -165,12 +242,10 @@ class PublisherMW ():
       # let us first receive all the bytes
       bytesRcvd = self.req.recv ()
 
-      # now use protobuf to deserialize the bytes
-      # The way to do this is to first allocate the space for the
-      # message we expect, here DiscoveryResp and then parse
-      # the incoming bytes and populate this structure (via protobuf code)
-      disc_resp = discovery_pb2.DiscoveryResp ()
-      disc_resp.ParseFromString (bytesRcvd)
+      # now use protobuf to deserialize the bytes. The codec parses them
+      # into a fresh DiscoveryResp each time, which with the upb runtime is
+      # faster than parsing into one kept around
+      disc_resp = self.codec.decode_resp (bytesRcvd)
 
       # demultiplex the message based on the message type but let the application
       # object handle the contents as it is best positioned to do so. See how we make
@@ -184,6 +259,9 @@ class PublisherMW ():
       elif (disc_resp.msg_type == discovery_pb2.TYPE_ISREADY):
         # this is a response to is ready request
         timeout = self.upcall_obj.isready_response (disc_resp.isready_resp)
+      elif (disc_resp.msg_type == discovery_pb2.TYPE_DEREGISTER):
+        # response to our leaving the system
+        timeout = self.upcall_obj.deregister_response (disc_resp.register_resp)
 
       else: # anything else is unrecognizable by this object
         # raise an exception here
@@ -214,40 +292,14 @@ class PublisherMW ():
       # what role we are playing, the list of topics we are publishing,
       # and our whereabouts, e.g., name, IP and port
 
-      # The following code shows serialization using the protobuf generated code.
-
-      # Build the Registrant Info message first.
-      self.logger.debug ("PublisherMW::register - populate the Registrant Info")
-      reg_info = discovery_pb2.RegistrantInfo () # allocate
-      reg_info.id = name  # our id
-      reg_info.addr = self.addr  # our advertised IP addr where we are publishing
-      reg_info.port = self.port # port on which we are publishing
-      self.logger.debug ("PublisherMW::register - done populating the Registrant Info")
-      
-      # Next build a RegisterReq message
-      self.logger.debug ("PublisherMW::register - populate the nested register req")
-      register_req = discovery_pb2.RegisterReq ()  # allocate 
-      register_req.role = discovery_pb2.ROLE_PUBLISHER  # we are a publisher
-      # It was observed that we cannot directly assign the nested field here.
-      # A way around is to use the CopyFrom method as shown
-      register_req.info.CopyFrom (reg_info)  # copy contents of inner structure
-      register_req.topiclist[:] = topiclist   # this is how repeated entries are added (or use append() or extend ()
-      self.logger.debug ("PublisherMW::register - done populating nested RegisterReq")
-
-      # Finally, build the outer layer DiscoveryReq Message
-      self.logger.debug ("PublisherMW::register - build the outer DiscoveryReq message")
-      disc_req = discovery_pb2.DiscoveryReq ()  # allocate
-      disc_req.msg_type = discovery_pb2.TYPE_REGISTER  # set message type
-      disc_req.dht_type=discovery_pb2.TYPE_INITIAL
-      # It was observed that we cannot directly assign the nested field here.
-      # A way around is to use the CopyFrom method as shown
-      disc_req.register_req.CopyFrom (register_req)
-      self.logger.debug ("PublisherMW::register - done building the outer message")
-      
-      # now let us stringify the buffer and print it. This is actually a sequence of bytes and not
-      # a real string
-      buf2send = disc_req.SerializeToString ()
-      self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+      # The codec fills in the RegistrantInfo, RegisterReq and the outer
+      # DiscoveryReq in place and hands us the serialized bytes
+      self.logger.debug ("PublisherMW::register - build the DiscoveryReq message")
+      offered = []
+      for codecs in self.compress.values ():
+        offered.extend (codec for codec in codecs if codec not in offered)
+      buf2send = self.codec.register_req (discovery_pb2.ROLE_PUBLISHER, name, self.addr, self.port, topiclist, codecs=offered, endpoints=self.endpoints)
+      self.logger.debug (Lazy ("Stringified serialized buf = {}", buf2send))
 
       # now send this to our discovery service
       self.logger.debug ("PublisherMW::register - send stringified buffer to Discovery service")
@@ -259,6 +311,33 @@ class PublisherMW ():
     except Exception as e:
       raise e
 
+  ########################################
+  # deregister from the discovery service
+  #
+  # Sent once we are done publishing so that discovery can tell the
+  # broker to drop us from its publisher set.
+  ########################################
+  def deregister (self, name):
+    ''' deregister the appln from the discovery service '''
+
+    try:
+      self.logger.info ("PublisherMW::deregister")
+
+      # we reuse the RegisterReq message; only our role and id matter here
+      self.logger.debug ("PublisherMW::deregister - build the DiscoveryReq message")
+      buf2send = self.codec.register_req (discovery_pb2.ROLE_PUBLISHER, name, None, None, [], discovery_pb2.TYPE_DEREGISTER)
+      self.logger.debug (Lazy ("Stringified serialized buf = {}", buf2send))
+
+      # now send this to our discovery service
+      self.logger.debug ("PublisherMW::deregister - send stringified buffer to Discovery service")
+      self.req.send (buf2send)  # we use the "send" method of ZMQ that sends the bytes
+
+      # now go to our event loop to receive a response to this request
+      self.logger.info ("PublisherMW::deregister - sent deregister message and now wait for reply")
+
+    except Exception as e:
+      raise e
+
   ########################################
   # check if the discovery service gives us a green signal to proceed
   #
@@ -277,28 +356,9 @@ class PublisherMW ():
       # message but much simpler as the message format is very simple.
       # Then send the request to the discovery service
     
-      # The following code shows serialization using the protobuf generated code.
-      
-      # first build a IsReady message
-      self.logger.debug ("PublisherMW::is_ready - populate the nested IsReady msg")
-      isready_req = discovery_pb2.IsReadyReq ()  # allocate 
-      # actually, there is nothing inside that msg declaration.
-      self.logger.debug ("PublisherMW::is_ready - done populating nested IsReady msg")
-
-      # Build the outer layer Discovery Message
-      self.logger.debug ("PublisherMW::is_ready - build the outer DiscoveryReq message")
-      disc_req = discovery_pb2.DiscoveryReq ()
-      disc_req.msg_type = discovery_pb2.TYPE_ISREADY
-      disc_req.node_type=discovery_pb2.TYPE_INITIAL
-      # It was observed that we cannot directly assign the nested field here.
-      # A way around is to use the CopyFrom method as shown
-      disc_req.isready_req.CopyFrom (isready_req)
-      self.logger.debug ("PublisherMW::is_ready - done building the outer message")
-      
-      # now let us stringify the buffer and print it. This is actually a sequence of bytes and not
-      # a real string
-      buf2send = disc_req.SerializeToString ()
-      self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+      # The request carries nothing of ours, so the codec serializes it once
+      # and gives back the same bytes every time we ask
+      buf2send = self.codec.isready_req ()
 
       # now send this to our discovery service
       self.logger.debug ("PublisherMW::is_ready - send stringified buffer to Discovery service")
@@ -310,34 +370,151 @@ class PublisherMW ():
     except Exception as e:
       raise e
 
+  ########################################
+  # learn the ids of our topics
+  #
+  # topic_ids are the TopicIds of the RegisterResp; our samples carry them
+  # as their topic frame and in their Publication.
+  ########################################
+  def intern (self, topic_ids):
+    try:
+      added = self.pub_codec.topics.update (topic_ids)
+      self.logger.info ("PublisherMW::intern - {}".format ({topic: self.pub_codec.topics.ids[topic] for topic in added}))
+    except Exception as e:
+      raise e
+
+  ########################################
+  # settle on the compression of our topics
+  #
+  # topic_codecs are the TopicCodecs of the IsReadyResp: for every topic,
+  # the codecs all its subscribers can undo. Each of our topics gets the
+  # first of the codecs we would use for it that is among them, if any.
+  ########################################
+  def negotiate (self, topiclist, topic_codecs):
+    ''' topic -> codec we compress its batches with, for the topics that got one '''
+    try:
+      chosen = {}
+      if self.compress:
+        accepted = {entry.topic: set (entry.codecs) for entry in topic_codecs}
+        for topic in topiclist:
+          for codec in self.compress.get (topic, self.compress.get (None, [])):
+            if codec in accepted.get (topic, ()):
+              chosen[topic] = codec
+              self.batcher.compression[topic] = COMPRESSION[codec]
+              break
+        self.logger.info ("PublisherMW::negotiate - compression {}".format (chosen or "none"))
+      return chosen
+    except Exception as e:
+      raise e
+
+  ########################################
+  # take in the filters of our subscribers
+  #
+  # filters are the SubscriberFilters of the IsReadyResp: the predicates
+  # of every subscriber on the topics whose subscribers all filter. Samples
+  # of those topics that none of them wants are not sent at all.
+  ########################################
+  def set_filters (self, topiclist, filters):
+    try:
+      index = PredicateIndex ()
+      for entry in filters:
+        predicates = {}
+        for predicate in entry.predicates:
+          if predicate.topic in topiclist:
+            predicates.setdefault (predicate.topic, []).append ((predicate.field, predicate.op, literal (predicate.operand)))
+        for topic, conditions in predicates.items ():
+          index.add (entry.subscriber, topic, conditions)
+      if len (index):
+        self.filters = index
+        self.filtered = {topic: [0, 0] for topic in index.topics}
+        self.logger.info ("PublisherMW::set_filters - {} filtered".format (sorted (index.topics)))
+    except Exception as e:
+      raise e
+
   #################################################################
   # disseminate the data on our pub socket
   #
   # do the actual dissemination of info using the ZMQ pub socket
   #
-  # Note, here I am sending three diff params. I am eventually going to replace this
-  # sending of a simple string with protobuf serialization. Recall that we need to be
-  # sending publisher id, topic, data, timestamp at a minimum for our experimental
-  # data collection. So anyway we will need to do the necessary serialization.
-  #
-  # This part is left as an exercise.
+  # Each sample goes out as two frames: the topic id, so that the SUB
+  # sockets keep filtering on it, and a Publication (see topic.proto) that
+  # carries the topic id, our id, a sequence number, the send timestamp and
+  # the value in its own type. The topic is given by name, and the timestamp
+  # is the time of sending unless the appln says when the sample was due.
   #################################################################
-  def disseminate (self, id, topic, data):
+  def disseminate (self, id, topic, data, timestamp=None):
     try:
-      self.logger.debug ("PublisherMW::disseminate")
+      # a sample no subscriber wants is not sent at all
+      if self.filters is not None and self.filters.filtered (topic) and not self.filters.matching (topic, data, id):
+        counts = self.filtered[topic]
+        counts[0] += 1
+        counts[1] += self.pub_codec.size (id, topic, data)
+        return
+
+      if self.batcher is None:
+        frames = self.pub_codec.encode (id, topic, data, timestamp)
+        if self.trace:
+          self.logger.debug ("PublisherMW::disseminate - {} seq {}: {}".format (topic, self.pub_codec.seq, data))
+
+        # both frames go out as one message
+        self.send (frames)
+
+      else:
+        # the sample goes into its topic's batch, which goes out once full
+        frames = self.batcher.add (id, topic, data, timestamp)
+        if self.trace:
+          self.logger.debug ("PublisherMW::disseminate - batched {} seq {}: {}".format (topic, self.pub_codec.seq, data))
+        if frames is not None:
+          self.send (frames)
+        self.send_expired ()
+    except Exception as e:
+      raise e
+
+  #################################################################
+  # batches whose linger time is up
+  #################################################################
+  def send_expired (self):
+    for frames in self.batcher.expired ():
+      self.send (frames)
 
-      # Now use the protobuf logic to encode the info and send it.  But for now
-      # we are simply sending the string to make sure dissemination is working.
-      send_str = topic + ":" + data
-      self.logger.debug ("PublisherMW::disseminate - {}".format (send_str))
+  #################################################################
+  # send whatever is still sitting in a batch
+  #################################################################
+  def flush (self):
+    try:
+      if self.batcher is not None:
+        self.logger.debug ("PublisherMW::flush")
+        for frames in self.batcher.flush ():
+          self.send (frames)
+    except Exception as e:
+      raise e
 
-      # send the info as bytes. See how we are providing an encoding of utf-8
-      self.pub.send (bytes(send_str, "utf-8"))
+  #################################################################
+  # send a message, remembering it as its topic's latest
+  #################################################################
+  def send (self, frames):
+    self.pub.send_multipart (frames)
+    if self.lvc is not None:
+      self.lvc.put (frames[0], frames)
 
-      self.logger.debug ("PublisherMW::disseminate complete")
+  #################################################################
+  # a new subscription on our XPUB socket
+  #
+  # a leading 1 byte subscribes, a 0 byte unsubscribes. A subscriber
+  # (or broker) that subscribes gets our latest message of every topic it
+  # matches, tagged as a snapshot, rather than waiting for our next round.
+  #################################################################
+  def subscription (self):
+    try:
+      message = self.pub.recv ()
+      if message[:1] == b"\x01":
+        snapshot = self.lvc.snapshot (message[1:])
+        for frames in snapshot:
+          self.pub.send_multipart (frames)
+        self.logger.debug ("PublisherMW::subscription - {}, {} cached values sent".format (message[1:], len (snapshot)))
     except Exception as e:
       raise e
-            
+
   ########################################
   # set upcall handle
   #
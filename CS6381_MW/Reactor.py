@@ -0,0 +1,163 @@
+###############################################
+#
+# Purpose: One event loop for many logical publishers and subscribers
+#
+###############################################
+
+# A PublisherAppln or SubscriberAppln normally is a process of its own, with
+# its own ZMQ context and poller, so simulating a thousand publishers takes a
+# thousand interpreters. A Reactor hosts any number of them in one process
+# instead: they share its context, whose I/O threads do the socket work of all
+# of them, and one poller over all of their sockets. Each logical entity keeps
+# its own middleware object, and with it its own name, sockets and discovery
+# registration; only the event loop is shared. Being in one context, hosted
+# publishers and subscribers talk over inproc (see Transports in Common.py).
+#
+# A middleware object configured with a reactor registers its sockets with
+# the Poller the reactor hands it, which puts them on the shared poller and
+# remembers whose they are. The event loop of a middleware object is split
+# into begin (), wakeup () and dispatch (): every time round, the reactor
+# hands the ready sockets to their owners' dispatch (), and so the objects
+# whose wakeup (the deadline of their last upcall, or a batch's linger) has
+# come, which it keeps in a heap by time. An object whose event loop gets
+# disabled is dropped, and run () returns once none is left.
+#
+#   reactor = Reactor (logger, io_threads=4)
+#   pub_app.configure (args, reactor)
+#   pub_app.start ()
+#   reactor.add (pub_app.mw_obj, timeout=0)
+#   ...
+#   reactor.run ()
+#
+# HostAppln.py does that for as many publishers and subscribers as asked for.
+
+import heapq  # wakeups of the hosted objects
+import itertools  # tie breaker for equal wakeups
+import time  # for the monotonic clock
+import zmq  # ZMQ sockets
+
+from CS6381_MW.Common import poll_remaining
+
+class Reactor ():
+
+  ##################################
+  # what a hosted object gets as its poller
+  ##################################
+  class Poller ():
+
+    def __init__ (self, reactor, owner):
+      self.reactor = reactor
+      self.owner = owner  # the hosted object
+      self.sockets = set ()  # registered by it
+
+    def register (self, socket, flags=zmq.POLLIN):
+      self.reactor.poller.register (socket, flags)
+      self.reactor.owners[socket] = self.owner
+      self.sockets.add (socket)
+
+    def unregister (self, socket):
+      self.reactor.poller.unregister (socket)
+      del self.reactor.owners[socket]
+      self.sockets.discard (socket)
+
+    def poll (self, timeout=None):
+      raise RuntimeError ("A hosted middleware object is polled by its reactor")
+
+  def __init__ (self, logger, io_threads=1, max_sockets=0):
+    self.logger = logger
+    self.context = zmq.Context (io_threads=io_threads)
+    if max_sockets:
+      # ZMQ allows 1023 sockets per context unless told otherwise
+      self.context.set (zmq.MAX_SOCKETS, max_sockets)
+    self.poller = zmq.Poller ()  # over the sockets of every hosted object
+    self.owners = {}  # socket -> the hosted object it belongs to
+    self.pollers = {}  # hosted object -> its Poller
+    self.hosted = set ()  # objects whose event loop we run
+    self.wakeups = []  # heap of (wakeup, tie breaker, hosted object)
+    self.scheduled = {}  # hosted object -> its wakeup in the heap, None if none
+    self.counter = itertools.count ()
+    self.handle_events = True
+
+  def __len__ (self):
+    return len (self.hosted)
+
+  def poller_for (self, owner):
+    ''' the poller a middleware object configured with us registers its sockets with '''
+    poller = self.pollers.get (owner)
+    if poller is None:
+      poller = self.Poller (self, owner)
+      self.pollers[owner] = poller
+    return poller
+
+  def add (self, obj, timeout=None):
+    ''' run obj's event loop, starting with an upcall after timeout msec the
+    way obj.event_loop (timeout) would '''
+    obj.begin (timeout)
+    self.hosted.add (obj)
+    self.scheduled[obj] = None
+    self.schedule (obj)
+
+  def remove (self, obj):
+    ''' stop running obj's event loop; its sockets are left to it '''
+    poller = self.pollers.pop (obj, None)
+    if poller is not None:
+      for socket in list (poller.sockets):
+        poller.unregister (socket)
+    self.hosted.discard (obj)
+    self.scheduled.pop (obj, None)
+
+  def schedule (self, obj):
+    # a wakeup already in the heap stays valid, so an object that keeps
+    # getting data does not pile up entries
+    wakeup = obj.wakeup ()
+    if wakeup != self.scheduled[obj]:
+      self.scheduled[obj] = wakeup
+      if wakeup is not None:
+        heapq.heappush (self.wakeups, (wakeup, next (self.counter), obj))
+
+  def disable_event_loop (self):
+    self.handle_events = False
+
+  ########################################
+  # the one event loop
+  ########################################
+  def run (self):
+    try:
+      self.logger.info ("Reactor::run - {} objects hosted".format (len (self.hosted)))
+      wakeups = self.wakeups
+      while self.handle_events and self.hosted:
+        events = self.poller.poll (timeout=poll_remaining (wakeups[0][0] if wakeups else None))
+
+        # ready sockets go to their owners
+        ready = {}
+        for socket, event in events:
+          ready.setdefault (self.owners[socket], {})[socket] = event
+        # and so do the objects whose wakeup has come; entries that were
+        # since replaced by an other wakeup are skipped
+        now = time.monotonic ()
+        while wakeups and wakeups[0][0] <= now:
+          wakeup, _, obj = heapq.heappop (wakeups)
+          if self.scheduled.get (obj) == wakeup:
+            self.scheduled[obj] = None
+            ready.setdefault (obj, {})
+
+        for obj, obj_events in ready.items ():
+          if obj not in self.hosted:
+            continue
+          try:
+            obj.dispatch (obj_events)
+          except Exception as e:
+            # one logical entity failing does not take the others down
+            self.logger.error ("Reactor::run - dropping a {} that failed: {}".format (type (obj).__name__, e))
+            obj.handle_events = False
+          if obj.handle_events:
+            self.schedule (obj)
+          else:
+            self.remove (obj)
+      self.logger.info ("Reactor::run - out of the event loop, {} objects left".format (len (self.hosted)))
+    except Exception as e:
+      raise e
+
+  def close (self):
+    ''' close every socket of the shared context and terminate it '''
+    self.context.destroy (linger=0)
@@ -41,45 +41,103 @@ import zmq  # ZMQ sockets
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
-#from CS6381_MW import topic_pb2  # you will need this eventually
+from CS6381_MW import topic_pb2
+from CS6381_MW.Common import DiscoveryCodec, PublicationCodec, BATCH_TAGS, SNAPSHOT_TAG, drain, parse_qos
+from CS6381_MW.Common import COMPRESSION, CompressionStats, TopicIds
+from CS6381_MW.Common import parse_transports, choose_endpoint
+from CS6381_MW.ContentFilter import PredicateIndex, parse_predicates
+from CS6381_MW.TopicTrie import TopicTrie
+from CS6381_MW.Common import poll_deadline, poll_remaining, deadline_expired
+from CS6381_MW.LogUtil import Lazy, hot_path
+from CS6381_MW.TopicLog import REPLAY_TAG, REPLAY_END_TAG, SEQ
+
+# most messages a broker sends us per replay request; we ask for the next
+# lot once they are in
+REPLAY_CHUNK = 1000
 
 class SubscriberMW():
     def __init__ (self, logger):
         self.logger = logger  # internal logger for print statements
         self.req = None # will be a ZMQ REQ socket to talk to Discovery service
         self.sub = None # will be a ZMQ sub socket for dissemination
+        self.context = None # the ZMQ context
+        self.qos = None # (topic, policy, hwm) we register with; brokers with managed egress honor it
+        self.dealers = {} # with QoS, connect string -> DEALER socket to that broker
+        self.hello = None # with QoS, our registration, which we also send to every broker
+        self.replayers = {} # replay endpoint -> DEALER socket to that broker's replay service
+        self.replaying = {} # topic -> (samples of the answer so far, the request being answered)
         self.poller = None # used to wait on incoming replies
+        self.reactor = None # the Reactor running our event loop along with others, if any
+        self.deadline = None # monotonic time the next upcall is due (None = when a reply comes)
+        self.codec = DiscoveryCodec () # builds and parses our discovery messages
         self.addr = None # our advertised IP address
         self.port = None # port num
+        self.budget = None # most messages taken off the SUB socket per wakeup
+        self.transports = [] # the local transports we may connect over besides tcp
+        self.seen = set () # topics we have had data of; later snapshots of them are stale
+        self.topics = TopicTrie () # our topics and wildcard subscriptions
+        self.ids = TopicIds () # the topics they stand for, as discovery told us, by id
+        self.unwanted = 0 # messages on topics that are not ours
+        self.compression = CompressionStats () # what undoing compressed batches cost us, per topic
+        self.predicates = [] # (topic, field, op, operand) the samples we want have to satisfy
+        self.filters = None # PredicateIndex of our own predicates, if we have any
+        self.filtered = {} # topic -> samples that reached us although we do not want them
         self.upcall_obj = None # handle to appln obj to handle appln-specific data
         self.handle_events = True # in general we keep going thru the event loop
+        self.trace = False # whether we log every wakeup with data (only at DEBUG)
 
-    def configure (self, args):
-        ''' Initialize the object '''
+    def configure (self, args, reactor=None):
+        ''' Initialize the object; with a Reactor, we use its context and it
+        runs our event loop '''
 
         try:
             # Here we initialize any internal variables
             self.logger.info ("SubscriberMW::configure")
 
+            # checked once here rather than by the logger for every wakeup
+            self.trace = hot_path (self.logger)
+
             # First retrieve our advertised IP addr and the publication port num
             self.port = args.port
             self.addr = args.addr
+            self.budget = args.budget
+            self.transports = parse_transports (args.transports)
+            self.qos = parse_qos (args.qos)
+            self.predicates = parse_predicates (args.predicates)
+            if self.predicates:
+                # publishers and brokers only send what someone wants, but what
+                # they send for another subscriber of a topic reaches us as well
+                conditions = {}
+                for topic, field, op, operand in self.predicates:
+                    conditions.setdefault (topic, []).append ((field, op, operand))
+                self.filters = PredicateIndex ()
+                for topic, predicates in conditions.items ():
+                    self.filters.add (True, topic, predicates)
+                self.filtered = dict.fromkeys (conditions, 0)
 
             # Next get the ZMQ context
             self.logger.debug ("SubscriberMW::configure - obtain ZMQ context")
-            context = zmq.Context ()  # returns a singleton object
+            self.reactor = reactor
+            if reactor is None:
+                context = zmq.Context.instance ()  # returns a singleton object
+            else:
+                context = reactor.context  # shared by everyone the reactor hosts
+            self.context = context
 
             # get the ZMQ poller object
             self.logger.debug ("SubscriberMW::configure - obtain the poller")
-            self.poller = zmq.Poller ()
+            self.poller = zmq.Poller () if reactor is None else reactor.poller_for (self)
 
             self.logger.debug ("SubscriberMW::configure - obtain REQ and SUB sockets")
             self.req = context.socket (zmq.REQ)
-            self.sub = context.socket (zmq.SUB)
+            if not self.qos:
+                # with QoS, every broker gets a DEALER socket of its own instead
+                self.sub = context.socket (zmq.SUB)
 
             self.logger.debug ("SubscriberMW::configure - register the REQ socket for incoming replies")
             self.poller.register (self.req, zmq.POLLIN)
-            self.poller.register (self.sub, zmq.POLLIN)
+            if self.sub is not None:
+                self.poller.register (self.sub, zmq.POLLIN)
 
             self.logger.debug ("SubscriberMW::configure - connect to Discovery service")
             # For our assignments we will use TCP. The connect string is made up of
@@ -100,17 +158,44 @@ class SubscriberMW():
         try:
             self.logger.info ("SubscriberMW::event_loop - run the event loop")
 
+            # as in the broker, samples keep the sub socket busy, so the timeout
+            # from the appln is kept as a deadline; otherwise the periodic lookup
+            # refresh would never get its upcall while data is flowing
+            self.begin (timeout)
             while self.handle_events:  
-                events = dict (self.poller.poll (timeout=timeout))
-                if not events:
-                    timeout = self.upcall_obj.invoke_operation ()
-                elif self.req in events:
-                    timeout = self.handle_reply ()
-                elif self.sub in events:
-                    timeout = self.receive_from_pub ()
+                events = dict (self.poller.poll (timeout=poll_remaining (self.wakeup ())))
+                self.dispatch (events)
+            self.logger.info ("SubscriberMW::event_loop - out of the event loop")
+        except Exception as e:
+            raise e
+
+    # one time round the event loop, split up so that a Reactor (see
+    # Reactor.py) can run the loops of many of us at once
+    def begin (self, timeout):
+        ''' the first upcall is due after timeout msec '''
+        self.deadline = poll_deadline (timeout)
+
+    def wakeup (self):
+        ''' when we have to be called back even if nothing comes in '''
+        return self.deadline
+
+    def dispatch (self, events):
+        ''' handle the events (socket -> event mask) of our sockets, and our
+        deadline if it has come '''
+        try:
+            # every ready socket gets its turn, so that a busy data socket
+            # cannot hold up a replay
+            for socket in events:
+                if socket is self.req:
+                    self.deadline = poll_deadline (self.handle_reply ())
+                elif socket is self.sub or socket in self.dealers.values ():
+                    self.receive_from_pub (socket)
+                elif socket in self.replayers.values ():
+                    self.receive_replay (socket)
                 else:
                     raise Exception ("Unknown event after poll")
-            self.logger.info ("SubscriberMW::event_loop - out of the event loop")
+            if deadline_expired (self.deadline):
+                self.deadline = poll_deadline (self.upcall_obj.invoke_operation ())
         except Exception as e:
             raise e
     
@@ -118,8 +203,7 @@ class SubscriberMW():
         try:
             self.logger.info ("SubscriberMW::handle_reply")
             bytesRcvd = self.req.recv ()
-            disc_resp = discovery_pb2.DiscoveryResp ()
-            disc_resp.ParseFromString (bytesRcvd)
+            disc_resp = self.codec.decode_resp (bytesRcvd)
             if (disc_resp.msg_type == discovery_pb2.TYPE_REGISTER):
                 timeout = self.upcall_obj.register_response (disc_resp.register_resp)
             elif (disc_resp.msg_type == discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC):
@@ -135,36 +219,19 @@ class SubscriberMW():
 
         try:
             self.logger.info ("SubscriberMW::register")
-            self.logger.debug ("SubscriberMW::register - populate the Registrant Info")
-            reg_info = discovery_pb2.RegistrantInfo () # allocate
-            reg_info.id = name  # our id
-            reg_info.addr = self.addr
-            reg_info.port = self.port 
-            self.logger.debug ("SubscriberMW::register - done populating the Registrant Info")
-
-            # Next build a RegisterReq message
-            self.logger.debug ("SubscriberMW::register - populate the nested register req")
-            register_req = discovery_pb2.RegisterReq ()  # allocate 
-            register_req.role = discovery_pb2.ROLE_SUBSCRIBER 
-            register_req.info.CopyFrom (reg_info)  # copy contents of inner structure
-            register_req.topiclist[:] = topiclist   # this is how repeated entries are added (or use append() or extend ()
-            self.logger.debug ("SubscriberMW::register - done populating nested RegisterReq")
-
-            # Finally, build the outer layer DiscoveryReq Message
-            self.logger.debug ("SubscriberMW::register - build the outer DiscoveryReq message")
-            disc_req = discovery_pb2.DiscoveryReq ()  # allocate
-            disc_req.msg_type = discovery_pb2.TYPE_REGISTER  # set message type
-            disc_req.dht_type=discovery_pb2.TYPE_INITIAL
-            disc_req.register_req.CopyFrom (register_req)
-            self.logger.debug ("SubscriberMW::register - done building the outer message")
-
+            self.logger.debug ("SubscriberMW::register - build the DiscoveryReq message")
+            # publishers only compress with what all their subscribers can undo
+            predicates = [predicate for predicate in self.predicates if predicate[0] in topiclist]
+            buf2send = self.codec.register_req (discovery_pb2.ROLE_SUBSCRIBER, name, self.addr, self.port, topiclist, qos=self.qos, codecs=list (COMPRESSION), predicates=predicates)
+            self.logger.debug (Lazy ("Stringified serialized buf = {}", buf2send))
+
+            # the SUB socket subscribes to the ids of our topics as discovery
+            # hands them to us (see intern ())
             for item in topiclist:
-                self.sub.setsockopt(zmq.SUBSCRIBE, bytes(item, "utf-8"))
-
-            # now let us stringify the buffer and print it. This is actually a sequence of bytes and not
-            # a real string
-            buf2send = disc_req.SerializeToString ()
-            self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+                self.topics.add (item, item)
+            if self.sub is None:
+                # a broker learns our topics and QoS from the same registration
+                self.hello = buf2send
 
             # now send this to our discovery service
             self.logger.debug ("SubscriberMW::register - send stringified buffer to Discovery service")
@@ -177,28 +244,34 @@ class SubscriberMW():
             raise e
         
 
-    def lookup_publisher(self,topiclist):
+    def intern (self, topic_ids):
+        ''' the TopicIds of a discovery response: the ids of our topics and of
+        those our wildcard subscriptions stand for, which we subscribe to '''
+        try:
+            added = []
+            for entry in topic_ids:
+                if entry.topic not in self.ids and self.topics.match (entry.topic):
+                    self.ids.add (entry.topic, entry.id)
+                    if self.sub is not None:
+                        self.sub.setsockopt (zmq.SUBSCRIBE, self.ids.frames[entry.topic])
+                    added.append (entry.topic)
+            if added:
+                self.logger.info ("SubscriberMW::intern - subscribed to {}".format ({topic: self.ids.ids[topic] for topic in added}))
+            return added
+        except Exception as e:
+            raise e
+
+    def lookup_publisher(self,topiclist,version=0):
         #send topic list to discovery
         #look up like register
         try:
             self.logger.info ("SubscriberMW::lookup")
-            self.logger.debug ("SubscriberMW::lookup_req - populate the LookupPubByTopicReq")
-            lookup_req = discovery_pb2.LookupPubByTopicReq () # allocate
-            lookup_req.topiclist[:] = topiclist
-            self.logger.debug ("SubscriberMW::lookup - done populating nested LookupPubByTopicReq")
-
-            # Finally, build the outer layer DiscoveryReq Message
-            self.logger.debug ("SubscriberMW::lookup - build the outer DiscoveryReq message")
-            disc_req = discovery_pb2.DiscoveryReq ()  # allocate
-            disc_req.msg_type = discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC  # set message type
-            disc_req.dht_type=discovery_pb2.TYPE_INITIAL
-            disc_req.lookup_req.CopyFrom (lookup_req)
-            self.logger.debug ("SubscriberMW::lookup - done building the outer message")
-
-            # now let us stringify the buffer and print it. This is actually a sequence of bytes and not
-            # a real string
-            buf2send = disc_req.SerializeToString ()
-            self.logger.debug ("Stringified serialized buf = {}".format (buf2send))
+            # our topic list does not change, and neither does the version we
+            # have while the publishers stay the same, so the codec mostly hands
+            # back the bytes it serialized before
+            self.logger.debug ("SubscriberMW::lookup - build the DiscoveryReq message")
+            buf2send = self.codec.lookup_req (topiclist, version)
+            self.logger.debug (Lazy ("Stringified serialized buf = {}", buf2send))
 
             # now send this to our discovery service
             self.logger.debug ("SubscriberMW::lookup - send stringified buffer to Discovery service")
@@ -210,30 +283,170 @@ class SubscriberMW():
         except Exception as e:
             raise e
     
-    #single publisher
-    def receive_from_pub (self):
+    def receive_from_pub (self, socket):
         try:
-            self.logger.info ("SubscriberMW::receive from publisher")
-            bytesRcvd = self.sub.recv ()
-            data=str(bytesRcvd, "utf-8")
-            self.upcall_obj.data_receive(data)
-            self.logger.debug ("SubscriberMW::receive complete")
-            return 0
+            # everything already queued (up to our budget) is taken in one go and
+            # handed up as a single list of (topic, Publication)
+            samples = []
+            snapshots = []
+            seen = self.seen
+            names = self.ids.names
+            for frames in drain (socket, self.budget):
+                # a sample is the topic frame followed by the Publication frame; a
+                # batch has the batch tag in between
+                topic = names.get (frames[0].bytes)
+                if topic is None:
+                    self.unwanted += 1
+                    continue
+                if len (frames) == 2:
+                    samples.append ((topic, PublicationCodec.decode (frames[1].buffer)))
+                elif len (frames) == 3 and frames[1].bytes in BATCH_TAGS:
+                    samples.extend ((topic, publication) for publication in self.unpack (topic, frames[1].bytes, frames[2]))
+                elif frames[1].bytes == SNAPSHOT_TAG:
+                    # a cached value sent as we subscribed; only the first one
+                    # counts, and only if live data has not beaten it
+                    if topic not in seen:
+                        seen.add (topic)
+                        if len (frames) == 3:
+                            snapshots.append ((topic, PublicationCodec.decode (frames[2].buffer)))
+                        elif frames[2].bytes in BATCH_TAGS and len (frames) == 4:
+                            snapshots.extend ((topic, publication) for publication in self.unpack (topic, frames[2].bytes, frames[3]))
+                        else:
+                            raise ValueError ("Unrecognized snapshot message")
+                    continue
+                else:
+                    raise ValueError ("Unrecognized publication message")
+                seen.add (topic)
+            if self.trace:
+                self.logger.debug ("SubscriberMW::receive complete - {} samples, {} from snapshots".format (len (samples), len (snapshots)))
+            if self.filters is not None:
+                samples = self.select (samples)
+                snapshots = self.select (snapshots)
+            if snapshots:
+                self.upcall_obj.snapshot_receive (snapshots)
+            return self.upcall_obj.data_receive (samples)
         except Exception as e:
             raise e
             
-    def connect_pub (self, pubaddr):
+    def select (self, samples):
+        ''' the (topic, Publication) samples our predicates let through '''
+        filters = self.filters
+        selected = []
+        for topic, publication in samples:
+            if filters.filtered (topic) and not filters.matching (topic, PublicationCodec.value (publication), publication.pub_id):
+                self.filtered[topic] += 1
+            else:
+                selected.append ((topic, publication))
+        return selected
+
+    def unpack (self, topic, tag, frame):
+        ''' the samples of a batch frame, decompressed first if its tag says so '''
+        compression = BATCH_TAGS[tag]
+        if compression is None:
+            return PublicationCodec.decode_batch (frame.buffer)
+        start = time.thread_time_ns ()
+        buf = compression.decompress (frame.buffer)
+        self.compression.add (topic, len (buf), len (frame), time.thread_time_ns () - start)
+        return PublicationCodec.decode_batch (buf)
+
+    def replay (self, endpoint, topic, from_seq=0, since=0, until=0):
+        ''' ask the broker at endpoint (its replay port) for the messages of a
+        topic in its log from a log sequence number, or from a time (ns) '''
         try:
-            self.logger.info ("SubscriberMW::lookup - connect to publisher")
+            self.logger.info ("SubscriberMW::replay - {} from {}".format (topic, endpoint))
+            socket = self.replayers.get (endpoint)
+            if socket is None:
+                socket = self.context.socket (zmq.DEALER)
+                socket.connect ("tcp://" + endpoint)
+                self.poller.register (socket, zmq.POLLIN)
+                self.replayers[endpoint] = socket
+            req = topic_pb2.ReplayReq (topic=topic, from_seq=from_seq, since=since, until=until, max_count=REPLAY_CHUNK)
+            self.replaying[topic] = ([], req)
+            socket.send (req.SerializeToString ())
+        except Exception as e:
+            raise e
+
+    def receive_replay (self, socket):
+        ''' replayed messages, handed up an answer at a time '''
+        try:
+            for frames in drain (socket, self.budget):
+                topic = self.ids.name (frames[0].bytes)
+                replaying = self.replaying.get (topic)
+                if replaying is None:
+                    # a topic we do not know the id of, or no longer replay
+                    self.logger.debug (Lazy ("SubscriberMW::receive_replay - dropping a frame of {} we are not replaying", topic or frames[0].bytes))
+                    continue
+                samples, req = replaying
+                tag = frames[1].bytes
+                if tag == REPLAY_TAG:
+                    # [topic, tag, seq, <the frames after the topic>]
+                    if len (frames) == 4:
+                        samples.append ((topic, PublicationCodec.decode (frames[3].buffer)))
+                    elif len (frames) == 5 and frames[3].bytes in BATCH_TAGS:
+                        samples.extend ((topic, publication) for publication in self.unpack (topic, frames[3].bytes, frames[4]))
+                    # a snapshot tag never makes it into the log
+                    else:
+                        raise ValueError ("Unrecognized replayed message")
+                elif tag == REPLAY_END_TAG:
+                    next_seq, = SEQ.unpack (frames[2].bytes)
+                    caught_up = frames[3].bytes == b"1"
+                    if caught_up:
+                        del self.replaying[topic]
+                    else:
+                        # on to the next lot, from where this one ended
+                        req.from_seq = next_seq
+                        self.replaying[topic] = ([], req)
+                        socket.send (req.SerializeToString ())
+                    if self.filters is not None:
+                        samples = self.select (samples)
+                    self.upcall_obj.replay_receive (topic, samples, next_seq, caught_up)
+                else:
+                    raise ValueError ("Unrecognized replay message")
+        except Exception as e:
+            raise e
+
+    def endpoint (self, info):
+        ''' where to connect to a publisher (or broker) in a lookup response:
+        its inproc or ipc endpoint when it is in our process or on our host '''
+        return choose_endpoint (self.context, self.transports, self.addr, info.addr, info.port, info.endpoints)
+
+    def connect_pub (self, endpoint):
+        try:
+            self.logger.info ("SubscriberMW::lookup - connect to publisher at {}".format (endpoint))
             self.logger.debug ("SubscriberMW::lookup - connect to the pub socket")
 
-            connect_string = "tcp://" + str(pubaddr)
-            self.sub.connect (connect_string)
+            connect_string = endpoint
+            if self.sub is not None:
+                self.sub.connect (connect_string)
+            else:
+                # a broker with managed egress; ZMQ holds the hello until we
+                # are connected
+                dealer = self.context.socket (zmq.DEALER)
+                dealer.connect (connect_string)
+                dealer.send (self.hello)
+                self.poller.register (dealer, zmq.POLLIN)
+                self.dealers[connect_string] = dealer
  
             self.logger.debug ("SubscriberMW::connect complete")
         except Exception as e:
             raise e
 
+    def disconnect_pub (self, endpoint):
+        try:
+            self.logger.info ("SubscriberMW::disconnect_pub - disconnect from publisher at {}".format (endpoint))
+
+            disconnect_string = endpoint
+            if self.sub is not None:
+                self.sub.disconnect (disconnect_string)
+            else:
+                dealer = self.dealers.pop (disconnect_string)
+                self.poller.unregister (dealer)
+                dealer.close (linger=0)
+
+            self.logger.debug ("SubscriberMW::disconnect complete")
+        except Exception as e:
+            raise e
+
     def set_upcall_handle (self, upcall_obj):
         ''' set upcall handle '''
         self.upcall_obj = upcall_obj
@@ -0,0 +1,304 @@
+###############################################
+#
+# Purpose: Durable per topic log of what the broker forwards, from which
+# subscribers can replay what they missed
+#
+###############################################
+
+# Every topic has a directory of its own under the log directory, named
+# after the topic's id (its topic frame) in hex, holding segments. A segment is a pair of files named after the log sequence number
+# of its first message:
+#
+#   <base seq>.log   the messages, each as a frame count byte followed by
+#                    every frame after the topic with its 4 byte length in
+#                    front (the frames exactly as they were forwarded)
+#   <base seq>.idx   16 bytes per message: its offset in the .log and the
+#                    time (ns) the broker got it
+#
+# The log sequence number is the broker's, per topic and counting from 1; it
+# has nothing to do with the publishers' own sequence numbers.
+#
+# Appends go through ordinary buffered files and only reach the OS when the
+# broker calls flush (), once every flush interval rather than per message.
+# The in-memory index of each segment only exposes what has been flushed,
+# and that is all a reader ever looks at. Readers go through mmap. A segment
+# is sealed once it has grown past segment_bytes and a new one is started.
+# Segments already on disk are loaded again on start, so the sequence
+# numbers carry on across restarts.
+#
+# The ReplayService answers replay requests (ReplayReq, topic.proto) on a
+# ROUTER socket of its own thread, so reading the log never holds up the
+# forwarding done by the broker's event loop.
+
+import array # the in-memory index
+import bisect # to find a time in the index
+import mmap # the readers map the segment files
+import os # for the log directory
+import struct # record and index layout
+import threading # replays are served on their own thread
+import time # receive times
+import zmq # ZMQ sockets
+
+from CS6381_MW import topic_pb2
+from CS6381_MW.Common import poll_deadline, topic_frame, SNAPSHOT_TAG
+
+REPLAY_TAG = b"r"  # second frame of [topic, tag, seq, <frames>] with a replayed message
+REPLAY_END_TAG = b"e"  # second frame of [topic, tag, next seq, caught up] ending an answer
+
+SEQ = struct.Struct ("<Q") # sequence numbers on the wire
+FRAME_COUNT = struct.Struct ("<B")
+FRAME_LEN = struct.Struct ("<I")
+INDEX_ENTRY = struct.Struct ("<qq") # offset, receive time
+
+##################################
+#       One segment
+##################################
+class Segment ():
+
+  def __init__ (self, path, base):
+    self.path = path # file name without the extension
+    self.base = base # log sequence number of its first message
+    self.offsets = array.array ("q") # per message, where it starts in the .log
+    self.stamps = array.array ("q") # per message, when the broker got it (ns)
+    self.count = 0 # messages flushed to the OS; readers see only these
+    self.size = 0 # bytes in the .log, flushed or not
+    self.map = None # the reader's mmap of the .log
+    self.mapped = None # the reader's file object behind it
+
+  def load (self):
+    ''' the index of a segment already on disk, cut back to what the .log holds '''
+    with open (self.path + ".idx", "rb") as f:
+      data = f.read ()
+    data = data[:len (data) - len (data) % INDEX_ENTRY.size]
+    self.size = os.path.getsize (self.path + ".log")
+    for offset, stamp in INDEX_ENTRY.iter_unpack (data):
+      if offset >= self.size:
+        break
+      self.offsets.append (offset)
+      self.stamps.append (stamp)
+    self.count = len (self.offsets)
+
+  def reader (self, end):
+    ''' a map of the .log covering at least end bytes (reader thread only) '''
+    if self.map is None or len (self.map) < end:
+      if self.map is not None:
+        self.map.close ()
+        self.mapped.close ()
+      self.mapped = open (self.path + ".log", "rb")
+      self.map = mmap.mmap (self.mapped.fileno (), 0, access=mmap.ACCESS_READ)
+    return self.map
+
+  def read (self, i):
+    ''' the frames of the i-th message of the segment '''
+    offset = self.offsets[i]
+    end = self.offsets[i + 1] if i + 1 < self.count else None
+    buf = self.reader (offset + 1 if end is None else end)
+    count, = FRAME_COUNT.unpack_from (buf, offset)
+    pos = offset + FRAME_COUNT.size
+    frames = []
+    for _ in range (count):
+      length, = FRAME_LEN.unpack_from (buf, pos)
+      pos += FRAME_LEN.size
+      if pos + length > len (buf):
+        buf = self.reader (pos + length)
+      frames.append (buf[pos:pos + length])
+      pos += length
+    return frames
+
+##################################
+#       The log of all topics
+##################################
+class TopicLog ():
+
+  def __init__ (self, directory, segment_bytes, flush_interval):
+    self.directory = directory
+    self.segment_bytes = segment_bytes
+    self.flush_interval = flush_interval # msec an append may wait before it is flushed
+    self.segments = {} # topic (bytes) -> its segments, oldest first
+    self.writers = {} # topic (bytes) -> (.log file, .idx file) of its last segment
+    self.dirty = set () # topics with appends not flushed yet
+    self.deadline = None # when the appends so far have to be flushed
+    os.makedirs (directory, exist_ok=True)
+    self.load ()
+
+  def topic_dir (self, topic):
+    return os.path.join (self.directory, topic.hex ())
+
+  def load (self):
+    ''' pick up the segments of an earlier run '''
+    for name in os.listdir (self.directory):
+      path = os.path.join (self.directory, name)
+      if not os.path.isdir (path):
+        continue
+      try:
+        topic = bytes.fromhex (name)
+      except ValueError:
+        # not a topic id; logs kept by topic name before topics had ids
+        continue
+      bases = sorted (int (f[:-4]) for f in os.listdir (path) if f.endswith (".idx"))
+      segments = []
+      for base in bases:
+        segment = Segment (os.path.join (path, "{:020d}".format (base)), base)
+        segment.load ()
+        segments.append (segment)
+      if segments:
+        self.segments[topic] = segments
+
+  def roll (self, topic):
+    ''' seal the topic's last segment, if any, and start a new one '''
+    writer = self.writers.pop (topic, None)
+    if writer is not None:
+      for f in writer:
+        f.close ()
+    segments = self.segments.setdefault (topic, [])
+    base = segments[-1].base + len (segments[-1].offsets) if segments else 1
+    if segments and not segments[-1].offsets:
+      # an empty segment (left from an earlier run) is simply taken over
+      segment = segments[-1]
+    else:
+      os.makedirs (self.topic_dir (topic), exist_ok=True)
+      segment = Segment (os.path.join (self.topic_dir (topic), "{:020d}".format (base)), base)
+      segments.append (segment)
+    writer = (open (segment.path + ".log", "ab"), open (segment.path + ".idx", "ab"))
+    segment.size = writer[0].tell ()
+    self.writers[topic] = writer
+    return writer
+
+  def append (self, batch):
+    ''' log a list of messages as received with copy=False, each a list of frames '''
+    now = time.time_ns ()
+    for frames in batch:
+      # cached values a publisher replays are not new data
+      if len (frames) > 2 and frames[1].bytes == SNAPSHOT_TAG:
+        continue
+      topic = frames[0].bytes
+      writer = self.writers.get (topic)
+      if writer is None or self.segments[topic][-1].size >= self.segment_bytes:
+        if writer is not None:
+          self.flush_topic (topic)
+        writer = self.roll (topic)
+      segment = self.segments[topic][-1]
+      log, idx = writer
+      offset = segment.size
+      size = log.write (FRAME_COUNT.pack (len (frames) - 1))
+      for frame in frames[1:]:
+        buf = frame.buffer
+        size += log.write (FRAME_LEN.pack (len (buf)))
+        size += log.write (buf)
+      idx.write (INDEX_ENTRY.pack (offset, now))
+      segment.offsets.append (offset)
+      segment.stamps.append (now)
+      segment.size += size
+      self.dirty.add (topic)
+    if self.dirty and self.deadline is None:
+      self.deadline = poll_deadline (self.flush_interval)
+
+  def flush_topic (self, topic):
+    for f in self.writers[topic]:
+      f.flush ()
+    # only now may readers see the new messages
+    segment = self.segments[topic][-1]
+    segment.count = len (segment.offsets)
+
+  def flush (self):
+    ''' hand everything appended so far to the OS '''
+    for topic in self.dirty:
+      self.flush_topic (topic)
+    self.dirty.clear ()
+    self.deadline = None
+
+  def close (self):
+    self.flush ()
+    for writer in self.writers.values ():
+      for f in writer:
+        f.close ()
+    self.writers.clear ()
+
+  ########################################
+  # reading, done by the replay thread
+  ########################################
+  def locate (self, topic, from_seq, since):
+    ''' (segment index, message index) of the first message wanted, None if there is none yet '''
+    segments = self.segments.get (topic, [])
+    for n, segment in enumerate (segments):
+      count = segment.count
+      if from_seq:
+        if from_seq < segment.base + count:
+          return n, max (0, from_seq - segment.base)
+      else:
+        i = bisect.bisect_left (segment.stamps, since, 0, count)
+        if i < count:
+          return n, i
+    return None
+
+  def read (self, topic, from_seq, since, until, max_count):
+    ''' up to max_count (seq, frames) from the log, the next seq to ask for and
+    whether that is all there is for now '''
+    segments = self.segments.get (topic, [])
+    start = self.locate (topic, from_seq, since)
+    if start is None:
+      end = segments[-1].base + segments[-1].count if segments else 1
+      return [], max (from_seq, end) if from_seq else end, True
+    n, i = start
+    messages = []
+    while n < len (segments):
+      segment = segments[n]
+      while i < segment.count:
+        if until and segment.stamps[i] >= until:
+          return messages, segment.base + i, True
+        if len (messages) >= max_count:
+          return messages, segment.base + i, False
+        messages.append ((segment.base + i, segment.read (i)))
+        i += 1
+      if segment.count < len (segment.offsets) or n + 1 == len (segments):
+        # the rest is not flushed yet, or there is no more
+        return messages, segment.base + i, True
+      n += 1
+      i = 0
+    return messages, segments[-1].base + segments[-1].count, True
+
+##################################
+#       Replay service
+##################################
+class ReplayService ():
+
+  def __init__ (self, log, logger):
+    self.log = log
+    self.logger = logger
+    self.thread = None
+    self.running = False
+
+  def start (self, context, bind_string):
+    socket = context.socket (zmq.ROUTER)
+    # a subscriber asks for one answer at a time, so what is queued for it
+    # never grows past max_count messages
+    socket.setsockopt (zmq.SNDHWM, 0)
+    socket.bind (bind_string)
+    self.running = True
+    self.thread = threading.Thread (target=self.serve, args=(socket,), daemon=True)
+    self.thread.start ()
+
+  def stop (self):
+    if self.thread is not None:
+      self.running = False
+      self.thread.join ()
+      self.thread = None
+
+  def serve (self, socket):
+    ''' the replay thread '''
+    try:
+      while self.running:
+        if not socket.poll (100):
+          continue
+        identity, buf = socket.recv_multipart ()
+        req = topic_pb2.ReplayReq.FromString (buf)
+        topic = topic_frame (req.topic)
+        messages, next_seq, caught_up = self.log.read (topic, req.from_seq, req.since, req.until, req.max_count)
+        for seq, frames in messages:
+          socket.send_multipart ([identity, topic, REPLAY_TAG, SEQ.pack (seq)] + frames)
+        socket.send_multipart ([identity, topic, REPLAY_END_TAG, SEQ.pack (next_seq), b"1" if caught_up else b"0"])
+        self.logger.debug ("ReplayService::serve - {} messages of {} up to {}".format (len (messages), req.topic, next_seq))
+    except Exception as e:
+      self.logger.error ("ReplayService::serve - replay stopped: {}".format (e))
+    finally:
+      socket.close (linger=0)
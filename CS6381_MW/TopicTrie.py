@@ -0,0 +1,130 @@
+###############################################
+#
+# Purpose: Hierarchical topic names and wildcard subscriptions
+#
+###############################################
+
+# Topics are names made of levels separated by slashes, such as
+# sensors/building1/temperature; a plain name like temperature is a topic
+# of a single level. A subscription may stand for many topics:
+#
+#   *   matches exactly one level        sensors/*/temperature
+#   #   matches the rest, zero or more   sensors/# (sensors itself too);
+#       levels; it can only end a subscription
+#
+# ZMQ can only filter on a byte prefix, under which light would also get
+# lighting, so a SUB socket subscribes to the literal start of each
+# subscription (prefix ()) and whoever receives the samples matches their
+# topics exactly against a TopicTrie of the subscriptions. A match walks the
+# trie level by level, following the topic's own level, * and #, so its cost
+# depends on the depth of the topic, not on how many subscriptions there are.
+
+SEPARATOR = "/"
+ONE = "*"  # exactly one level
+ALL = "#"  # the rest, zero or more levels
+
+def levels (topic):
+  return topic.split (SEPARATOR)
+
+def is_pattern (topic):
+  ''' whether a subscription has wildcards '''
+  return any (level in (ONE, ALL) for level in levels (topic))
+
+def validate (pattern):
+  ''' a # anywhere but at the end is an error '''
+  parts = levels (pattern)
+  if ALL in parts[:-1]:
+    raise ValueError ("{} may only end a subscription: {}".format (ALL, pattern))
+  return pattern
+
+def prefix (pattern):
+  ''' the literal start of a subscription, which is what a SUB socket can filter on '''
+  literal = []
+  for level in levels (pattern):
+    if level in (ONE, ALL):
+      break
+    literal.append (level)
+  return SEPARATOR.join (literal)
+
+def matches (pattern, topic):
+  ''' whether one subscription matches a topic '''
+  parts = levels (topic)
+  for i, level in enumerate (levels (pattern)):
+    if level == ALL:
+      return True
+    if i == len (parts) or (level != ONE and level != parts[i]):
+      return False
+  return len (levels (pattern)) == len (parts)
+
+##################################
+#       The trie
+##################################
+class TopicTrie ():
+
+  class Node ():
+    __slots__ = ("children", "values")
+
+    def __init__ (self):
+      self.children = {}  # level -> Node
+      self.values = set ()  # of the subscriptions ending here
+
+  def __init__ (self):
+    self.root = self.Node ()
+    self.count = 0  # subscriptions held
+
+  def __len__ (self):
+    return self.count
+
+  def add (self, pattern, value):
+    ''' file value under a subscription '''
+    node = self.root
+    for level in levels (validate (pattern)):
+      node = node.children.setdefault (level, self.Node ())
+    if value not in node.values:
+      node.values.add (value)
+      self.count += 1
+
+  def remove (self, pattern, value):
+    path = [self.root]
+    for level in levels (pattern):
+      node = path[-1].children.get (level)
+      if node is None:
+        return
+      path.append (node)
+    if value in path[-1].values:
+      path[-1].values.discard (value)
+      self.count -= 1
+    # prune the branches left empty
+    for level, (parent, node) in zip (reversed (levels (pattern)), reversed (list (zip (path, path[1:])))):
+      if node.values or node.children:
+        break
+      del parent.children[level]
+
+  def match (self, topic):
+    ''' the values of every subscription that matches a topic '''
+    found = set ()
+    parts = levels (topic)
+    nodes = [self.root]
+    for level in parts:
+      following = []
+      for node in nodes:
+        children = node.children
+        rest = children.get (ALL)
+        if rest is not None:
+          found |= rest.values
+        child = children.get (level)
+        if child is not None:
+          following.append (child)
+        child = children.get (ONE)
+        if child is not None:
+          following.append (child)
+      nodes = following
+      if not nodes:
+        return found
+    for node in nodes:
+      found |= node.values
+      # a # after the last level matches zero levels
+      rest = node.children.get (ALL)
+      if rest is not None:
+        found |= rest.values
+    return found
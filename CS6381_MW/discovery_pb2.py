@@ -13,39 +13,55 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0f\x64iscovery.proto\"T\n\x0eRegistrantInfo\x12\n\n\x02id\x18\x01 \x01(\t\x12\x11\n\x04\x61\x64\x64r\x18\x02 \x01(\tH\x00\x88\x01\x01\x12\x11\n\x04port\x18\x03 \x01(\rH\x01\x88\x01\x01\x42\x07\n\x05_addrB\x07\n\x05_port\"T\n\x0bRegisterReq\x12\x13\n\x04role\x18\x01 \x01(\x0e\x32\x05.Role\x12\x1d\n\x04info\x18\x02 \x01(\x0b\x32\x0f.RegistrantInfo\x12\x11\n\ttopiclist\x18\x03 \x03(\t\"G\n\x0cRegisterResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\x12\x13\n\x06reason\x18\x02 \x01(\tH\x00\x88\x01\x01\x42\t\n\x07_reason\"\x0c\n\nIsReadyReq\"\x1d\n\x0bIsReadyResp\x12\x0e\n\x06status\x18\x01 \x01(\x08\"(\n\x13LookupPubByTopicReq\x12\x11\n\ttopiclist\x18\x01 \x03(\t\"X\n\x14LookupPubByTopicResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\x12\'\n\x0epublisherInfos\x18\x02 \x03(\x0b\x32\x0f.RegistrantInfo\"\x11\n\x0fLookupAllPubReq\"T\n\x10LookupAllPubResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\x12\'\n\x0epublisherInfos\x18\x02 \x03(\x0b\x32\x0f.RegistrantInfo\"\xd5\x01\n\x0c\x44iscoveryReq\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12$\n\x0cregister_req\x18\x02 \x01(\x0b\x32\x0c.RegisterReqH\x00\x12\"\n\x0bisready_req\x18\x03 \x01(\x0b\x32\x0b.IsReadyReqH\x00\x12*\n\nlookup_req\x18\x04 \x01(\x0b\x32\x14.LookupPubByTopicReqH\x00\x12\'\n\x0blookall_req\x18\x05 \x01(\x0b\x32\x10.LookupAllPubReqH\x00\x42\t\n\x07\x43ontent\"\xde\x01\n\rDiscoveryResp\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12&\n\rregister_resp\x18\x02 \x01(\x0b\x32\r.RegisterRespH\x00\x12$\n\x0cisready_resp\x18\x03 \x01(\x0b\x32\x0c.IsReadyRespH\x00\x12,\n\x0blookup_resp\x18\x04 \x01(\x0b\x32\x15.LookupPubByTopicRespH\x00\x12)\n\x0clookall_resp\x18\x05 \x01(\x0b\x32\x11.LookupAllPubRespH\x00\x42\t\n\x07\x43ontent*P\n\x04Role\x12\x10\n\x0cROLE_UNKNOWN\x10\x00\x12\x12\n\x0eROLE_PUBLISHER\x10\x01\x12\x13\n\x0fROLE_SUBSCRIBER\x10\x02\x12\r\n\tROLE_BOTH\x10\x03*\\\n\x06Status\x12\x12\n\x0eSTATUS_UNKNOWN\x10\x00\x12\x12\n\x0eSTATUS_SUCCESS\x10\x01\x12\x12\n\x0eSTATUS_FAILURE\x10\x02\x12\x16\n\x12STATUS_CHECK_AGAIN\x10\x03*y\n\x08MsgTypes\x12\x10\n\x0cTYPE_UNKNOWN\x10\x00\x12\x11\n\rTYPE_REGISTER\x10\x01\x12\x10\n\x0cTYPE_ISREADY\x10\x02\x12\x1c\n\x18TYPE_LOOKUP_PUB_BY_TOPIC\x10\x03\x12\x18\n\x14TYPE_LOOKUP_ALL_PUBS\x10\x04\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0f\x64iscovery.proto\"\xa4\x01\n\x0eRegistrantInfo\x12\n\n\x02id\x18\x01 \x01(\t\x12\x11\n\x04\x61\x64\x64r\x18\x02 \x01(\tH\x00\x88\x01\x01\x12\x11\n\x04port\x18\x03 \x01(\rH\x01\x88\x01\x01\x12\x11\n\ttopiclist\x18\x04 \x03(\t\x12\x18\n\x0breplay_port\x18\x05 \x01(\rH\x02\x88\x01\x01\x12\x11\n\tendpoints\x18\x06 \x03(\tB\x07\n\x05_addrB\x07\n\x05_portB\x0e\n\x0c_replay_port\"B\n\x08TopicQos\x12\r\n\x05topic\x18\x01 \x01(\t\x12\x1a\n\x06policy\x18\x02 \x01(\x0e\x32\n.QosPolicy\x12\x0b\n\x03hwm\x18\x03 \x01(\r\"F\n\tPredicate\x12\r\n\x05topic\x18\x01 \x01(\t\x12\r\n\x05\x66ield\x18\x02 \x01(\t\x12\n\n\x02op\x18\x03 \x01(\t\x12\x0f\n\x07operand\x18\x04 \x01(\t\"\x9c\x01\n\x0bRegisterReq\x12\x13\n\x04role\x18\x01 \x01(\x0e\x32\x05.Role\x12\x1d\n\x04info\x18\x02 \x01(\x0b\x32\x0f.RegistrantInfo\x12\x11\n\ttopiclist\x18\x03 \x03(\t\x12\x16\n\x03qos\x18\x04 \x03(\x0b\x32\t.TopicQos\x12\x0e\n\x06\x63odecs\x18\x05 \x03(\t\x12\x1e\n\npredicates\x18\x06 \x03(\x0b\x32\n.Predicate\"$\n\x07TopicId\x12\r\n\x05topic\x18\x01 \x01(\t\x12\n\n\x02id\x18\x02 \x01(\x07\"d\n\x0cRegisterResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\x12\x13\n\x06reason\x18\x02 \x01(\tH\x00\x88\x01\x01\x12\x1b\n\ttopic_ids\x18\x03 \x03(\x0b\x32\x08.TopicIdB\t\n\x07_reason\"\x92\x01\n\nIsReadyReq\x12\x13\n\x06pubnum\x18\x01 \x01(\x03H\x00\x88\x01\x01\x12\x13\n\x06subnum\x18\x02 \x01(\x03H\x01\x88\x01\x01\x12\x13\n\x06\x62roker\x18\x03 \x01(\x08H\x02\x88\x01\x01\x12\x16\n\tbrokernum\x18\x04 \x01(\x03H\x03\x88\x01\x01\x42\t\n\x07_pubnumB\t\n\x07_subnumB\t\n\x07_brokerB\x0c\n\n_brokernum\",\n\x0bTopicCodecs\x12\r\n\x05topic\x18\x01 \x01(\t\x12\x0e\n\x06\x63odecs\x18\x02 \x03(\t\"F\n\x10SubscriberFilter\x12\x12\n\nsubscriber\x18\x01 \x01(\t\x12\x1e\n\npredicates\x18\x02 \x03(\x0b\x32\n.Predicate\"_\n\x0bIsReadyResp\x12\x0e\n\x06status\x18\x01 \x01(\x08\x12\x1c\n\x06\x63odecs\x18\x02 \x03(\x0b\x32\x0c.TopicCodecs\x12\"\n\x07\x66ilters\x18\x03 \x03(\x0b\x32\x11.SubscriberFilter\"9\n\x13LookupPubByTopicReq\x12\x11\n\ttopiclist\x18\x01 \x03(\t\x12\x0f\n\x07version\x18\x02 \x01(\x04\"\x99\x01\n\x14LookupPubByTopicResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\x12\'\n\x0epublisherInfos\x18\x02 \x03(\x0b\x32\x0f.RegistrantInfo\x12\x0f\n\x07version\x18\x03 \x01(\x04\x12\x11\n\tunchanged\x18\x04 \x01(\x08\x12\x1b\n\ttopic_ids\x18\x05 \x03(\x0b\x32\x08.TopicId\"7\n\x0fLookupAllPubReq\x12\x0f\n\x07version\x18\x01 \x01(\x04\x12\x13\n\x0bmax_entries\x18\x02 \x01(\r\"\xc3\x01\n\x10LookupAllPubResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\x12\'\n\x0epublisherInfos\x18\x02 \x03(\x0b\x32\x0f.RegistrantInfo\x12\x0f\n\x07removed\x18\x03 \x03(\t\x12\x0f\n\x07version\x18\x04 \x01(\x04\x12\x0c\n\x04more\x18\x05 \x01(\x08\x12 \n\x07\x62rokers\x18\x06 \x03(\x0b\x32\x0f.RegistrantInfo\x12\x1b\n\ttopic_ids\x18\x07 \x03(\x0b\x32\x08.TopicId\"\x8e\x02\n\x0c\x44iscoveryReq\x12\x1d\n\tnode_type\x18\x01 \x01(\x0e\x32\n.NodeTypes\x12\x1b\n\x08msg_type\x18\x02 \x01(\x0e\x32\t.MsgTypes\x12\x10\n\x03key\x18\x03 \x01(\x03H\x01\x88\x01\x01\x12$\n\x0cregister_req\x18\x04 \x01(\x0b\x32\x0c.RegisterReqH\x00\x12\"\n\x0bisready_req\x18\x05 \x01(\x0b\x32\x0b.IsReadyReqH\x00\x12*\n\nlookup_req\x18\x06 \x01(\x0b\x32\x14.LookupPubByTopicReqH\x00\x12\'\n\x0blookall_req\x18\x07 \x01(\x0b\x32\x10.LookupAllPubReqH\x00\x42\t\n\x07\x43ontentB\x06\n\x04_key\"e\n\rRelayEnvelope\x12\x1d\n\tnode_type\x18\x01 \x01(\x0e\x32\n.NodeTypes\x12\x1b\n\x08msg_type\x18\x02 \x01(\x0e\x32\t.MsgTypes\x12\x10\n\x03key\x18\x03 \x01(\x03H\x00\x88\x01\x01\x42\x06\n\x04_key\"\xde\x01\n\rDiscoveryResp\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12&\n\rregister_resp\x18\x02 \x01(\x0b\x32\r.RegisterRespH\x00\x12$\n\x0cisready_resp\x18\x03 \x01(\x0b\x32\x0c.IsReadyRespH\x00\x12,\n\x0blookup_resp\x18\x04 \x01(\x0b\x32\x15.LookupPubByTopicRespH\x00\x12)\n\x0clookall_resp\x18\x05 \x01(\x0b\x32\x11.LookupAllPubRespH\x00\x42\t\n\x07\x43ontent*P\n\x04Role\x12\x10\n\x0cROLE_UNKNOWN\x10\x00\x12\x12\n\x0eROLE_PUBLISHER\x10\x01\x12\x13\n\x0fROLE_SUBSCRIBER\x10\x02\x12\r\n\tROLE_BOTH\x10\x03*\\\n\x06Status\x12\x12\n\x0eSTATUS_UNKNOWN\x10\x00\x12\x12\n\x0eSTATUS_SUCCESS\x10\x01\x12\x12\n\x0eSTATUS_FAILURE\x10\x02\x12\x16\n\x12STATUS_CHECK_AGAIN\x10\x03*\x8e\x01\n\x08MsgTypes\x12\x10\n\x0cTYPE_UNKNOWN\x10\x00\x12\x11\n\rTYPE_REGISTER\x10\x01\x12\x10\n\x0cTYPE_ISREADY\x10\x02\x12\x1c\n\x18TYPE_LOOKUP_PUB_BY_TOPIC\x10\x03\x12\x18\n\x14TYPE_LOOKUP_ALL_PUBS\x10\x04\x12\x13\n\x0fTYPE_DEREGISTER\x10\x05*G\n\tQosPolicy\x12\x13\n\x0fQOS_DROP_OLDEST\x10\x00\x12\x13\n\x0fQOS_DROP_NEWEST\x10\x01\x12\x10\n\x0cQOS_CONFLATE\x10\x02*A\n\tNodeTypes\x12\x12\n\x0eTYPE_SUCCESSOR\x10\x00\x12\x0e\n\nTYPE_RELAY\x10\x01\x12\x10\n\x0cTYPE_INITIAL\x10\x02\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'discovery_pb2', globals())
 if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
-  _ROLE._serialized_start=987
-  _ROLE._serialized_end=1067
-  _STATUS._serialized_start=1069
-  _STATUS._serialized_end=1161
-  _MSGTYPES._serialized_start=1163
-  _MSGTYPES._serialized_end=1284
-  _REGISTRANTINFO._serialized_start=19
-  _REGISTRANTINFO._serialized_end=103
-  _REGISTERREQ._serialized_start=105
-  _REGISTERREQ._serialized_end=189
-  _REGISTERRESP._serialized_start=191
-  _REGISTERRESP._serialized_end=262
-  _ISREADYREQ._serialized_start=264
-  _ISREADYREQ._serialized_end=276
-  _ISREADYRESP._serialized_start=278
-  _ISREADYRESP._serialized_end=307
-  _LOOKUPPUBBYTOPICREQ._serialized_start=309
-  _LOOKUPPUBBYTOPICREQ._serialized_end=349
-  _LOOKUPPUBBYTOPICRESP._serialized_start=351
-  _LOOKUPPUBBYTOPICRESP._serialized_end=439
-  _LOOKUPALLPUBREQ._serialized_start=441
-  _LOOKUPALLPUBREQ._serialized_end=458
-  _LOOKUPALLPUBRESP._serialized_start=460
-  _LOOKUPALLPUBRESP._serialized_end=544
-  _DISCOVERYREQ._serialized_start=547
-  _DISCOVERYREQ._serialized_end=760
-  _DISCOVERYRESP._serialized_start=763
-  _DISCOVERYRESP._serialized_end=985
+  _ROLE._serialized_start=2060
+  _ROLE._serialized_end=2140
+  _STATUS._serialized_start=2142
+  _STATUS._serialized_end=2234
+  _MSGTYPES._serialized_start=2237
+  _MSGTYPES._serialized_end=2379
+  _QOSPOLICY._serialized_start=2381
+  _QOSPOLICY._serialized_end=2452
+  _NODETYPES._serialized_start=2454
+  _NODETYPES._serialized_end=2519
+  _REGISTRANTINFO._serialized_start=20
+  _REGISTRANTINFO._serialized_end=184
+  _TOPICQOS._serialized_start=186
+  _TOPICQOS._serialized_end=252
+  _PREDICATE._serialized_start=254
+  _PREDICATE._serialized_end=324
+  _REGISTERREQ._serialized_start=327
+  _REGISTERREQ._serialized_end=483
+  _TOPICID._serialized_start=485
+  _TOPICID._serialized_end=521
+  _REGISTERRESP._serialized_start=523
+  _REGISTERRESP._serialized_end=623
+  _ISREADYREQ._serialized_start=626
+  _ISREADYREQ._serialized_end=772
+  _TOPICCODECS._serialized_start=774
+  _TOPICCODECS._serialized_end=818
+  _SUBSCRIBERFILTER._serialized_start=820
+  _SUBSCRIBERFILTER._serialized_end=890
+  _ISREADYRESP._serialized_start=892
+  _ISREADYRESP._serialized_end=987
+  _LOOKUPPUBBYTOPICREQ._serialized_start=989
+  _LOOKUPPUBBYTOPICREQ._serialized_end=1046
+  _LOOKUPPUBBYTOPICRESP._serialized_start=1049
+  _LOOKUPPUBBYTOPICRESP._serialized_end=1202
+  _LOOKUPALLPUBREQ._serialized_start=1204
+  _LOOKUPALLPUBREQ._serialized_end=1259
+  _LOOKUPALLPUBRESP._serialized_start=1262
+  _LOOKUPALLPUBRESP._serialized_end=1457
+  _DISCOVERYREQ._serialized_start=1460
+  _DISCOVERYREQ._serialized_end=1730
+  _RELAYENVELOPE._serialized_start=1732
+  _RELAYENVELOPE._serialized_end=1833
+  _DISCOVERYRESP._serialized_start=1836
+  _DISCOVERYRESP._serialized_end=2058
 # @@protoc_insertion_point(module_scope)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: topic.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0btopic.proto\"\xab\x01\n\x0bPublication\x12\x10\n\x08topic_id\x18\x01 \x01(\r\x12\x0e\n\x06pub_id\x18\x02 \x01(\t\x12\x0b\n\x03seq\x18\x03 \x01(\x04\x12\x11\n\ttimestamp\x18\x04 \x01(\x06\x12\x11\n\x07str_val\x18\x05 \x01(\tH\x00\x12\x14\n\ndouble_val\x18\x06 \x01(\x01H\x00\x12\x11\n\x07int_val\x18\x07 \x01(\x12H\x00\x12\x13\n\tbytes_val\x18\x08 \x01(\x0cH\x00\x42\t\n\x07Payload\".\n\x10PublicationBatch\x12\x1a\n\x04pubs\x18\x01 \x03(\x0b\x32\x0c.Publication\"]\n\tReplayReq\x12\r\n\x05topic\x18\x01 \x01(\t\x12\x10\n\x08\x66rom_seq\x18\x02 \x01(\x04\x12\r\n\x05since\x18\x03 \x01(\x06\x12\r\n\x05until\x18\x04 \x01(\x06\x12\x11\n\tmax_count\x18\x05 \x01(\rb\x06proto3')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'topic_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _PUBLICATION._serialized_start=16
+  _PUBLICATION._serialized_end=187
+  _PUBLICATIONBATCH._serialized_start=189
+  _PUBLICATIONBATCH._serialized_end=235
+  _REPLAYREQ._serialized_start=237
+  _REPLAYREQ._serialized_end=330
+# @@protoc_insertion_point(module_scope)
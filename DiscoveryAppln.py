@@ -30,17 +30,19 @@
 # it will be false.
 
 import random # random number generation
-import hashlib  # for the secure hash library
+import bisect # for searching the publisher change log
 import argparse # argument parsing
 import json # for JSON
 import configparser # for configuration parsing
 import logging # for logging. Use it in place of print statements.
-import hashlib  # for the secure hash library
 
 # Now import our CS6381 Middleware
 from CS6381_MW.DiscoveryMW import DiscoveryMW
 # We also need the message formats to handle incoming responses.
 from CS6381_MW import discovery_pb2
+from CS6381_MW.Common import BrokerRing, TopicIds, ring_hash
+from CS6381_MW.TopicTrie import TopicTrie, is_pattern
+from CS6381_MW import LogUtil
 
 # import any other packages you need.
 from enum import Enum  # for an enumeration we are using to describe what state we are in
@@ -65,7 +67,17 @@ class DiscoveryAppln():
         #temp data
         self.pub_data={}
         self.sub_data={}
-        self.broker={}
+        self.ids=TopicIds() # the ids handed out for the data path
+        self.brokernum=1 # brokers expected in Broker mode
+        self.brokers={} # broker name -> addr, port
+        self.broker_ring=None # which broker owns which topic
+        self.broker_version=0 # bumped on every broker registration
+        # publisher change log so the broker can fetch just what changed
+        self.pub_version=0 # bumped on every publisher add/remove
+        self.pub_log=[] # publisher names in the order they changed
+        self.pub_log_versions=[] # version of each pub_log entry (sorted)
+        self.pub_latest={} # publisher name -> version of its latest change
+        self.page_size=None # most publishers sent in one LookupAll response
         self.dissemination=None
         self.discovery=None
         #DHT node
@@ -96,6 +108,9 @@ class DiscoveryAppln():
             self.name=args.name
             self.pubnum=args.pubnum
             self.subnum=args.subnum
+            self.page_size=args.page_size
+            self.brokernum=args.brokernum
+            self.broker_ring=BrokerRing(self.m)
 
             # Now, get the configuration object
             self.logger.debug ("DiscoveryAppln::configure - parsing config.ini")
@@ -109,11 +124,11 @@ class DiscoveryAppln():
             # everything
             self.logger.debug ("DiscoveryAppln::configure - initialize the middleware object")
             self.mw_obj = DiscoveryMW (self.logger)
-            self.mw_obj.configure (addr,port) # pass remainder of the args to the m/w object
+            self.mw_obj.configure (addr,port,args.transports) # pass remainder of the args to the m/w object
             
             self.logger.debug ("DiscoveryAppln::configure - connect to all finger nodes")
             for index in range(self.m):
-                finger_node=self.finger_table[(self.hash+2**index)%(2**self.m)]
+                finger_node=self.finger_table[index][1]
                 disc_addr=self.dht[finger_node]['IP']+':'+str(self.dht[finger_node]['port'])
                 self.mw_obj.connect_disc(index,disc_addr)
 
@@ -149,15 +164,9 @@ class DiscoveryAppln():
     def hash_func (self, topic):
         self.logger.debug ("DiscoveryAppln::hash_func")
 
-        # first get the digest from hashlib and then take the desired number of bytes from the
-        # lower end of the 256 bits hash. Big or little endian does not matter.
-        hash_str=topic
-        hash_digest = hashlib.sha256 (bytes (hash_str, "utf-8")).digest ()  # this is how we get the digest or hash value
-        # figure out how many bytes to retrieve
-        num_bytes = int(self.m/8)  # otherwise we get float which we cannot use below
-        hash_val = int.from_bytes (hash_digest[:num_bytes], "big")  # take lower N number of bytes
-
-        return hash_val
+        # the first m bits of the sha256 digest; the broker ring uses the same
+        # positions so topics land on brokers the way they land on DHT nodes
+        return ring_hash(topic,self.m)
 
     def configure_DHT_logic(self,args):
         try:
@@ -168,6 +177,11 @@ class DiscoveryAppln():
             with open (self.json_file, "r") as f:
                 dht_db=json.load (f)
                 dht_json=dht_db['dht']
+            # with more than one node, a node would only ever see the
+            # registrations made with it, never get ready and miss publishers
+            # in its lookups, until isready and the lookups walk the ring
+            if len(dht_json)>1:
+                raise ValueError ("{} has {} DHT nodes; distributed discovery answers from the node asked, so only a ring of one node is supported (exp_generator.py -D 1)".format (self.json_file,len(dht_json)))
     
             # Config my host and hash
             for dht_node in dht_json:
@@ -271,46 +285,37 @@ class DiscoveryAppln():
         except Exception as e:
             raise e
     
-    def chord_algurithm(self,register_req, key):
+    def chord_algurithm(self,msg_type,payload,key):
+        ''' route a relayed request by its key; the payload is passed on opaque '''
         self.logger.info ("DiscoveryAppln::chord_algurithm")
         index=self.find_successor(self.hash,key)
         node_type=None
-        status=discovery_pb2.STATUS_SUCCESS
         if index==0:
             node_type=discovery_pb2.TYPE_SUCCESSOR
         else:
             node_type=discovery_pb2.TYPE_RELAY
-        self.mw_obj.relay_register_req(status,index,node_type,key,register_req)
+        self.mw_obj.relay_register_req(index,node_type,msg_type,key,payload)
 
     def isready_iterate_chord(self,isready_req, key):
         self.logger.info ("DiscoveryAppln::isready_iterate_chord")
         pubnum=isready_req.pubnum+self.cur_pubnum
         subnum=isready_req.subnum+self.cur_subnum
-        broker=(isready_req.broker or (len(self.broker)>0))
+        brokernum=isready_req.brokernum+len(self.brokers)
         node_type=None
         if self.finger_table[0][1]==key:
             node_type=discovery_pb2.TYPE_SUCCESSOR
         else:
             node_type=discovery_pb2.TYPE_RELAY
-        self.mw_obj.relay_isready_req(pubnum,subnum,broker,node_type,key)
+        self.mw_obj.relay_isready_req(pubnum,subnum,brokernum>0,brokernum,node_type,key)
 
     def register_request_encode(self,reg_req):
         try:
             self.logger.info ("DiscoveryAppln::register encode")
-            #find which node should be stored
-            topiclist=reg_req.topiclist[:]
-            for topic in topiclist:
-                hash_value=self.hash_func(topic)
-                index=self.find_successor(self.hash,hash_value)
-                node_type=None
-                if index==0:
-                    node_type=discovery_pb2.TYPE_SUCCESSOR
-                else:
-                    node_type=discovery_pb2.TYPE_RELAY
-                self.mw_obj.send_chord_register_req(index,node_type,hash_value,reg_req,topic)
-
-            #waiting for chord reply 
-            return None
+            # isready, lookup and lookall are answered by the node asked, from
+            # what registered with it, so registrations stay with that node
+            # too rather than going round the ring to the owner of each topic
+            # (which is why configure_DHT_logic takes a ring of one node only)
+            return self.register_request(reg_req)
             
         except Exception as e:
             raise e
@@ -318,33 +323,52 @@ class DiscoveryAppln():
     def isready_request_encode(self,isready_req):
         try:
             self.logger.info ("DiscoveryAppln::is ready encode")
-            #iterate all dhtNodes
-            pubnum=self.cur_pubnum
-            subnum=self.cur_subnum
-            broker=(len(self.broker)>0)
-            node_type=discovery_pb2.TYPE_RELAY
-            self.mw_obj.send_chord_isready_req(pubnum,subnum,broker,node_type)
-
-            #waiting for chord reply 
-            return None
+            # the walk around the ring adding up every node's counts is not in
+            # place yet, so the node asked answers from what registered with it
+            isready_req.pubnum=self.cur_pubnum
+            isready_req.subnum=self.cur_subnum
+            isready_req.brokernum=len(self.brokers)
+            isready_req.broker=len(self.brokers)>0
+            return self.isready_request(isready_req)
             
         except Exception as e:
             raise e
         
-    def lookup_request_encode(self,reg_req):
-        pass
+    def lookup_request_encode(self,lookup_req):
+        # as with LookupAll, the node the subscriber talks to answers itself
+        return self.lookup_request(lookup_req)
         
-    def lookall_request_encode(self,reg_req):
-        pass
+    def lookall_request_encode(self,lookall_req):
+        # the ring walk for LookupAll is not in place yet, so the node the broker
+        # talks to answers from the publishers registered with it
+        return self.lookall_request(lookall_req)
+
+    def deregister_request_encode(self,reg_req):
+        # same as above, the node the publisher talks to drops it
+        return self.deregister_request(reg_req)
         
+    def topic_ids(self,topics):
+        ''' (topic, id) of topics, handing out ids to those new to us; raises
+        ValueError if a topic's id is another's already '''
+        return [(topic,self.ids.id(topic)) for topic in topics]
+
     def register_request(self,reg_req):
         try:
             self.logger.info ("DiscoveryAppln::register")
             status=discovery_pb2.STATUS_UNKNOWN
             reason=None
-            reg_info = discovery_pb2.RegistrantInfo ()
-            reg_info.CopyFrom(reg_req.info)
-            if reg_req.role==discovery_pb2.ROLE_PUBLISHER:
+            topic_ids=()
+            reg_info = reg_req.info
+            if reg_req.role!=discovery_pb2.ROLE_BOTH:
+                # ids for the data path; wildcard subscriptions get theirs
+                # with every lookup
+                try:
+                    topic_ids=self.topic_ids([topic for topic in reg_req.topiclist if not is_pattern(topic)])
+                except ValueError as e:
+                    reason=str(e)
+            if reason is not None:
+                status=discovery_pb2.STATUS_FAILURE
+            elif reg_req.role==discovery_pb2.ROLE_PUBLISHER:
                 pub_name=reg_info.id
                 if pub_name in self.pub_data.keys():
                     status=discovery_pb2.STATUS_FAILURE
@@ -355,7 +379,10 @@ class DiscoveryAppln():
                     self.pub_data[pub_name]={}
                     self.pub_data[pub_name]['addr']=reg_info.addr
                     self.pub_data[pub_name]['port']=reg_info.port
+                    # its ipc and inproc endpoints, for those on its host
+                    self.pub_data[pub_name]['endpoints']=reg_info.endpoints[:]
                     self.pub_data[pub_name]['topiclist']=reg_req.topiclist[:]
+                    self.record_pub_change(pub_name)
 
             elif reg_req.role==discovery_pb2.ROLE_SUBSCRIBER:
                 sub_name=reg_info.id
@@ -367,22 +394,30 @@ class DiscoveryAppln():
                     status=discovery_pb2.STATUS_SUCCESS
                     self.sub_data[sub_name]={}
                     self.sub_data[sub_name]['topiclist']=reg_req.topiclist[:]
+                    # compression codecs it can undo
+                    self.sub_data[sub_name]['codecs']=reg_req.codecs[:]
+                    # and the samples it wants
+                    self.sub_data[sub_name]['predicates']=list(reg_req.predicates)
 
             elif reg_req.role==discovery_pb2.ROLE_BOTH:
                 broker_name=reg_info.id
-                if len(self.broker)>0:
+                if broker_name in self.brokers.keys():
                     status=discovery_pb2.STATUS_FAILURE
-                    reason='Broker has already exits!'
+                    reason='Name has already exits!'
                 else:
                     status=discovery_pb2.STATUS_SUCCESS
-                    self.broker['name']=broker_name
-                    self.broker['addr']=reg_info.addr
-                    self.broker['port']=reg_info.port
-                    self.broker['topiclist']=reg_req.topiclist[:]
+                    self.brokers[broker_name]={}
+                    self.brokers[broker_name]['addr']=reg_info.addr
+                    self.brokers[broker_name]['port']=reg_info.port
+                    self.brokers[broker_name]['endpoints']=reg_info.endpoints[:]
+                    # 0 when the broker keeps no topic log to replay from
+                    self.brokers[broker_name]['replay_port']=reg_info.replay_port
+                    self.broker_ring.add(broker_name,reg_info.addr,reg_info.port)
+                    self.broker_version+=1
             else:
                 raise ValueError ("Unknown type of request")
             
-            self.mw_obj.send_register_resp(status,reason)
+            self.mw_obj.send_register_resp(status,reason,topic_ids=topic_ids if status==discovery_pb2.STATUS_SUCCESS else ())
             # return a timeout of zero so that the event loop in its next iteration will immediately make
             # an upcall to us
             return 0
@@ -390,13 +425,73 @@ class DiscoveryAppln():
         except Exception as e:
             raise e
 
+
+    def deregister_request(self,reg_req):
+        try:
+            self.logger.info ("DiscoveryAppln::deregister")
+            status=discovery_pb2.STATUS_SUCCESS
+            reason=None
+            pub_name=reg_req.info.id
+            if reg_req.role!=discovery_pb2.ROLE_PUBLISHER:
+                raise ValueError ("Only publishers deregister")
+            if pub_name in self.pub_data.keys():
+                del self.pub_data[pub_name]
+                self.cur_pubnum-=1
+                self.record_pub_change(pub_name)
+            else:
+                status=discovery_pb2.STATUS_FAILURE
+                reason='Name is not registered!'
+
+            self.mw_obj.send_register_resp(status,reason,discovery_pb2.TYPE_DEREGISTER)
+            return 0
+
+        except Exception as e:
+            raise e
+
+    def record_pub_change(self,pub_name):
+        ''' log that a publisher was added or removed under a new registry version '''
+        self.pub_version+=1
+        self.pub_latest[pub_name]=self.pub_version
+        self.pub_log.append(pub_name)
+        self.pub_log_versions.append(self.pub_version)
+
+        # entries superseded by a later change of the same publisher are skipped
+        # when reading; once they are half the log, squeeze them out
+        if len(self.pub_log)>2*len(self.pub_latest):
+            live=[i for i in range(len(self.pub_log)) if self.pub_latest[self.pub_log[i]]==self.pub_log_versions[i]]
+            self.pub_log=[self.pub_log[i] for i in live]
+            self.pub_log_versions=[self.pub_log_versions[i] for i in live]
+
+    def pub_delta(self,version,limit):
+        ''' up to limit (0 = no limit) publishers added and removed after the given registry version
+
+        Returns the added names, removed names, the version the caller is at after
+        applying them and whether more changes are left after that version. '''
+        added=[]
+        removed=[]
+        start=bisect.bisect_right(self.pub_log_versions,version)
+        for i in range(start,len(self.pub_log)):
+            pub_name=self.pub_log[i]
+            if self.pub_latest[pub_name]!=self.pub_log_versions[i]:
+                continue # changed again later, that entry will report it
+            if pub_name not in self.pub_data and version==0:
+                continue # a broker starting from scratch has nothing to remove
+            if limit and len(added)+len(removed)==limit:
+                # the page is full; the log version of the last entry we took is
+                # the cursor the broker continues from
+                return added,removed,self.pub_log_versions[i-1],True
+            if pub_name in self.pub_data:
+                added.append(pub_name)
+            else:
+                removed.append(pub_name)
+        return added,removed,self.pub_version,False
     
     def isready_request(self,isready_req):
         try:
             self.logger.info ("DiscoveryAppln::publisher is ready")
             if isready_req.pubnum==self.pubnum and isready_req.subnum==self.subnum:
                 if self.dissemination == "Broker":
-                    if isready_req.broker:
+                    if isready_req.brokernum>=self.brokernum:
                         self.state = self.State.READY
                         self.is_ready=True
                     else:
@@ -404,7 +499,12 @@ class DiscoveryAppln():
                 else:
                     self.state = self.State.READY
                     self.is_ready=True
-            self.mw_obj.send_isready_resp(self.is_ready)
+            # once everyone is in, the publishers learn what they may compress
+            # with and which samples nobody wants
+            if self.is_ready:
+                self.mw_obj.send_isready_resp(True,self.topic_codecs(),self.topic_filters())
+            else:
+                self.mw_obj.send_isready_resp(False)
             # return a timeout of zero so that the event loop in its next iteration will immediately make
             # an upcall to us
             return 0
@@ -412,30 +512,86 @@ class DiscoveryAppln():
         except Exception as e:
             raise e
 
+    def resolve_topics(self,topiclist):
+        ''' the topics a subscriber's topic list stands for: its plain topics and
+        every topic of the registered publishers its wildcard subscriptions match '''
+        topics=[topic for topic in topiclist if not is_pattern(topic)]
+        patterns=TopicTrie()
+        for topic in topiclist:
+            if is_pattern(topic):
+                patterns.add(topic,topic)
+        if len(patterns):
+            published=set(topic for publisher in self.pub_data.values() for topic in publisher['topiclist'])
+            topics.extend(sorted(topic for topic in published-set(topics) if patterns.match(topic)))
+        return topics
+
+    def topic_codecs(self):
+        ''' per topic, the compression codecs every one of its subscribers can undo '''
+        codecs={}
+        for subscriber in self.sub_data.values():
+            for topic in self.resolve_topics(subscriber['topiclist']):
+                if topic in codecs:
+                    codecs[topic]&=set(subscriber['codecs'])
+                else:
+                    codecs[topic]=set(subscriber['codecs'])
+        return codecs
+
+    def topic_filters(self):
+        ''' per subscriber, its predicates on the topics all of whose subscribers filter;
+        a topic with any subscriber that wants everything is not filtered at all '''
+        filtered={}
+        for subscriber in self.sub_data.values():
+            mine={predicate.topic for predicate in subscriber['predicates']}
+            for topic in self.resolve_topics(subscriber['topiclist']):
+                filtered[topic]=filtered.get(topic,True) and topic in mine
+        filters={}
+        for sub_name,subscriber in self.sub_data.items():
+            predicates=[predicate for predicate in subscriber['predicates'] if filtered.get(predicate.topic)]
+            if predicates:
+                filters[sub_name]=predicates
+        return filters
+
     def lookup_request(self,lookup_req):
         try:
             self.logger.info ("DiscoveryAppln::subscriber lookup")
             
-            sub_topiclist=lookup_req.topiclist[:]
+            # wildcard subscriptions stand for the topics published so far that
+            # they match
+            sub_topiclist=self.resolve_topics(lookup_req.topiclist)
             lookupInfos=[]
+            endpoints={} # name -> its ipc and inproc endpoints
+            version=0
             #get the topic
-            if self.is_ready:
+            if self.is_ready and self.dissemination == "Broker" and not self.broker_ring:
+                # no broker on the ring owns our topics; answer as not ready so
+                # that the subscriber asks again soon rather than failing here
+                self.logger.debug ("DiscoveryAppln::lookup - no broker owns any topic, answer as not ready")
+            elif self.is_ready:
+                # both counters only grow, so their sum changes whenever either does
+                version=self.pub_version+self.broker_version
+                if lookup_req.version==version:
+                    # the subscriber is up to date; its periodic refresh costs us
+                    # next to nothing
+                    self.mw_obj.send_lookup_resp(lookupInfos,version,True)
+                    return 0
+
                 if self.dissemination == "Broker":
-                    brokerInfo=discovery_pb2.RegistrantInfo()
-                    brokerInfo.id=self.broker['name']
-                    brokerInfo.addr=self.broker['addr']
-                    brokerInfo.port=self.broker['port']
-                    lookupInfos.append(brokerInfo)  
+                    # every topic goes to the broker owning it on the ring, so
+                    # the subscriber only connects to the brokers it needs
+                    owned={}
+                    for topic in sub_topiclist:
+                        owner=self.broker_ring.owner(topic)
+                        owned.setdefault(owner,[]).append(topic)
+                    for (name,addr,port),topics in owned.items():
+                        lookupInfos.append((name,addr,port,topics,self.brokers[name]['replay_port']))
+                        endpoints[name]=self.brokers[name]['endpoints']
                 else:
                     for pubname, publisher in self.pub_data.items():
                         if list(set(publisher['topiclist'])&set(sub_topiclist)):
-                            publisherInfo=discovery_pb2.RegistrantInfo()
-                            publisherInfo.id=pubname
-                            publisherInfo.addr=publisher['addr']
-                            publisherInfo.port=publisher['port']
-                            lookupInfos.append(publisherInfo)
+                            lookupInfos.append((pubname,publisher['addr'],publisher['port']))
+                            endpoints[pubname]=publisher['endpoints']
 
-            self.mw_obj.send_lookup_resp(lookupInfos)
+            self.mw_obj.send_lookup_resp(lookupInfos,version,topic_ids=self.topic_ids(sub_topiclist),endpoints=endpoints)
             # return a timeout of zero so that the event loop in its next iteration will immediately make
             # an upcall to us
             return 0
@@ -445,19 +601,24 @@ class DiscoveryAppln():
 
     def lookall_request(self,lookall_req):
         try:
-            self.logger.info ("DiscoveryAppln::broker lookall")
+            self.logger.info ("DiscoveryAppln::broker lookall since version {}".format (lookall_req.version))
             
-            #get the topic
+            #only send what changed since the version the broker already has, one
+            #page at a time so neither side ever holds the whole registry in a message
             if self.dissemination == "Broker":
-                publisherInfos=[]
-                for pubname, publisher in self.pub_data.items():
-                    publisherInfo=discovery_pb2.RegistrantInfo()
-                    publisherInfo.id=pubname
-                    publisherInfo.addr=publisher['addr']
-                    publisherInfo.port=publisher['port']
-                    publisherInfos.append(publisherInfo)
-
-                self.mw_obj.send_lookall_resp(publisherInfos)
+                limit=self.page_size
+                if lookall_req.max_entries>0 and (limit==0 or lookall_req.max_entries<limit):
+                    limit=lookall_req.max_entries
+                added,removed,version,more=self.pub_delta(lookall_req.version,limit)
+
+                # the middleware fills the response straight from these tuples; the
+                # topics tell the brokers what there is to own
+                publisherInfos=[(pubname,self.pub_data[pubname]['addr'],self.pub_data[pubname]['port'],self.pub_data[pubname]['topiclist']) for pubname in added]
+                # the broker tier is small, so it goes out whole every time and
+                # each broker works out its own slice from it
+                topics=set(topic for pubname in added for topic in self.pub_data[pubname]['topiclist'])
+                endpoints={pubname:self.pub_data[pubname]['endpoints'] for pubname in added}
+                self.mw_obj.send_lookall_resp(publisherInfos,removed,version,more,self.broker_ring.members(),self.topic_ids(sorted(topics)),endpoints)
             else:
                 raise ValueError ("Not broker, not allowed")
             # return a timeout of zero so that the event loop in its next iteration will immediately make
@@ -478,14 +639,15 @@ class DiscoveryAppln():
             self.logger.info ("     name: {}".format (self.name))
             self.logger.info ("     Num of publisher: {}".format (self.pubnum))
             self.logger.info ("     Num of subscriber: {}".format (self.subnum))
+            if self.dissemination == "Broker":
+                self.logger.info ("     Num of broker: {}".format (self.brokernum))
             if self.discovery=='Distributed':
                 self.logger.info ("------------------------------")
                 self.logger.info ("Finger Table::dump")
-                for key in self.finger_table:
-                    value=self.finger_table[key]
+                for start,successor in self.finger_table:
                     self.logger.info ("------------------------------")
-                    self.logger.info ("     Start: {}".format (key))
-                    self.logger.info ("     Successor: {}".format (value))
+                    self.logger.info ("     Start: {}".format (start))
+                    self.logger.info ("     Successor: {}".format (successor))
             self.logger.info ("**********************************")
         except Exception as e:
             raise e
@@ -511,15 +673,21 @@ def parseCmdLineArgs ():
 
     parser.add_argument ("-P", "--pubnum", type=int, default="1", help="total number of publishers")
     
+    parser.add_argument ("-B", "--brokernum", type=int, default=1, help="total number of brokers in Broker mode, each owning a slice of the topics, default 1")
+
     parser.add_argument ("-a", "--addr", default="localhost", help="IP addr of this discovery to advertise (default: localhost)")
     
     parser.add_argument ("-p", "--port", type=int, default=5555, help="Port number on which our underlying discovery ZMQ service runs, default=5555")
     
+    parser.add_argument ("-g", "--page_size", type=int, default=1000, help="most publishers returned in one LookupAll response (0 = no limit), default 1000")
+
     parser.add_argument ("-j", "--json_file", default="dht.json", help="JSON file with the database of all DHT nodes, default dht.json")
 
     parser.add_argument ("-c", "--config", default="config.ini", help="configuration file (default: config.ini)")
 
-    parser.add_argument ("-l", "--loglevel", type=int, default=logging.DEBUG, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+    parser.add_argument ("-x", "--transports", default="inproc,ipc", help="Local transports besides tcp, comma separated inproc,ipc, over which the DHT nodes on our host talk to each other; every node has to use the same. \"tcp\" turns them off. Default inproc,ipc")
+
+    parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
 
     return parser.parse_args()
 
@@ -567,9 +735,9 @@ def main ():
 ###################################
 if __name__ == "__main__":
 
-  # set underlying default logging capabilities
-  logging.basicConfig (level=logging.DEBUG,
-                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+  # set underlying default logging capabilities; records are written out by
+  # a thread of their own so that logging never holds up the messaging
+  LogUtil.start (level=logging.DEBUG, fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 
   main ()
\ No newline at end of file
@@ -0,0 +1,229 @@
+###############################################
+#
+# Purpose: Many logical publishers and subscribers in one process
+#
+###############################################
+
+# Every logical publisher or subscriber here is a PublisherAppln or
+# SubscriberAppln of its own, with its own name, port, topics and discovery
+# registration, and takes the options it would take when run on its own
+# (passed with -A and -B). What they share is one ZMQ context, with as many
+# I/O threads as -I asks for, and one event loop (see CS6381_MW/Reactor.py),
+# so that a thousand of them cost one interpreter instead of a thousand.
+# Being in the same context, they talk to each other over inproc.
+#
+#   python3 HostAppln.py -n h2 -P 200 -S 50 -a 10.0.0.2 -d 10.0.0.1:5555 -A "-f 10 -i 1000 -T 5" -B "-T 3"
+#
+# Publisher i is called <name>-pub<i> and listens on port -p + i, subscriber
+# i is <name>-sub<i>. Every subscriber writes its latencies where its -o says
+# (default <its name>_latency.json) when the run ends, which is once every
+# one of them is done or on SIGINT/SIGTERM. Discovery has to be told about
+# all of them (DiscoveryAppln -P and -S).
+
+# import the needed packages
+import argparse # for argument parsing
+import logging # for logging. Use it in place of print statements.
+import shlex # to split the options handed on to the publishers and subscribers
+import signal # to end the run cleanly when we are told to stop
+
+try:
+  import resource # to raise our file descriptor limit
+except ImportError:
+  resource = None
+
+import PublisherAppln
+import SubscriberAppln
+
+# Now import our CS6381 Middleware
+from CS6381_MW.Reactor import Reactor
+from CS6381_MW import LogUtil
+
+# ZMQ sockets one of us may need: its REQ and PUB or SUB socket plus the
+# DEALER sockets of a subscriber with QoS and of its replays
+SOCKETS_PER_ENTITY = 8
+
+##################################
+#       HostAppln class
+##################################
+class HostAppln ():
+
+  ########################################
+  # constructor
+  ########################################
+  def __init__ (self, logger):
+    self.logger = logger  # internal logger for print statements
+    self.reactor = None # runs the event loops of everybody we host
+    self.publishers = [] # PublisherAppln objects we host
+    self.subscribers = [] # SubscriberAppln objects we host
+
+  ########################################
+  # configure/initialize
+  ########################################
+  def configure (self, args):
+    ''' Initialize the object '''
+
+    try:
+      self.logger.info ("HostAppln::configure")
+
+      entities = args.num_pubs + args.num_subs
+      if entities == 0:
+        raise ValueError ("Nothing to host; use -P and/or -S")
+      self.raise_fd_limit ()
+      self.reactor = Reactor (self.logger, args.io_threads, max (1023, SOCKETS_PER_ENTITY * entities))
+
+      # the options every one of them gets, ahead of their own
+      common = ["-a", args.addr, "-d", args.discovery, "-c", args.config, "-l", str (args.loglevel)]
+
+      self.logger.debug ("HostAppln::configure - {} publishers".format (args.num_pubs))
+      for i in range (args.num_pubs):
+        name = "{}-pub{}".format (args.name, i)
+        pub_args = PublisherAppln.parseCmdLineArgs (common + ["-n", name, "-p", str (args.port + i)] + shlex.split (args.pub_args))
+        pub_app = PublisherAppln.PublisherAppln (logging.getLogger ("HostAppln.{}".format (name)))
+        pub_app.configure (pub_args, self.reactor)
+        self.publishers.append (pub_app)
+
+      self.logger.debug ("HostAppln::configure - {} subscribers".format (args.num_subs))
+      for i in range (args.num_subs):
+        name = "{}-sub{}".format (args.name, i)
+        sub_args = SubscriberAppln.parseCmdLineArgs (common + ["-n", name, "-p", str (args.port + args.num_pubs + i)] + shlex.split (args.sub_args))
+        sub_app = SubscriberAppln.SubscriberAppln (logging.getLogger ("HostAppln.{}".format (name)))
+        sub_app.configure (sub_args, self.reactor)
+        self.subscribers.append (sub_app)
+
+      self.logger.info ("HostAppln::configure - configuration complete")
+
+    except Exception as e:
+      raise e
+
+  def raise_fd_limit (self):
+    ''' every ZMQ socket and connection takes file descriptors, so we go as
+    high as we are allowed to '''
+    if resource is None:
+      return
+    soft, hard = resource.getrlimit (resource.RLIMIT_NOFILE)
+    if soft != hard:
+      resource.setrlimit (resource.RLIMIT_NOFILE, (hard, hard))
+      self.logger.debug ("HostAppln::raise_fd_limit - from {} to {}".format (soft, hard))
+
+  ########################################
+  # driver program
+  ########################################
+  def driver (self):
+    ''' Driver program '''
+
+    try:
+      self.logger.info ("HostAppln::driver")
+
+      # everybody starts the way its own driver would, registering with
+      # discovery right away
+      for app in self.publishers + self.subscribers:
+        app.start ()
+        self.reactor.add (app.mw_obj, timeout=0)
+
+      # a SIGTERM ends the run the same way a Ctrl-C does, so that the
+      # subscribers still get to save their latencies
+      signal.signal (signal.SIGTERM, self.stop)
+
+      try:
+        self.reactor.run ()
+      except KeyboardInterrupt:
+        self.logger.info ("HostAppln::driver - told to stop")
+
+      for sub_app in self.subscribers:
+        sub_app.finish ()
+      self.reactor.close ()
+
+      self.logger.info ("HostAppln::driver completed")
+
+    except Exception as e:
+      raise e
+
+  def stop (self, signum, frame):
+    ''' signal handler that gets us out of the event loop '''
+    raise KeyboardInterrupt
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  # instantiate a ArgumentParser object
+  parser = argparse.ArgumentParser (description="Many publishers and subscribers in one process")
+
+  parser.add_argument ("-n", "--name", default="host", help="Prefix of the names of everyone we host, which have to be unique system wide, default host")
+
+  parser.add_argument ("-P", "--num_pubs", type=int, default=0, help="Publishers to host, default 0")
+
+  parser.add_argument ("-S", "--num_subs", type=int, default=0, help="Subscribers to host, default 0")
+
+  parser.add_argument ("-a", "--addr", default="localhost", help="IP addr everyone we host advertises (default: localhost)")
+
+  parser.add_argument ("-p", "--port", type=int, default=6000, help="Publisher i listens on this port + i, subscribers get the ports after those, default 6000")
+
+  parser.add_argument ("-d", "--discovery", default="localhost:5555", help="IP Addr:Port combo for the discovery service, default localhost:5555")
+
+  parser.add_argument ("-c", "--config", default="config.ini", help="configuration file (default: config.ini)")
+
+  parser.add_argument ("-I", "--io_threads", type=int, default=1, help="ZMQ I/O threads shared by everyone we host, default 1")
+
+  parser.add_argument ("-A", "--pub_args", default="", help="Further PublisherAppln options for every publisher, e.g. \"-f 10 -i 1000 -T 5\", default none")
+
+  parser.add_argument ("-B", "--sub_args", default="", help="Further SubscriberAppln options for every subscriber, e.g. \"-T 3 -r 2\", default none")
+
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  try:
+    # obtain a system wide logger and initialize it to debug level to begin with
+    logging.info ("Main - acquire a child logger and then log messages in the child")
+    logger = logging.getLogger ("HostAppln")
+
+    # first parse the arguments
+    logger.debug ("Main: parse command line arguments")
+    args = parseCmdLineArgs ()
+
+    # reset the log level to as specified; the loggers of everyone we host
+    # are children of ours
+    logger.debug ("Main: resetting log level to {}".format (args.loglevel))
+    logger.setLevel (args.loglevel)
+    logger.debug ("Main: effective log level is {}".format (logger.getEffectiveLevel ()))
+
+    # Obtain the host appln object
+    logger.debug ("Main: obtain the host appln object")
+    host_app = HostAppln (logger)
+
+    # configure the object
+    logger.debug ("Main: configure the host appln object")
+    host_app.configure (args)
+
+    # now invoke the driver program
+    logger.debug ("Main: invoke the host appln driver")
+    host_app.driver ()
+
+  except Exception as e:
+    logger.error ("Exception caught in main - {}".format (e))
+    return
+
+
+###################################
+#
+# Main entry point
+#
+###################################
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities; records are written out by
+  # a thread of their own so that logging never holds up the messaging
+  LogUtil.start (level=logging.DEBUG, fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+  main ()
@@ -53,9 +53,12 @@ import logging # for logging. Use it in place of print statements.
 # Import our topic selector. Feel free to use alternate way to
 # get your topics of interest
 from topic_selector import TopicSelector
+from load_generator import LoadGenerator, PayloadSizes, ARRIVALS
 
 # Now import our CS6381 Middleware
 from CS6381_MW.PublisherMW import PublisherMW
+from CS6381_MW.Common import PublicationScheduler
+from CS6381_MW import LogUtil
 # We also need the message formats to handle incoming responses.
 from CS6381_MW import discovery_pb2
 
@@ -76,7 +79,8 @@ class PublisherAppln ():
     REGISTER = 2,
     ISREADY = 3,
     DISSEMINATE = 4,
-    COMPLETED = 5
+    DEREGISTER = 5,
+    COMPLETED = 6
 
   ########################################
   # constructor
@@ -87,7 +91,15 @@ class PublisherAppln ():
     self.topiclist = None # the different topics that we publish on
     self.iters = None   # number of iterations of publication
     self.frequency = None # rate at which dissemination takes place
+    self.burst = None # most overdue rounds published back to back
+    self.scheduler = None # tells us when the next round of publication is due
+    self.round = 0 # rounds of publication done so far
+    self.load = None # open loop load generator, if we do not publish in rounds
+    self.ts = None # gives us the values we publish
     self.num_topics = None # total num of topics we publish
+    self.batch = None # most samples per batch (1 = no batching)
+    self.lvc = None # whether new subscribers get our latest sample per topic
+    self.compress = None # the compression we would use for our batches
     self.lookup = None # one of the diff ways we do lookup
     self.dissemination = None # direct or via broker
     self.mw_obj = None # handle to the underlying Middleware object
@@ -96,8 +108,9 @@ class PublisherAppln ():
   ########################################
   # configure/initialize
   ########################################
-  def configure (self, args):
-    ''' Initialize the object '''
+  def configure (self, args, reactor=None):
+    ''' Initialize the object; with a Reactor, our middleware shares its
+    context and event loop with the others it hosts '''
 
     try:
       # Here we initialize any internal variables
@@ -110,7 +123,14 @@ class PublisherAppln ():
       self.name = args.name # our name
       self.iters = args.iters  # num of iterations
       self.frequency = args.frequency # frequency with which topics are disseminated
+      self.burst = args.burst
+      self.scheduler = PublicationScheduler (self.frequency, self.burst)
       self.num_topics = args.num_topics  # total num of topics we publish
+      self.batch = args.batch
+      self.lvc = args.lvc
+      self.compress = args.compress
+      if self.compress and self.batch <= 1:
+        raise ValueError ("Compression (-z) applies to batches; use -b to batch")
 
       # Now, get the configuration object
       self.logger.debug ("PublisherAppln::configure - parsing config.ini")
@@ -121,14 +141,25 @@ class PublisherAppln ():
     
       # Now get our topic list of interest
       self.logger.debug ("PublisherAppln::configure - selecting our topic list")
-      ts = TopicSelector ()
-      self.topiclist = ts.interest (self.num_topics)  # let topic selector give us the desired num of topics
+      self.ts = TopicSelector (args.universe, args.skew)
+      self.topiclist = self.ts.interest (self.num_topics)  # let topic selector give us the desired num of topics
+      # optionally placed under a hierarchy such as sensors/building1
+      self.topiclist = self.ts.qualify (args.prefix, self.topiclist)
+
+      # rather than every topic once a round, an open loop of samples on
+      # topics picked by their popularity, with values or payloads drawn in
+      # batches (see load_generator.py)
+      if args.arrivals in ARRIVALS:
+        sizes = PayloadSizes (args.payload) if args.payload else None
+        self.load = LoadGenerator (self.topiclist, self.frequency, args.arrivals, self.ts.popularity (self.topiclist), sizes, self.ts.gen_publication)
+      elif args.payload:
+        raise ValueError ("Payload sizes (-y) apply to the open loop load; use -g with one of {}".format (", ".join (ARRIVALS)))
 
       # Now setup up our underlying middleware object to which we delegate
       # everything
       self.logger.debug ("PublisherAppln::configure - initialize the middleware object")
       self.mw_obj = PublisherMW (self.logger)
-      self.mw_obj.configure (args) # pass remainder of the args to the m/w object
+      self.mw_obj.configure (args, reactor) # pass remainder of the args to the m/w object
       
       self.logger.info ("PublisherAppln::configure - configuration complete")
       
@@ -144,6 +175,32 @@ class PublisherAppln ():
     try:
       self.logger.info ("PublisherAppln::driver")
 
+      self.start ()
+
+      # Now simply let the underlying middleware object enter the event loop
+      # to handle events. However, a trick we play here is that we provide a timeout
+      # of zero so that control is immediately sent back to us where we can then
+      # register with the discovery service and then pass control back to the event loop
+      #
+      # As a rule, whenever we expect a reply from remote entity, we set timeout to
+      # None or some large value, but if we want to send a request ourselves right away,
+      # we set timeout is zero.
+      #
+      self.mw_obj.event_loop (timeout=0)  # start the event loop
+
+      self.logger.info ("PublisherAppln::driver completed")
+
+    except Exception as e:
+      raise e
+
+  ########################################
+  # get ready for the event loop, which the driver runs, or a Reactor
+  # along with those of others (see HostAppln.py)
+  ########################################
+  def start (self):
+    ''' everything the driver does before entering the event loop '''
+
+    try:
       # dump our contents (debugging purposes)
       self.dump ()
 
@@ -151,7 +208,7 @@ class PublisherAppln ():
       # This is related to upcalls. By passing a pointer to ourselves, the
       # middleware will keep track of it and any time something must
       # be handled by the application level, invoke an upcall.
-      self.logger.debug ("PublisherAppln::driver - upcall handle")
+      self.logger.debug ("PublisherAppln::start - upcall handle")
       self.mw_obj.set_upcall_handle (self)
 
       # the next thing we should be doing is to register with the discovery
@@ -163,19 +220,6 @@ class PublisherAppln ():
       # the discovery service. So this is our next state.
       self.state = self.State.REGISTER
 
-      # Now simply let the underlying middleware object enter the event loop
-      # to handle events. However, a trick we play here is that we provide a timeout
-      # of zero so that control is immediately sent back to us where we can then
-      # register with the discovery service and then pass control back to the event loop
-      #
-      # As a rule, whenever we expect a reply from remote entity, we set timeout to
-      # None or some large value, but if we want to send a request ourselves right away,
-      # we set timeout is zero.
-      #
-      self.mw_obj.event_loop (timeout=0)  # start the event loop
-      
-      self.logger.info ("PublisherAppln::driver completed")
-      
     except Exception as e:
       raise e
 
@@ -190,7 +234,9 @@ class PublisherAppln ():
     ''' Invoke operating depending on state  '''
 
     try:
-      self.logger.info ("PublisherAppln::invoke_operation")
+      # called for every round we publish, so only when tracing
+      if self.mw_obj.trace:
+        self.logger.debug ("PublisherAppln::invoke_operation")
 
       # check what state are we in. If we are in REGISTER state,
       # we send register request to discovery service. If we are in
@@ -228,34 +274,64 @@ class PublisherAppln ():
       elif (self.state == self.State.DISSEMINATE):
 
         # We are here because both registration and is ready is done. So the only thing
-        # left for us as a publisher is dissemination, which we do it actively here.
-        self.logger.debug ("PublisherAppln::invoke_operation - start Disseminating")
-
-        # Now disseminate topics at the rate at which we have configured ourselves.
-        ts = TopicSelector ()
-        for i in range (self.iters):
-          # I leave it to you whether you want to disseminate all the topics of interest in
-          # each iteration OR some subset of it. Please modify the logic accordingly.
-          # Here, we choose to disseminate on all topics that we publish.  Also, we don't care
-          # about their values. But in future assignments, this can change.
-          for topic in self.topiclist:
-            # For now, we have chosen to send info in the form "topic name: topic value"
-            # In later assignments, we should be using more complex encodings using
-            # protobuf.  In fact, I am going to do this once my basic logic is working.
-            dissemination_data = ts.gen_publication (topic)
-            self.mw_obj.disseminate (self.name, topic, dissemination_data)
-
-          # Now sleep for an interval of time to ensure we disseminate at the
-          # frequency that was configured.
-          time.sleep (1/float (self.frequency))  # ensure we get a floating point num
-
-        self.logger.debug ("PublisherAppln::invoke_operation - Dissemination completed")
-
-        # we are done. So we move to the completed state
-        self.state = self.State.COMPLETED
+        # left for us as a publisher is dissemination. Rather than looping and sleeping
+        # in here, we publish the rounds that are due and hand the time until the next
+        # one back to the event loop, which keeps servicing everything else meanwhile.
+        if self.mw_obj.trace:
+          self.logger.debug ("PublisherAppln::invoke_operation - Disseminating round {}".format (self.round))
+
+        if self.load is not None:
+          # an open loop: every sample that is due goes out, stamped with the
+          # time it was due, and each one counts as an iteration
+          for topic, value, timestamp in self.load.take (self.iters - self.load.generated):
+            self.mw_obj.disseminate (self.name, topic, value, timestamp)
+
+          if self.load.generated < self.iters:
+            # come back when the next sample is due
+            return self.load.timeout ()
+
+          self.mw_obj.flush ()
+          self.logger.info ("PublisherAppln::invoke_operation - Dissemination completed, {} samples published, at most {:.1f} msec behind".format (self.load.generated, self.load.behind * 1000))
+
+        else:
+          # rounds the scheduler had to skip because we fell too far behind count
+          # towards our iterations, so the run lasts iters/frequency seconds
+          rounds = min (self.scheduler.take (), self.iters - self.round - self.scheduler.skipped)
+          for i in range (rounds):
+            # I leave it to you whether you want to disseminate all the topics of interest in
+            # each iteration OR some subset of it. Please modify the logic accordingly.
+            # Here, we choose to disseminate on all topics that we publish.  Also, we don't care
+            # about their values. But in future assignments, this can change.
+            for topic in self.topiclist:
+              # the middleware wraps the value in a Publication along with the
+              # topic id, our name, a sequence number and the send time
+              dissemination_data = self.ts.gen_publication (topic)
+              self.mw_obj.disseminate (self.name, topic, dissemination_data)
+          self.round += max (0, rounds)
+
+          if self.round + self.scheduler.skipped < self.iters:
+            # come back when the next round is due
+            return self.scheduler.timeout ()
+
+          # nothing may stay behind in a half full batch
+          self.mw_obj.flush ()
+          self.logger.info ("PublisherAppln::invoke_operation - Dissemination completed, {} rounds published, {} skipped".format (self.round, self.scheduler.skipped))
+        self.log_compression ()
+        self.log_filtered ()
+
+        # we are done. So we leave the system before completing
+        self.state = self.State.DEREGISTER
 
         # return a timeout of zero so that the event loop sends control back to us right away.
         return 0
+
+      elif (self.state == self.State.DEREGISTER):
+
+        # let discovery know we are gone so that the broker drops us from its
+        # publisher set on its next refresh
+        self.logger.debug ("PublisherAppln::invoke_operation - deregister with the discovery service")
+        self.mw_obj.deregister (self.name)
+        return None
         
       elif (self.state == self.State.COMPLETED):
 
@@ -287,6 +363,9 @@ class PublisherAppln ():
       if (reg_resp.status == discovery_pb2.STATUS_SUCCESS):
         self.logger.debug ("PublisherAppln::register_response - registration is a success")
 
+        # our samples go by the topic ids discovery gave us
+        self.mw_obj.intern (reg_resp.topic_ids)
+
         # set our next state to isready so that we can then send the isready message right away
         self.state = self.State.ISREADY
         
@@ -296,7 +375,7 @@ class PublisherAppln ():
       
       else:
         self.logger.debug ("PublisherAppln::register_response - registration is a failure with reason {}".format (reg_resp.reason))
-        raise ValueError ("Publisher needs to have unique id")
+        raise ValueError ("Publisher registration failed: {}".format (reg_resp.reason))
 
     except Exception as e:
       raise e
@@ -312,18 +391,25 @@ class PublisherAppln ():
     try:
       self.logger.info ("PublisherAppln::isready_response")
 
-      # Notice how we get that loop effect with the sleep (10)
+      # Notice how we get that loop effect with the timeout
       # by an interaction between the event loop and these
       # upcall methods.
       if not isready_resp.status:
         # discovery service is not ready yet
         self.logger.debug ("PublisherAppln::driver - Not ready yet; check again")
-        time.sleep (10)  # sleep between calls so that we don't make excessive calls
-
-      else:
-        # we got the go ahead
-        # set the state to disseminate
-        self.state = self.State.DISSEMINATE
+        # the event loop calls us back in the ISREADY state in 10 secs so that
+        # we don't make excessive calls, and is free to do other work meanwhile
+        return 10000
+
+      # we got the go ahead, along with what our subscribers can decompress
+      self.mw_obj.negotiate (self.topiclist, isready_resp.codecs)
+      self.mw_obj.set_filters (self.topiclist, isready_resp.filters)
+
+      # set the state to disseminate; our first round is due right away
+      self.state = self.State.DISSEMINATE
+      self.scheduler.start ()
+      if self.load is not None:
+        self.load.start ()
         
       # return timeout of 0 so event loop calls us back in the invoke_operation
       # method, where we take action based on what state we are in.
@@ -332,6 +418,47 @@ class PublisherAppln ():
     except Exception as e:
       raise e
 
+  ########################################
+  # handle deregister response method called as part of upcall
+  ########################################
+  def deregister_response (self, reg_resp):
+    ''' handle deregister response '''
+
+    try:
+      self.logger.info ("PublisherAppln::deregister_response")
+      if (reg_resp.status != discovery_pb2.STATUS_SUCCESS):
+        self.logger.debug ("PublisherAppln::deregister_response - deregistration failed with reason {}".format (reg_resp.reason))
+
+      # either way there is nothing left for us to do
+      self.state = self.State.COMPLETED
+      return 0
+
+    except Exception as e:
+      raise e
+
+  ########################################
+  # how well compression did, per topic
+  ########################################
+  def log_compression (self):
+    try:
+      if self.mw_obj.batcher is None:
+        return
+      for topic, stats in self.mw_obj.batcher.stats.summary ().items ():
+        self.logger.info ("PublisherAppln::log_compression - {}: {} of {} batches compressed, {} -> {} bytes, ratio {:.2f}, {:.1f} usec CPU per batch".format (
+          topic, stats["compressed"], stats["batches"], stats["raw_bytes"], stats["wire_bytes"], stats["ratio"], stats["cpu_usec"]))
+    except Exception as e:
+      raise e
+
+  ########################################
+  # what our subscribers' filters spared the wire, per topic
+  ########################################
+  def log_filtered (self):
+    try:
+      for topic, (samples, size) in self.mw_obj.filtered.items ():
+        self.logger.info ("PublisherAppln::log_filtered - {}: {} samples nobody wanted not sent, {} bytes saved".format (topic, samples, size))
+    except Exception as e:
+      raise e
+
   ########################################
   # dump the contents of the object 
   ########################################
@@ -345,10 +472,16 @@ class PublisherAppln ():
       self.logger.info ("     Name: {}".format (self.name))
       self.logger.info ("     Lookup: {}".format (self.lookup))
       self.logger.info ("     Dissemination: {}".format (self.dissemination))
-      self.logger.info ("     Num Topics: {}".format (self.num_topics))
+      self.logger.info ("     Num Topics: {} of {}".format (self.num_topics, len (self.ts.universe)))
       self.logger.info ("     TopicList: {}".format (self.topiclist))
       self.logger.info ("     Iterations: {}".format (self.iters))
       self.logger.info ("     Frequency: {}".format (self.frequency))
+      self.logger.info ("     Burst: {}".format (self.burst))
+      if self.load is not None:
+        self.logger.info ("     Load: {} arrivals, topic skew {}, payload {}".format (self.load.arrivals, self.ts.skew, self.load.sizes or "natural values"))
+      self.logger.info ("     Batch: {}".format (self.batch))
+      self.logger.info ("     Last value cache: {}".format (self.lvc))
+      self.logger.info ("     Compression: {}".format (self.compress or "none"))
       self.logger.info ("**********************************")
 
     except Exception as e:
@@ -359,7 +492,7 @@ class PublisherAppln ():
 # Parse command line arguments
 #
 ###################################
-def parseCmdLineArgs ():
+def parseCmdLineArgs (argv=None):
   # instantiate a ArgumentParser object
   parser = argparse.ArgumentParser (description="Publisher Application")
   
@@ -377,17 +510,43 @@ def parseCmdLineArgs ():
     
   parser.add_argument ("-d", "--discovery", default="localhost:5555", help="IP Addr:Port combo for the discovery service, default localhost:5555")
 
-  parser.add_argument ("-T", "--num_topics", type=int, choices=range(1,10), default=1, help="Number of topics to publish, currently restricted to max of 9")
+  parser.add_argument ("-T", "--num_topics", type=int, default=1, help="Number of topics to publish, out of the -U there are, default 1")
+
+  parser.add_argument ("-U", "--universe", type=int, default=9, help="Topics there are to choose from; beyond the 9 kinds they are numbered, e.g. weather1, humidity1, ... Default 9")
+
+  parser.add_argument ("-K", "--skew", type=float, default=0.0, help="Zipf skew of topic popularity: the topic of rank r in the universe is chosen (with -g, also published on) with a weight of 1/(r+1)^skew, default 0 = all alike")
+
+  parser.add_argument ("-t", "--prefix", default="", help="Publish our topics under this hierarchy, e.g. sensors/building1 gives sensors/building1/temperature; default none, plain topic names")
 
   parser.add_argument ("-c", "--config", default="config.ini", help="configuration file (default: config.ini)")
 
-  parser.add_argument ("-f", "--frequency", type=int,default=1, help="Rate at which topics disseminated: default once a second - use integers")
+  parser.add_argument ("-f", "--frequency", type=float, default=1.0, help="Rate in Hz at which topics are disseminated, fractions allowed (e.g. 0.5 or 10000): default once a second")
+
+  parser.add_argument ("-k", "--burst", type=int, default=10, help="Most overdue rounds published back to back after a late wakeup; rounds further behind are skipped, default 10")
+
+  parser.add_argument ("-i", "--iters", type=int, default=1000, help="number of publication iterations, samples with -g (default: 1000)")
+
+  parser.add_argument ("-g", "--arrivals", default="rounds", choices=("rounds",) + ARRIVALS, help="rounds publishes every topic once a round, -f rounds a second; poisson and fixed publish an open loop of -f samples a second over all our topics, with exponential or fixed gaps, never skipping any. Default rounds")
+
+  parser.add_argument ("-y", "--payload", default="", help="With -g, string payloads of this size in bytes instead of the topics' natural values: N, uniform:MIN:MAX, exp:MEAN or lognormal:MEDIAN:SIGMA; default none")
+
+  parser.add_argument ("-b", "--batch", type=int, default=1, help="Pack up to this many samples of a topic into one message, default 1 = no batching")
+
+  parser.add_argument ("-B", "--batch_bytes", type=int, default=65536, help="Send a batch once it grows past this many bytes, default 65536")
+
+  parser.add_argument ("-V", "--lvc", action="store_true", help="Keep our latest sample per topic and send it to every new subscriber (or broker) as soon as it subscribes")
+
+  parser.add_argument ("-z", "--compress", default="", help="Compress batches with these codecs, preferred first, as far as all subscribers of a topic can undo them: [topic=]codec,... with codecs zlib, lzma and zstd (needs the zstandard package); default none")
+
+  parser.add_argument ("-Z", "--compress_min", type=int, default=256, help="Only compress batches of at least this many bytes, default 256")
+
+  parser.add_argument ("-L", "--linger", type=float, default=5.0, help="Send a batch once its first sample has waited this many msec, default 5")
 
-  parser.add_argument ("-i", "--iters", type=int, default=1000, help="number of publication iterations (default: 1000)")
+  parser.add_argument ("-x", "--transports", default="inproc,ipc", help="Local transports to also publish on besides tcp, comma separated inproc,ipc, which subscribers and brokers on our host (ipc) or in our process (inproc) connect over instead. \"tcp\" turns them off. Default inproc,ipc")
 
-  parser.add_argument ("-l", "--loglevel", type=int, default=logging.DEBUG, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
   
-  return parser.parse_args()
+  return parser.parse_args(argv)
 
 
 ###################################
@@ -434,9 +593,9 @@ def main ():
 ###################################
 if __name__ == "__main__":
 
-  # set underlying default logging capabilities
-  logging.basicConfig (level=logging.DEBUG,
-                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+  # set underlying default logging capabilities; records are written out by
+  # a thread of their own so that logging never holds up the messaging
+  LogUtil.start (level=logging.DEBUG, fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 
   main ()
@@ -32,16 +32,25 @@ import time   # for sleep
 import argparse # for argument parsing
 import configparser # for configuration parsing
 import logging # for logging. Use it in place of print statements.
+import signal # to end the run cleanly when we are told to stop
 
 from topic_selector import TopicSelector
+from latency_histogram import LatencyRecorder
 # Now import our CS6381 Middleware
 from CS6381_MW.SubscriberMW import SubscriberMW
 # We also need the message formats to handle incoming responses.
 from CS6381_MW import discovery_pb2
+from CS6381_MW.Common import PublicationCodec, ConnectionManager
+from CS6381_MW import LogUtil
+from CS6381_MW.LogUtil import hot_path
+from CS6381_MW.TopicTrie import TopicTrie
 
 # import any other packages you need.
 from enum import Enum  # for an enumeration we are using to describe what state we are in
 
+# msec between lookups while discovery is not ready yet (answers version 0)
+LOOKUP_RETRY = 500
+
 class SubscriberAppln():
     class State (Enum):
         INITIALIZE = 0,
@@ -53,16 +62,36 @@ class SubscriberAppln():
     def __init__(self,logger):
         self.state = self.State.INITIALIZE # state that are we in
         self.name = None # our name (some unique name)
-        self.topiclist = None # the different topics
+        self.topiclist = None # the different topics, or wildcard subscriptions to them
+        self.trie = None # TopicTrie of the topic list, for what the subscriptions match
         #self.iters = None   # number of iterations of publication
         #self.frequency = None # rate at which dissemination takes place
         self.num_topics = None # total num of topics we want to receive
         self.lookup = None # one of the diff ways we do lookup
         self.dissemination = None # direct or via broker
+        self.qos = None # per topic QoS for a broker with managed egress
+        self.predicates = None # what the samples we want have to satisfy
+        self.samples = None # stop after receiving this many samples (0 = until told to stop)
+        self.refresh = None # msec between refreshes of the publisher set
+        self.lookup_version = 0 # registry version of the publisher set we are connected to
+        self.connections = None # the publishers (or brokers) we are connected to
+        self.callbacks = {} # topic (None = all our topics) -> per sample callbacks
+        self.batch_callbacks = {} # topic (None = all our topics) -> callbacks taking all samples of a wakeup
+        self.decoders = {} # topic -> turns a Publication into the value the callbacks get
+        self.dispatch = {} # topic -> (decoder, callbacks, batch callbacks), filled in as topics show up
+        self.waiting = None # topics (or subscriptions) we have not had any data of yet
+        self.connected_at = None # monotonic time we first connected to a publisher (or broker)
+        self.replay_endpoints = {} # topic -> replay endpoint of the broker that logs it
+        self.replay_seconds = None # how far back to replay once we are connected (0 = not at all)
+        self.replayed = {} # topic -> samples replayed so far
+        self.latency_file = None # where the latency histograms go at the end of the run
+        self.latency = None # one-way latency histograms per topic and publisher
         self.mw_obj = None # handle to the underlying Middleware object
         self.logger = logger  # internal logger for print statements
 
-    def configure(self,args):
+    def configure(self,args,reactor=None):
+        ''' with a Reactor, our middleware shares its context and event loop
+        with the others it hosts '''
         try:
             self.logger.info ("SubscriberAppln::configure")
             # set our current state to CONFIGURE state
@@ -72,6 +101,11 @@ class SubscriberAppln():
             #self.iters = args.iters  # num of iterations
             #self.frequency = args.frequency # frequency with which topics are disseminated
             self.num_topics = args.num_topics  # total num of topics we receive
+            self.samples = args.samples
+            self.refresh = int (args.refresh * 1000)
+            self.replay_seconds = args.replay
+            self.latency_file = args.latency_file or "{}_latency.json".format (self.name)
+            self.latency = LatencyRecorder (self.name)
 
             # Now, get the configuration object
             self.logger.debug ("SubscriberAppln::configure - parsing config.ini")
@@ -79,17 +113,36 @@ class SubscriberAppln():
             config.read (args.config)
             self.lookup = config["Discovery"]["Strategy"]
             self.dissemination = config["Dissemination"]["Strategy"]
+            self.qos = args.qos
+            self.predicates = args.predicates
+            if self.qos and self.dissemination != "Broker":
+                raise ValueError ("QoS is applied by the broker; it needs the Broker dissemination strategy")
 
             # Now get our topic list of interest
             self.logger.debug ("SubscriberAppln::configure - selecting our topic list")
-            ts = TopicSelector ()
-            self.topiclist = ts.interest (self.num_topics)  # let topic selector give us the desired num of topics
+            if args.topics:
+                # named ones, possibly hierarchical and with wildcards
+                self.topiclist = [topic.strip () for topic in args.topics.split (",") if topic.strip ()]
+            else:
+                ts = TopicSelector (args.universe, args.skew)
+                self.topiclist = ts.interest (self.num_topics)  # let topic selector give us the desired num of topics
+            self.trie = TopicTrie ()
+            for topic in self.topiclist:
+                self.trie.add (topic, topic)
+            self.waiting = set (self.topiclist)
+
+            # printing every sample is for debugging only; otherwise nothing but
+            # the callbacks registered with us runs per sample
+            if hot_path (self.logger):
+                self.on_topic (None, self.print_data)
+            self.build_dispatch ()
     
             # Now setup up our underlying middleware object to which we delegate
             # everything
             self.logger.debug ("SubscriberAppln::configure - initialize the middleware object")
             self.mw_obj = SubscriberMW (self.logger)
-            self.mw_obj.configure (args) # pass remainder of the args to the m/w object
+            self.mw_obj.configure (args, reactor) # pass remainder of the args to the m/w object
+            self.connections = ConnectionManager (self.mw_obj.connect_pub, self.mw_obj.disconnect_pub)
 
             self.logger.info ("SubscriberAppln::configure - configuration complete")
       
@@ -106,16 +159,45 @@ class SubscriberAppln():
         try:
             self.logger.info ("SubscriberAppln::driver")
 
+            self.start ()
+
+            # a SIGTERM (how the experiment scripts stop us) ends the run the same
+            # way a Ctrl-C does, so that we still get to save our latencies
+            signal.signal (signal.SIGTERM, self.stop)
+
+            try:
+                self.mw_obj.event_loop (timeout=0)  # start the event loop
+            except KeyboardInterrupt:
+                self.logger.info ("SubscriberAppln::driver - told to stop")
+
+            self.finish ()
+
+            self.logger.info ("SubscriberAppln::driver completed")
+
+        except Exception as e:
+            raise e
+
+    # the driver in two halves around the event loop, which a Reactor may run
+    # along with those of others (see HostAppln.py)
+    def start (self):
+        ''' everything the driver does before entering the event loop '''
+        try:
             self.dump ()
 
-            self.logger.debug ("SubscriberAppln::driver - upcall handle")
+            self.logger.debug ("SubscriberAppln::start - upcall handle")
             self.mw_obj.set_upcall_handle (self)
 
             self.state = self.State.REGISTER
 
-            self.mw_obj.event_loop (timeout=0)  # start the event loop
+        except Exception as e:
+            raise e
 
-            self.logger.info ("SubscriberAppln::driver completed")
+    def finish (self):
+        ''' everything the driver does once out of the event loop '''
+        try:
+            self.save_latency ()
+            self.log_compression ()
+            self.log_filtered ()
 
         except Exception as e:
             raise e
@@ -143,7 +225,10 @@ class SubscriberAppln():
             
             elif (self.state == self.State.DATARECEIVE):
                 
-                self.logger.debug ("SubscriberAppln::invoke_operation - connect to publisher and reveive data")    
+                # data arrives without any help from us; every refresh interval we
+                # ask discovery whether the publishers changed since our version
+                self.logger.debug ("SubscriberAppln::invoke_operation - refresh publishers since version {}".format (self.lookup_version))
+                self.mw_obj.lookup_publisher(self.topiclist,self.lookup_version)
 
                 return None
 
@@ -160,6 +245,9 @@ class SubscriberAppln():
             if (reg_resp.status == discovery_pb2.STATUS_SUCCESS):
                 self.logger.debug ("SubscriberAppln::register_response - registration is a success")
 
+                # the ids of our topics, which the data path knows them by
+                self.mw_obj.intern (reg_resp.topic_ids)
+
                 # set our next state to loojk up the publishers in discovery
                 self.state = self.State.LOOKUP
 
@@ -182,17 +270,43 @@ class SubscriberAppln():
             if (lookup_resp.status == discovery_pb2.STATUS_SUCCESS):
                 self.logger.debug ("SubscriberAppln::lookup_response - start receive publisher")
                 
-                #return publishers which send topic to us
-                for publisherInfo in lookup_resp.publisherInfos:
-                    # temporary store publishers in this structure
-                    self.mw_obj.connect_pub(str(publisherInfo.addr)+':'+str(publisherInfo.port))
-                #next step is to connect all these publishers
+                # the ids of the topics our wildcard subscriptions stand for
+                self.mw_obj.intern (lookup_resp.topic_ids)
+
+                if not lookup_resp.unchanged:
+                    #return publishers which send topic to us; we only connect to the
+                    #new ones and drop the ones that are gone
+                    endpoints={}
+                    for publisherInfo in lookup_resp.publisherInfos:
+                        # over ipc or inproc when it shares our host or process
+                        endpoints[publisherInfo.id]=self.mw_obj.endpoint(publisherInfo)
+                        # a broker that keeps a topic log says where to ask for replays
+                        if publisherInfo.replay_port:
+                            for topic in publisherInfo.topiclist:
+                                self.replay_endpoints[topic]=str(publisherInfo.addr)+':'+str(publisherInfo.replay_port)
+                    connected,disconnected=self.connections.update(endpoints)
+                    if connected and self.connected_at is None:
+                        # time to first data is counted from here
+                        self.connected_at=time.monotonic()
+                        if self.replay_seconds:
+                            # catch up on what was published before we came, up
+                            # to where our live data starts
+                            now=time.time_ns()
+                            for topic in self.replay_endpoints:
+                                self.replay(topic,since=now-int(self.replay_seconds*1e9),until=now)
+                    self.logger.debug ("SubscriberAppln::lookup_response - version {}: {} connected, {} dropped, {} in all".format (lookup_resp.version, len (connected), len (disconnected), len (self.connections)))
+                self.lookup_version=lookup_resp.version
 
                 self.state = self.State.DATARECEIVE
 
-                # return a timeout of zero so that the event loop in its next iteration will immediately make
-                # an upcall to us
-                return 0
+                if lookup_resp.version == 0:
+                    # discovery is not ready yet and told us nothing; ask again
+                    # soon rather than a whole refresh interval from now
+                    self.logger.debug ("SubscriberAppln::lookup_response - discovery not ready yet; look up again")
+                    return min (self.refresh, LOOKUP_RETRY)
+
+                # come back for the next refresh after the refresh interval
+                return self.refresh
 
             else:
                 self.logger.debug ("SubscriberAppln::lookup_response - look up failure")
@@ -201,17 +315,200 @@ class SubscriberAppln():
         except Exception as e:
             raise e
         
-    def data_receive(self,received_data):
+    ########################################
+    # per topic callbacks
+    #
+    # A callback gets (topic, value, publication) for every sample of its
+    # topic, a batch callback gets (topic, values, publications) once per
+    # wakeup of the event loop with all the samples of its topic that came
+    # in. The value is what the topic's decoder makes of the Publication,
+    # by default the payload in its own type. A topic of None means every
+    # topic we subscribe to; a wildcard subscription such as sensors/#
+    # means every topic it matches.
+    ########################################
+    def on_topic (self, topic, callback):
+        ''' call back for every sample of a topic '''
+        self.callbacks.setdefault (topic, []).append (callback)
+        self.build_dispatch ()
+
+    def on_topic_batch (self, topic, callback):
+        ''' call back once per wakeup with all the samples of a topic '''
+        self.batch_callbacks.setdefault (topic, []).append (callback)
+        self.build_dispatch ()
+
+    def set_decoder (self, topic, decoder):
+        ''' decoder turns a Publication of the topic into the value the callbacks get '''
+        self.decoders[topic] = decoder
+        self.build_dispatch ()
+
+    def build_dispatch (self):
+        ''' forget what runs for which topic; with wildcards the topics are
+        only known as their samples come in, so resolve () works it out then '''
+        self.dispatch = {}
+
+    def resolve (self, topic):
+        ''' work out once per topic what has to run for its samples '''
+        # the subscriptions matching the topic, and the topic itself in case
+        # callbacks were set for it under a wildcard subscription
+        keys = [None] + sorted (self.trie.match (topic) if self.trie is not None else ())
+        if topic not in keys:
+            keys.append (topic)
+        callbacks = [callback for key in keys for callback in self.callbacks.get (key, [])]
+        batch_callbacks = [callback for key in keys for callback in self.batch_callbacks.get (key, [])]
+        decoders = [self.decoders[key] for key in reversed (keys) if key in self.decoders]
+        decoder = decoders[0] if decoders else PublicationCodec.value
+        entry = (decoder, tuple (callbacks), tuple (batch_callbacks))
+        self.dispatch[topic] = entry
+        return entry
+
+    def data_receive(self,samples):
+        ''' samples is the list of (topic, Publication) the middleware took off the socket in one go '''
+        try:
+            if self.waiting:
+                self.first_data (samples, "live")
+            dispatch = self.dispatch
+            record = self.latency.record
+            batches = {} # topic -> publications for its batch callbacks
+            for topic,publication in samples:
+                # one-way latency from the timestamp the publisher put in the sample
+                record(topic,publication.pub_id,time.time_ns()-publication.timestamp)
+
+                entry = dispatch.get (topic)
+                if entry is None:
+                    entry = self.resolve (topic)
+                decoder,callbacks,batch_callbacks = entry
+                if callbacks:
+                    value = decoder (publication)
+                    for callback in callbacks:
+                        callback (topic, value, publication)
+                if batch_callbacks:
+                    batches.setdefault (topic, []).append (publication)
+
+                if self.samples and self.latency.total.count>=self.samples:
+                    self.logger.info ("SubscriberAppln::data_receive - received all {} samples".format (self.samples))
+                    self.mw_obj.disable_event_loop ()
+                    break
+
+            for topic,publications in batches.items ():
+                decoder,callbacks,batch_callbacks = dispatch[topic]
+                values = [decoder (publication) for publication in publications]
+                for callback in batch_callbacks:
+                    callback (topic, values, publications)
+
+            # the publishers are refreshed on their own timer, not per sample
+            return None
+        except Exception as e:
+            raise e
+
+    def snapshot_receive(self,samples):
+        ''' the latest values of our topics, cached by a broker or publisher and
+        sent to us as we subscribed; they go to the callbacks like any other
+        sample, but their age is not latency '''
+        try:
+            if self.waiting:
+                self.first_data (samples, "snapshot")
+            self.deliver (samples)
+        except Exception as e:
+            raise e
+
+    ########################################
+    # replay from a broker's topic log
+    ########################################
+    def replay (self, topic, from_seq=0, since=0, until=0):
+        ''' have the broker logging a topic send us its messages from a log
+        sequence number, or from a time (ns since the epoch) up to until '''
+        try:
+            endpoint = self.replay_endpoints.get (topic)
+            if endpoint is None:
+                raise ValueError ("No broker keeps a log of {}".format (topic))
+            self.replayed.setdefault (topic, 0)
+            self.mw_obj.replay (endpoint, topic, from_seq, since, until)
+        except Exception as e:
+            raise e
+
+    def replay_receive(self,topic,samples,next_seq,caught_up):
+        ''' samples replayed from a broker's log; next_seq is where the log
+        goes on from, caught_up whether that is its end (or until) '''
         try:
+            self.deliver (samples)
+            self.replayed[topic] += len (samples)
+            if caught_up:
+                self.logger.info ("SubscriberAppln::replay_receive - {} samples of {} replayed, log at {}".format (self.replayed[topic], topic, next_seq))
+        except Exception as e:
+            raise e
 
-            strs=received_data.split(':')
-            #print data we received
-            self.print_data(strs[0],strs[1])
-            self.state = self.State.LOOKUP
-            return 0
+    def deliver(self,samples):
+        ''' hand samples that are not live to the callbacks '''
+        try:
+            dispatch = self.dispatch
+            batches = {} # topic -> publications for its batch callbacks
+            for topic,publication in samples:
+                entry = dispatch.get (topic)
+                if entry is None:
+                    entry = self.resolve (topic)
+                decoder,callbacks,batch_callbacks = entry
+                if callbacks:
+                    value = decoder (publication)
+                    for callback in callbacks:
+                        callback (topic, value, publication)
+                if batch_callbacks:
+                    batches.setdefault (topic, []).append (publication)
+            for topic,publications in batches.items ():
+                decoder,callbacks,batch_callbacks = dispatch[topic]
+                values = [decoder (publication) for publication in publications]
+                for callback in batch_callbacks:
+                    callback (topic, values, publications)
+        except Exception as e:
+            raise e
+
+    def first_data (self, samples, source):
+        ''' log how long after we connected the first data of each topic came '''
+        try:
+            now = time.monotonic ()
+            for topic,publication in samples:
+                for pattern in self.trie.match (topic) & self.waiting:
+                    self.waiting.discard (pattern)
+                    since = (now - self.connected_at) * 1000 if self.connected_at is not None else 0.0
+                    self.logger.info ("SubscriberAppln::first_data - {} after {:.1f} msec ({} on {} from {})".format (pattern, since, source, topic, publication.pub_id))
+                if not self.waiting:
+                    break
+        except Exception as e:
+            raise e
+
+    def stop (self, signum, frame):
+        ''' signal handler that gets us out of the event loop '''
+        raise KeyboardInterrupt
+
+    def save_latency (self):
+        ''' write the latency histograms and log the percentiles '''
+        try:
+            self.latency.save (self.latency_file)
+            summary = self.latency.total.summary ()
+            self.logger.info ("SubscriberAppln::save_latency - {} samples written to {}".format (summary["count"], self.latency_file))
+            if summary["count"]:
+                self.logger.info ("SubscriberAppln::save_latency - usec p50 {:.1f} p90 {:.1f} p99 {:.1f} p99.9 {:.1f}".format (summary["p50"], summary["p90"], summary["p99"], summary["p99.9"]))
         except Exception as e:
             raise e
     
+    def log_compression (self):
+        ''' what undoing compressed batches cost us, per topic '''
+        try:
+            for topic, stats in self.mw_obj.compression.summary ().items ():
+                self.logger.info ("SubscriberAppln::log_compression - {}: {} batches, {} -> {} bytes, ratio {:.2f}, {:.1f} usec CPU per batch".format (
+                    topic, stats["batches"], stats["wire_bytes"], stats["raw_bytes"], stats["ratio"], stats["cpu_usec"]))
+        except Exception as e:
+            raise e
+
+    def log_filtered (self):
+        ''' samples that still reached us although our predicates rule them out '''
+        try:
+            for topic, samples in self.mw_obj.filtered.items ():
+                self.logger.info ("SubscriberAppln::log_filtered - {}: {} samples dropped here".format (topic, samples))
+            if self.mw_obj.unwanted:
+                self.logger.info ("SubscriberAppln::log_filtered - {} messages on topics that are not ours dropped here".format (self.mw_obj.unwanted))
+        except Exception as e:
+            raise e
+
     ########################################
     # dump the contents of the object 
     ########################################
@@ -225,14 +522,19 @@ class SubscriberAppln():
             self.logger.info ("     Name: {}".format (self.name))
             self.logger.info ("     Lookup: {}".format (self.lookup))
             self.logger.info ("     Dissemination: {}".format (self.dissemination))
+            self.logger.info ("     QoS: {}".format (self.qos))
+            self.logger.info ("     Predicates: {}".format (self.predicates))
             self.logger.info ("     Num Topics: {}".format (self.num_topics))
             self.logger.info ("     TopicList: {}".format (self.topiclist))
+            self.logger.info ("     Samples: {}".format (self.samples))
+            self.logger.info ("     Refresh (msec): {}".format (self.refresh))
+            self.logger.info ("     Latency file: {}".format (self.latency_file))
             self.logger.info ("**********************************")
 
         except Exception as e:
             raise e
         
-    def print_data (self, topic, content):
+    def print_data (self, topic, value, publication):
         ''' Pretty print '''
 
         try:
@@ -240,7 +542,9 @@ class SubscriberAppln():
             self.logger.info ("SubscriberAppln::print")
             self.logger.info ("------------------------------")
             self.logger.info ("     Topic: {}".format (topic))
-            self.logger.info ("     Content: {}".format (content))
+            self.logger.info ("     Publisher: {}".format (publication.pub_id))
+            self.logger.info ("     Seq: {}".format (publication.seq))
+            self.logger.info ("     Content: {}".format (value))
             self.logger.info ("**********************************")
 
         except Exception as e:
@@ -251,7 +555,7 @@ class SubscriberAppln():
 # Parse command line arguments
 #
 ###################################
-def parseCmdLineArgs ():
+def parseCmdLineArgs (argv=None):
     # instantiate a ArgumentParser object
     parser = argparse.ArgumentParser (description="Subscriber Application")
     
@@ -271,11 +575,33 @@ def parseCmdLineArgs ():
     
     parser.add_argument ("-c", "--config", default="config.ini", help="configuration file (default: config.ini)")
     
-    parser.add_argument ("-l", "--loglevel", type=int, default=logging.DEBUG, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+    parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
     
-    parser.add_argument ("-T", "--num_topics", type=int, choices=range(1,10), default=1, help="Number of topics to publish, currently restricted to max of 9")
+    parser.add_argument ("-T", "--num_topics", type=int, default=1, help="Number of topics to subscribe to, out of the -U there are, default 1")
+
+    parser.add_argument ("-U", "--universe", type=int, default=9, help="Topics there are to choose from, as many as the publishers have; beyond the 9 kinds they are numbered, e.g. weather1, humidity1, ... Default 9")
+
+    parser.add_argument ("-K", "--skew", type=float, default=0.0, help="Zipf skew of topic popularity: the topic of rank r in the universe is chosen with a weight of 1/(r+1)^skew, default 0 = all alike")
+
+    parser.add_argument ("-t", "--topics", default="", help="Comma separated topics to subscribe to instead of -T random ones; hierarchical names may have wildcards, * for exactly one level and # (last) for all the rest, e.g. sensors/*/temperature,sensors/building1/#; default none")
+
+    parser.add_argument ("-b", "--budget", type=int, default=100, help="Most messages taken off the SUB socket per wakeup of the event loop, default 100")
+
+    parser.add_argument ("-r", "--refresh", type=float, default=5.0, help="Seconds between asking discovery whether the publishers changed, default 5")
+
+    parser.add_argument ("-R", "--replay", type=float, default=0, help="Once connected, replay the last this many seconds of our topics from the brokers' topic logs (BrokerAppln -D), default 0 = no replay")
+
+    parser.add_argument ("-Q", "--qos", default="", help="Per topic QoS for brokers with managed egress (BrokerAppln -e managed), comma separated [topic=]policy[:hwm] with policy drop-oldest, drop-newest or conflate and no topic for the default, e.g. conflate,weather=drop-newest:50; default none (plain SUB socket)")
+
+    parser.add_argument ("-P", "--predicates", default="", help="Only the samples satisfying all our predicates on their topic, e.g. \"temperature>50,weather==sunny,light.pub_id!=pub2\"; publishers and brokers with managed egress do not send us the rest. Default none")
+
+    parser.add_argument ("-x", "--transports", default="inproc,ipc", help="Local transports besides tcp, comma separated inproc,ipc: a publisher or broker on our host is reached over ipc and one in our process (and ZMQ context) over inproc. \"tcp\" turns them off. Default inproc,ipc")
+
+    parser.add_argument ("-s", "--samples", type=int, default=0, help="Stop after receiving this many samples, default 0 = until stopped with SIGINT/SIGTERM")
+
+    parser.add_argument ("-o", "--latency_file", default=None, help="Where to write the latency histograms, .csv for just the percentiles, default <name>_latency.json")
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 ###################################
 #
@@ -321,9 +647,9 @@ def main ():
 ###################################
 if __name__ == "__main__":
 
-  # set underlying default logging capabilities
-  logging.basicConfig (level=logging.DEBUG,
-                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+  # set underlying default logging capabilities; records are written out by
+  # a thread of their own so that logging never holds up the messaging
+  LogUtil.start (level=logging.DEBUG, fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 
   main ()
\ No newline at end of file
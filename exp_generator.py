@@ -383,7 +383,7 @@ def parseCmdLineArgs ():
   #
   parser.add_argument ("-b", "--bits_hash", type=int, choices=[8,16,24,32,40,48,56,64], default=48, help="Number of bits of hash value to test for collision: allowable values between 6 and 64 in increments of 8 bytes, default 48")
 
-  parser.add_argument ("-D", "--num_disc_dht", type=int, default=20, help="Number of Discovery DHT instances, default 20")
+  parser.add_argument ("-D", "--num_disc_dht", type=int, default=1, help="Number of Discovery DHT instances; the discovery service supports one only for now, default 1")
 
   parser.add_argument ("-P", "--num_pub", type=int, default=5, help="number of publishers, default 5")
   
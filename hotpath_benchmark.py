@@ -0,0 +1,436 @@
+###############################################
+#
+# Purpose: Microbenchmarks of the middleware hot paths, with baselines
+#
+# Each case times the real code, many times over, and keeps the best of -r
+# runs:
+#
+#   hash_func         DiscoveryAppln.hash_func of a topic
+#   finger_table      DiscoveryAppln.generate_finger_table for a ring of -D nodes
+#   req_encode        a RegisterReq built by the DiscoveryCodec
+#   req_decode        and parsed again
+#   disseminate       PublisherMW.disseminate of one sample
+#   receive_from_pub  SubscriberMW.receive_from_pub, per sample
+#   proxy             BrokerMW.proxy, per sample forwarded
+#
+# The last three run over inproc in this one process, so no Mininet and no
+# network is involved: the samples are queued where the code under test
+# picks them up before the clock starts, and taken away after it stops.
+#
+# Next to ops/s it gives what a run allocates, as tracemalloc sees it (so
+# the Python heap, not what libzmq allocates): the peak over a whole run,
+# and what is still held at its end per op, which should stay near zero.
+# -o saves the results as a json baseline; -c compares with one, flagging
+# the cases that got slower, or allocate more, by over -t percent, in which
+# case we exit with status 1:
+#
+#    python3 hotpath_benchmark.py -o before.json
+#    ... change something ...
+#    python3 hotpath_benchmark.py -c before.json
+#
+###############################################
+
+import argparse # for argument parsing
+import json # baselines are saved as json
+import logging # for logging. Use it in place of print statements.
+import platform # recorded with a baseline
+import sys # for the exit status
+import time   # for the clock
+import tracemalloc # for the allocations
+import zmq  # ZMQ sockets
+
+from CS6381_MW import discovery_pb2
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.PublisherMW import PublisherMW
+from CS6381_MW.SubscriberMW import SubscriberMW
+from CS6381_MW.Common import DiscoveryCodec, PublicationCodec, drain, local_endpoints, bind_endpoints, ring_hash, topic_id
+from DiscoveryAppln import DiscoveryAppln
+from mw_benchmark import SampleCounter
+
+CASES = ("hash_func", "finger_table", "req_encode", "req_decode", "disseminate", "receive_from_pub", "proxy")
+
+# allocations this much larger than the baseline's are within noise
+ALLOC_SLACK = 256
+
+##################################
+#       Benchmark class
+##################################
+class HotPathBenchmark ():
+
+  ########################################
+  # constructor
+  ########################################
+  def __init__ (self, logger):
+    self.logger = logger  # internal logger for print statements
+    self.iters = None # ops per run
+    self.repeat = None # runs per case, the best one is kept
+    self.cases = None # which of CASES to run
+    self.topiclist = None # topics hashed, registered and published
+    self.nodes = None # DHT nodes in the finger table ring
+    self.port = None # first of the local ports the middleware objects bind to
+    self.threshold = None # percent worse than the baseline that is a regression
+    self.output = None # json file the results are saved to
+    self.baseline = None # results of an earlier run to compare with
+    self.results = {} # case -> {"ops_per_sec", "peak_bytes", "retained_bytes_per_op"}
+
+  ########################################
+  # configure/initialize
+  ########################################
+  def configure (self, args):
+    ''' Initialize the object '''
+
+    try:
+      self.logger.info ("HotPathBenchmark::configure")
+      self.iters = args.iters
+      self.repeat = args.repeat
+      self.cases = [case.strip () for case in args.cases.split (",")] if args.cases else list (CASES)
+      unknown = set (self.cases) - set (CASES)
+      if unknown:
+        raise ValueError ("Unknown cases {}; choose from {}".format (sorted (unknown), ", ".join (CASES)))
+      self.topiclist = ["topic{}".format (i) for i in range (args.num_topics)]
+      self.nodes = args.nodes
+      self.port = args.port
+      self.threshold = args.threshold / 100.0
+      self.output = args.output
+      # read now, so that -c and -o may name the same file
+      if args.compare:
+        with open (args.compare, "r") as f:
+          self.baseline = json.load (f)
+      self.logger.info ("HotPathBenchmark::configure completed")
+
+    except Exception as e:
+      raise e
+
+  ########################################
+  # time a case and trace its allocations
+  ########################################
+  def measure (self, name, run, ops, prepare=None):
+    ''' run () does ops operations; prepare (), if given, sets up the next
+    run without being timed '''
+    best = None
+    for _ in range (self.repeat):
+      if prepare is not None:
+        prepare ()
+      start = time.perf_counter ()
+      run ()
+      elapsed = time.perf_counter () - start
+      if best is None or elapsed < best:
+        best = elapsed
+
+    # one more run for the allocations, as tracing slows everything down
+    if prepare is not None:
+      prepare ()
+    tracemalloc.start ()
+    run ()
+    retained, peak = tracemalloc.get_traced_memory ()
+    tracemalloc.stop ()
+
+    self.results[name] = {"ops_per_sec": ops / best, "peak_bytes": peak, "retained_bytes_per_op": retained / ops}
+    self.logger.debug ("HotPathBenchmark::measure - {} done".format (name))
+
+  def loop (self, func, ops):
+    ''' a run of ops calls of func (i) '''
+    def run ():
+      for i in range (ops):
+        func (i)
+    return run
+
+  ########################################
+  # discovery
+  ########################################
+  def discovery (self):
+    disc = DiscoveryAppln (self.logger)
+    topics = self.topiclist
+
+    if "hash_func" in self.cases:
+      self.measure ("hash_func", self.loop (lambda i: disc.hash_func (topics[i % len (topics)]), self.iters), self.iters)
+
+    if "finger_table" in self.cases:
+      # a ring named the way exp_generator.py names its DHT nodes
+      disc.hash_list = sorted (ring_hash ("disc{}:10.0.0.{}:5555".format (i, i % 250 + 1), disc.m) for i in range (self.nodes))
+      disc.hash = disc.hash_list[0]
+      def generate (i):
+        disc.finger_table = []
+        disc.generate_finger_table ()
+      # a whole table is far more work than the other ops
+      ops = max (1, self.iters // 100)
+      self.measure ("finger_table", self.loop (generate, ops), ops)
+
+    codec = DiscoveryCodec ()
+    if "req_encode" in self.cases:
+      self.measure ("req_encode", self.loop (lambda i: codec.register_req (discovery_pb2.ROLE_PUBLISHER, "pub1", "10.0.0.1", 5570, topics), self.iters), self.iters)
+
+    if "req_decode" in self.cases:
+      buf = codec.register_req (discovery_pb2.ROLE_PUBLISHER, "pub1", "10.0.0.1", 5570, topics)
+      self.measure ("req_decode", self.loop (lambda i: codec.decode_req (buf), self.iters), self.iters)
+
+  ########################################
+  # PublisherMW.disseminate into a SUB socket over inproc
+  ########################################
+  def disseminate (self):
+    # nothing answers on the discovery port; the REQ socket is never used
+    args = argparse.Namespace (port=self.port, addr="127.0.0.1", discovery="127.0.0.1:{}".format (self.port + 4), lvc=False, transports="inproc", batch=1, batch_bytes=65536, linger=5.0, compress="", compress_min=256)
+    mw = PublisherMW (self.logger)
+    mw.configure (args)
+    mw.pub.setsockopt (zmq.SNDHWM, 0)
+
+    sub = zmq.Context.instance ().socket (zmq.SUB)
+    sub.setsockopt (zmq.RCVHWM, 0)
+    sub.connect (mw.endpoints[0])
+    sub.setsockopt (zmq.SUBSCRIBE, b"")
+    time.sleep (0.2)  # let the subscription reach the publisher
+
+    topics = self.topiclist
+    self.measure ("disseminate",
+                  self.loop (lambda i: mw.disseminate ("pub1", topics[i % len (topics)], i), self.iters), self.iters,
+                  lambda: drain (sub, self.iters))
+
+  ########################################
+  # SubscriberMW.receive_from_pub of samples queued over inproc
+  ########################################
+  def receive_from_pub (self):
+    context = zmq.Context.instance ()
+    pub = context.socket (zmq.PUB)
+    pub.setsockopt (zmq.SNDHWM, 0)
+    endpoint, = local_endpoints ("127.0.0.1", self.port + 1, ["inproc"])
+    bind_endpoints (pub, [endpoint])
+
+    args = argparse.Namespace (port=self.port + 2, addr="127.0.0.1", discovery="127.0.0.1:{}".format (self.port + 4), budget=100, qos="", predicates="", transports="inproc")
+    mw = SubscriberMW (self.logger)
+    mw.configure (args)
+    mw.sub.setsockopt (zmq.RCVHWM, 0)
+    mw.connect_pub (endpoint)
+    # subscribed to # and told the ids of our topics, as discovery would
+    mw.topics.add ("#", "#")
+    mw.intern ([discovery_pb2.TopicId (topic=topic, id=topic_id (topic)) for topic in self.topiclist])
+    counter = SampleCounter ()
+    mw.set_upcall_handle (counter)
+    time.sleep (0.2)  # let the subscription reach the publisher
+
+    codec = PublicationCodec ()
+    messages = [codec.encode ("pub1", self.topiclist[i % len (self.topiclist)], i) for i in range (self.iters)]
+    def prepare ():
+      counter.count = 0
+      for frames in messages:
+        pub.send_multipart (frames)
+    def run ():
+      while counter.count < self.iters:
+        mw.receive_from_pub (mw.sub)
+    self.measure ("receive_from_pub", run, self.iters, prepare)
+
+  ########################################
+  # BrokerMW.proxy of samples queued over inproc
+  ########################################
+  def proxy (self):
+    context = zmq.Context.instance ()
+    pub = context.socket (zmq.PUB)
+    pub.setsockopt (zmq.SNDHWM, 0)
+    endpoint, = local_endpoints ("127.0.0.1", self.port + 3, ["inproc"])
+    bind_endpoints (pub, [endpoint])
+
+    args = argparse.Namespace (port=self.port + 5, addr="127.0.0.1", discovery="127.0.0.1:{}".format (self.port + 4), forwarding="proxy", budget=100, egress="pub", hwm=1000, log_dir=None, transports="inproc")
+    brk = BrokerMW (self.logger)
+    brk.configure (args)
+    brk.sub.setsockopt (zmq.RCVHWM, 0)
+    brk.pub.setsockopt (zmq.SNDHWM, 0)
+    brk.connect_pub (endpoint)
+    # a lone broker owns every topic
+    brk.set_topics (self.topiclist)
+
+    sub = context.socket (zmq.SUB)
+    sub.setsockopt (zmq.RCVHWM, 0)
+    sub.connect (brk.endpoints[0])
+    sub.setsockopt (zmq.SUBSCRIBE, b"")
+    time.sleep (0.2)  # let the subscriptions make their way up
+
+    codec = PublicationCodec ()
+    messages = [codec.encode ("pub1", self.topiclist[i % len (self.topiclist)], i) for i in range (self.iters)]
+    def prepare ():
+      drain (sub, self.iters)
+      for frames in messages:
+        pub.send_multipart (frames)
+    def run ():
+      # what the broker event loop does while its SUB socket is readable
+      while brk.sub.poll (0):
+        brk.proxy ()
+    self.measure ("proxy", run, self.iters, prepare)
+
+    # every sample has to have made it through for the rate to mean anything
+    forwarded = len (drain (sub, self.iters + 1))
+    if forwarded != self.iters:
+      self.logger.warning ("HotPathBenchmark::proxy - {} of {} samples forwarded".format (forwarded, self.iters))
+
+  ########################################
+  # driver
+  ########################################
+  def driver (self):
+    ''' Driver program; returns the number of regressions '''
+
+    try:
+      self.logger.info ("HotPathBenchmark::driver")
+
+      self.discovery ()
+      if "disseminate" in self.cases:
+        self.disseminate ()
+      if "receive_from_pub" in self.cases:
+        self.receive_from_pub ()
+      if "proxy" in self.cases:
+        self.proxy ()
+      zmq.Context.instance ().destroy (linger=0)
+
+      regressions = self.report ()
+      if self.output:
+        self.save ()
+
+      self.logger.info ("HotPathBenchmark::driver completed")
+      return regressions
+
+    except Exception as e:
+      raise e
+
+  ########################################
+  # save the results as a baseline
+  ########################################
+  def save (self):
+    try:
+      baseline = {"python": platform.python_version (),
+                  "zmq": zmq.zmq_version (),
+                  "time": time.strftime ("%Y-%m-%dT%H:%M:%S"),
+                  "iters": self.iters,
+                  "num_topics": len (self.topiclist),
+                  "nodes": self.nodes,
+                  "results": self.results}
+      with open (self.output, "w") as f:
+        json.dump (baseline, f, indent=2)
+      self.logger.info ("HotPathBenchmark::save - results written to {}".format (self.output))
+    except Exception as e:
+      raise e
+
+  ########################################
+  # how a case compares with the baseline
+  ########################################
+  def regressed (self, result, base):
+    ''' the change in ops/s and whether it, or the allocations, got worse by over the threshold '''
+    change = result["ops_per_sec"] / base["ops_per_sec"] - 1
+    slower = change < -self.threshold
+    fatter = any (result[key] > base[key] * (1 + self.threshold) + ALLOC_SLACK for key in ("peak_bytes", "retained_bytes_per_op"))
+    return change, slower or fatter
+
+  ########################################
+  # print the results
+  ########################################
+  def report (self):
+    ''' Pretty print; returns the number of regressions '''
+    try:
+      regressions = 0
+      base = self.baseline["results"] if self.baseline else {}
+      if self.baseline:
+        print ("compared with the baseline of {} (-t {:.0f}%)".format (self.baseline.get ("time", "?"), self.threshold * 100))
+        if self.baseline.get ("iters") != self.iters or self.baseline.get ("num_topics") != len (self.topiclist):
+          print ("the baseline ran with other -i/-T, so its numbers may not compare")
+      print ("{:<20} {:>14} {:>9} {:>12} {:>12}".format ("case", "ops/s", "change", "peak bytes", "kept B/op"))
+      for name in CASES:
+        result = self.results.get (name)
+        if result is None:
+          continue
+        change, flag = "", ""
+        if name in base:
+          delta, regressed = self.regressed (result, base[name])
+          change = "{:+.1f}%".format (delta * 100)
+          if regressed:
+            flag = "REGRESSION"
+            regressions += 1
+        print ("{:<20} {:>14.0f} {:>9} {:>12} {:>12.1f}  {}".format (name, result["ops_per_sec"], change, result["peak_bytes"], result["retained_bytes_per_op"], flag).rstrip ())
+      if self.baseline:
+        print ("{} regression{}".format (regressions, "" if regressions == 1 else "s"))
+      return regressions
+
+    except Exception as e:
+      raise e
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  # instantiate a ArgumentParser object
+  parser = argparse.ArgumentParser (description="Middleware hot path microbenchmarks")
+
+  parser.add_argument ("-i", "--iters", type=int, default=20000, help="Ops per run (finger tables: a hundredth of that), default 20000")
+
+  parser.add_argument ("-r", "--repeat", type=int, default=5, help="Runs per case, the best is reported, default 5")
+
+  parser.add_argument ("-k", "--cases", default="", help="Comma separated cases to run out of {}; default all".format (",".join (CASES)))
+
+  parser.add_argument ("-T", "--num_topics", type=int, default=5, help="Topics hashed, registered and published, default 5")
+
+  parser.add_argument ("-D", "--nodes", type=int, default=20, help="DHT nodes in the ring the finger table is made for, default 20")
+
+  parser.add_argument ("-p", "--port", type=int, default=5600, help="First of the six local ports the middleware objects bind to besides their inproc endpoints, default 5600")
+
+  parser.add_argument ("-o", "--output", default=None, help="Save the results as a json baseline to this file, default none")
+
+  parser.add_argument ("-c", "--compare", default=None, help="Compare with the json baseline of an earlier run, default none")
+
+  parser.add_argument ("-t", "--threshold", type=float, default=15.0, help="Percent fewer ops/s, or more bytes allocated, than the baseline that counts as a regression; runs on a busy or different host vary by about that much. Default 15")
+
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args()
+
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  try:
+    # obtain a system wide logger and initialize it to debug level to begin with
+    logging.info ("Main - acquire a child logger and then log messages in the child")
+    logger = logging.getLogger ("HotPathBenchmark")
+
+    # first parse the arguments
+    logger.debug ("Main: parse command line arguments")
+    args = parseCmdLineArgs ()
+
+    # reset the log level to as specified
+    logger.debug ("Main: resetting log level to {}".format (args.loglevel))
+    logger.setLevel (args.loglevel)
+    logger.debug ("Main: effective log level is {}".format (logger.getEffectiveLevel ()))
+
+    # Obtain the benchmark object
+    logger.debug ("Main: obtain the benchmark object")
+    bench = HotPathBenchmark (logger)
+
+    # configure the object
+    logger.debug ("Main: configure the benchmark object")
+    bench.configure (args)
+
+    # now invoke the driver program
+    logger.debug ("Main: invoke the benchmark driver")
+    regressions = bench.driver ()
+
+  except Exception as e:
+    logger.error ("Exception caught in main - {}".format (e))
+    sys.exit (2)
+
+  # so that a script can tell a regression
+  if regressions:
+    sys.exit (1)
+
+
+###################################
+#
+# Main entry point
+#
+###################################
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+  main ()
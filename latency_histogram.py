@@ -0,0 +1,321 @@
+###############################################
+#
+# Purpose: Fixed memory latency histogram for our experiments
+#
+# Every subscriber records the one-way latency of each sample it receives
+# (receive time minus the timestamp the publisher put in the Publication)
+# into one of these histograms per topic and publisher. At the end of the run
+# the subscriber writes them out; since the bucket layout is the same for
+# everybody, the files of hundreds of subscribers can be merged by adding up
+# the bucket counts, which is what running this file as a program does:
+#
+#    python3 latency_histogram.py -o all.json sub1_latency.json sub2_latency.json ...
+#
+###############################################
+
+import argparse # for argument parsing
+import csv # for the percentile table
+import json # histograms are saved as json
+import logging # for logging. Use it in place of print statements.
+
+##################################
+#       Latency histogram
+#
+# Log-linear buckets: values below 2^sub_bits get a bucket each, above that
+# every power of two is split into 2^sub_bits equal buckets. So any value is
+# off by at most 1/2^sub_bits of itself (about 1.6% with the default 6 bits)
+# and the whole range of a 64 bit nanosecond count fits in a fixed list of
+# (65 - sub_bits) * 2^sub_bits counters.
+##################################
+class LatencyHistogram ():
+
+  percentiles = (50.0, 90.0, 99.0, 99.9)
+
+  def __init__ (self, sub_bits=6):
+    self.sub_bits = sub_bits
+    self.sub_count = 1 << sub_bits
+    self.counts = [0] * ((65 - sub_bits) * self.sub_count)
+    self.count = 0 # number of values recorded
+    self.total = 0 # sum of the values recorded
+    self.min = None
+    self.max = None
+
+  ########################################
+  # bucket arithmetic
+  ########################################
+  def index (self, value):
+    ''' bucket of a (non negative, integer) value '''
+    if value < self.sub_count:
+      return value
+    shift = value.bit_length () - self.sub_bits - 1
+    return shift * self.sub_count + (value >> shift)
+
+  def bucket_value (self, index):
+    ''' the value we report for a bucket: the middle of its range '''
+    if index < self.sub_count:
+      return index
+    shift = index // self.sub_count - 1
+    mantissa = index - shift * self.sub_count
+    return (mantissa << shift) + ((1 << shift) >> 1)
+
+  ########################################
+  # recording
+  ########################################
+  def record (self, value):
+    ''' record one latency in nanoseconds; clock skew can make it negative, we count that as 0 '''
+    value = int (value)
+    if value < 0:
+      value = 0
+    self.counts[self.index (value)] += 1
+    self.count += 1
+    self.total += value
+    if self.min is None or value < self.min:
+      self.min = value
+    if self.max is None or value > self.max:
+      self.max = value
+
+  def merge (self, other):
+    ''' add the counts of another histogram with the same layout to ours '''
+    if other.sub_bits != self.sub_bits:
+      raise ValueError ("Cannot merge histograms with {} and {} sub bucket bits".format (self.sub_bits, other.sub_bits))
+    counts = self.counts
+    for index, count in enumerate (other.counts):
+      if count:
+        counts[index] += count
+    self.count += other.count
+    self.total += other.total
+    if other.min is not None and (self.min is None or other.min < self.min):
+      self.min = other.min
+    if other.max is not None and (self.max is None or other.max > self.max):
+      self.max = other.max
+
+  ########################################
+  # reading
+  ########################################
+  def percentile (self, pct):
+    ''' value at or below which pct percent of the recorded values fall '''
+    if not self.count:
+      return None
+    rank = max (1, int (round (pct / 100.0 * self.count)))
+    seen = 0
+    for index, count in enumerate (self.counts):
+      seen += count
+      if seen >= rank:
+        # never report past what was actually recorded
+        return min (max (self.bucket_value (index), self.min), self.max)
+    return self.max
+
+  def mean (self):
+    return self.total / self.count if self.count else None
+
+  def summary (self, scale=1000.0):
+    ''' count, min, mean, max and our percentiles, in usec by default '''
+    result = {"count": self.count}
+    if self.count:
+      result["min"] = self.min / scale
+      result["mean"] = self.mean () / scale
+      result["max"] = self.max / scale
+      for pct in self.percentiles:
+        result["p{:g}".format (pct)] = self.percentile (pct) / scale
+    return result
+
+  ########################################
+  # saving and loading
+  ########################################
+  def to_dict (self):
+    ''' only the buckets in use are saved '''
+    return {"sub_bits": self.sub_bits,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {str (index): count for index, count in enumerate (self.counts) if count}}
+
+  @classmethod
+  def from_dict (cls, data):
+    hist = cls (data["sub_bits"])
+    for index, count in data["buckets"].items ():
+      hist.counts[int (index)] = count
+    hist.count = data["count"]
+    hist.total = data["total"]
+    hist.min = data["min"]
+    hist.max = data["max"]
+    return hist
+
+##################################
+#       Latency histograms of one run
+#
+# One histogram per (topic, publisher) plus the total across all of them.
+##################################
+class LatencyRecorder ():
+
+  def __init__ (self, name, sub_bits=6):
+    self.name = name # who recorded them
+    self.sub_bits = sub_bits
+    self.total = LatencyHistogram (sub_bits)
+    self.series = {} # (topic, publisher) -> histogram
+
+  def record (self, topic, publisher, latency):
+    hist = self.series.get ((topic, publisher))
+    if hist is None:
+      hist = LatencyHistogram (self.sub_bits)
+      self.series[(topic, publisher)] = hist
+    hist.record (latency)
+    self.total.record (latency)
+
+  def merge (self, other):
+    for key, hist in other.series.items ():
+      if key in self.series:
+        self.series[key].merge (hist)
+      else:
+        mine = LatencyHistogram (self.sub_bits)
+        mine.merge (hist)
+        self.series[key] = mine
+    self.total.merge (other.total)
+
+  def rows (self):
+    ''' one summary row per series (in usec), the total last '''
+    rows = []
+    for (topic, publisher), hist in sorted (self.series.items ()):
+      row = {"topic": topic, "publisher": publisher}
+      row.update (hist.summary ())
+      rows.append (row)
+    row = {"topic": "*", "publisher": "*"}
+    row.update (self.total.summary ())
+    rows.append (row)
+    return rows
+
+  def save (self, filename):
+    ''' a .csv file gets the percentile table, anything else the mergeable json '''
+    if filename.endswith (".csv"):
+      fields = ["topic", "publisher", "count", "min", "mean", "max"] + ["p{:g}".format (pct) for pct in LatencyHistogram.percentiles]
+      with open (filename, "w", newline="") as f:
+        writer = csv.DictWriter (f, fieldnames=fields)
+        writer.writeheader ()
+        writer.writerows (self.rows ())
+    else:
+      data = {"name": self.name,
+              "unit": "ns",
+              "summary_unit": "us",
+              "total": self.total.to_dict (),
+              "summary": self.rows (),
+              "series": [{"topic": topic, "publisher": publisher, "histogram": hist.to_dict ()}
+                         for (topic, publisher), hist in sorted (self.series.items ())]}
+      with open (filename, "w") as f:
+        json.dump (data, f, indent=1)
+
+  @classmethod
+  def load (cls, filename):
+    with open (filename) as f:
+      data = json.load (f)
+    recorder = cls (data["name"], data["total"]["sub_bits"])
+    recorder.total = LatencyHistogram.from_dict (data["total"])
+    for entry in data["series"]:
+      recorder.series[(entry["topic"], entry["publisher"])] = LatencyHistogram.from_dict (entry["histogram"])
+    return recorder
+
+##################################
+#       Histogram merger
+##################################
+class HistogramMerger ():
+
+  def __init__ (self, logger):
+    self.logger = logger  # internal logger for print statements
+    self.files = None # the histogram files to merge
+    self.output = None # where the merged histograms go
+    self.csv = None # optional percentile table
+
+  def configure (self, args):
+    ''' Initialize the object '''
+    try:
+      self.logger.info ("HistogramMerger::configure")
+      self.files = args.files
+      self.output = args.output
+      self.csv = args.csv
+    except Exception as e:
+      raise e
+
+  def driver (self):
+    ''' Driver program '''
+    try:
+      self.logger.info ("HistogramMerger::driver")
+      merged = LatencyRecorder (self.output)
+      for filename in self.files:
+        self.logger.debug ("HistogramMerger::driver - merging {}".format (filename))
+        merged.merge (LatencyRecorder.load (filename))
+
+      merged.save (self.output)
+      if self.csv:
+        merged.save (self.csv)
+
+      fields = ["count", "min", "mean", "max"] + ["p{:g}".format (pct) for pct in LatencyHistogram.percentiles]
+      print ("{:<16} {:<12} ".format ("topic", "publisher") + " ".join ("{:>10}".format (field) for field in fields))
+      for row in merged.rows ():
+        print ("{:<16} {:<12} {:>10} ".format (row["topic"], row["publisher"], row["count"]) +
+               " ".join ("{:>10.1f}".format (row[field]) if field in row else "{:>10}".format ("-") for field in fields[1:]))
+      self.logger.info ("HistogramMerger::driver - merged {} files into {}".format (len (self.files), self.output))
+
+    except Exception as e:
+      raise e
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  # instantiate a ArgumentParser object
+  parser = argparse.ArgumentParser (description="Merge latency histogram files")
+
+  parser.add_argument ("files", nargs="+", help="json histogram files written by the subscribers")
+
+  parser.add_argument ("-o", "--output", default="latency_merged.json", help="merged json histogram file, default latency_merged.json")
+
+  parser.add_argument ("-c", "--csv", default=None, help="also write the merged percentile table to this csv file")
+
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  try:
+    # obtain a system wide logger and initialize it to debug level to begin with
+    logging.info ("Main - acquire a child logger and then log messages in the child")
+    logger = logging.getLogger ("HistogramMerger")
+
+    # first parse the arguments
+    logger.debug ("Main: parse command line arguments")
+    args = parseCmdLineArgs ()
+
+    # reset the log level to as specified
+    logger.debug ("Main: resetting log level to {}".format (args.loglevel))
+    logger.setLevel (args.loglevel)
+    logger.debug ("Main: effective log level is {}".format (logger.getEffectiveLevel ()))
+
+    # Obtain the merger object
+    merger = HistogramMerger (logger)
+    merger.configure (args)
+    merger.driver ()
+
+  except Exception as e:
+    logger.error ("Exception caught in main - {}".format (e))
+    return
+
+###################################
+#
+# Main entry point
+#
+###################################
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+  main ()
@@ -0,0 +1,253 @@
+###############################################
+#
+# Purpose: Synthetic load for our experiments
+#
+# A publisher normally publishes every one of its topics once per round, at
+# -f rounds a second, and so never sends faster than it keeps up with. Run
+# with -g poisson (or -g fixed) it is driven by a LoadGenerator instead: an
+# open loop of -f samples a second over all its topics together, each on one
+# of them picked by its popularity (Zipf, -K) and carrying, with -y, a string
+# payload whose size is drawn from a distribution. Samples are sent when they
+# are due whether or not the publisher keeps up, and carry the time they were
+# due as their timestamp, so a backlog shows in the subscribers' latencies
+# rather than quietly lowering the rate.
+#
+# Arrival times, topics, payload sizes and payloads are drawn a batch at a
+# time, with NumPy if it is installed, so that making up the load costs
+# little next to sending it. Without NumPy the random module does the same
+# sample by sample.
+#
+###############################################
+
+import bisect # for the samples that are due
+import heapq # for the weighted sample without numpy
+import itertools # for the cumulative popularity
+import math # for the lognormal median
+import random # draws without numpy
+import string # the payload alphabet
+import time # for the monotonic clock
+
+try:
+  import numpy  # vectorized draws, if installed
+except ImportError:
+  numpy = None
+
+ARRIVALS = ("poisson", "fixed")  # open loop arrival processes (-g)
+MAX_PAYLOAD = 1 << 20  # largest payload drawn, in bytes
+BATCH = 4096  # samples drawn at a time
+
+##################################
+#       Topic popularity
+#
+# The topic of rank r (0 being the most popular) is picked with a weight of
+# 1/(r+1)^skew, so a skew of 0 makes every topic as popular as any other and
+# the usual Zipf skew of about 1 gives the top few topics most of the load.
+##################################
+def zipf_weights (ranks, skew):
+  ''' popularity of the topics of these ranks '''
+  return [1.0 / (rank + 1) ** skew for rank in ranks]
+
+def weighted_sample (population, weights, num):
+  ''' num distinct members of population, each picked with a chance going by
+  its weight (the keys of Efraimidis and Spirakis, u^(1/weight), are largest
+  for the ones picked) '''
+  if num > len (population):
+    raise ValueError ("Cannot pick {} out of {}".format (num, len (population)))
+  if numpy is not None:
+    keys = numpy.log (numpy.random.random (len (population))) / numpy.asarray (weights)
+    picked = numpy.argpartition (keys, len (population) - num)[len (population) - num:].tolist () if num else []
+    return [population[i] for i in picked]
+  picked = heapq.nlargest (num, range (len (population)), key=lambda i: random.random () ** (1.0 / weights[i]))
+  return [population[i] for i in picked]
+
+##################################
+#       Payload sizes
+#
+# Given as N (always N bytes), uniform:MIN:MAX, exp:MEAN or
+# lognormal:MEDIAN:SIGMA; drawn sizes are capped at MAX_PAYLOAD. The payloads
+# are slices of one random string of letters, so a payload costs a slice.
+##################################
+class PayloadSizes ():
+
+  def __init__ (self, spec):
+    self.spec = spec
+    kind, _, params = spec.partition (":")
+    try:
+      if not params:
+        self.kind, self.params = "fixed", (int (kind),)
+      else:
+        self.kind, self.params = kind, tuple (float (param) for param in params.split (":"))
+    except ValueError:
+      raise ValueError ("Bad payload size {}; expected N, uniform:MIN:MAX, exp:MEAN or lognormal:MEDIAN:SIGMA".format (spec))
+    arity = {"fixed": 1, "uniform": 2, "exp": 1, "lognormal": 2}.get (self.kind)
+    if arity != len (self.params) or min (self.params) < 0 or (self.kind == "uniform" and self.params[0] > self.params[1]):
+      raise ValueError ("Bad payload size {}; expected N, uniform:MIN:MAX, exp:MEAN or lognormal:MEDIAN:SIGMA".format (spec))
+    if self.kind in ("fixed", "uniform"):
+      self.params = tuple (int (param) for param in self.params)
+      self.max = min (MAX_PAYLOAD, max (self.params))
+    else:
+      self.max = MAX_PAYLOAD
+    # twice the largest payload, so slices start anywhere in the first half
+    self.pool = random_string (max (65536, 2 * self.max))
+
+  def __str__ (self):
+    return self.spec
+
+  def draw (self, num):
+    ''' num payload sizes, as a list '''
+    if numpy is not None:
+      rng = numpy.random
+      if self.kind == "fixed":
+        sizes = numpy.full (num, self.params[0])
+      elif self.kind == "uniform":
+        sizes = rng.randint (self.params[0], self.params[1] + 1, num)
+      elif self.kind == "exp":
+        sizes = rng.exponential (self.params[0], num)
+      else:
+        sizes = rng.lognormal (math.log (max (self.params[0], 1)), self.params[1], num)
+      return numpy.minimum (sizes.astype (numpy.int64), self.max).tolist ()
+    if self.kind == "fixed":
+      draw = lambda: self.params[0]
+    elif self.kind == "uniform":
+      draw = lambda: random.randint (self.params[0], self.params[1])
+    elif self.kind == "exp":
+      draw = lambda: int (random.expovariate (1.0 / self.params[0])) if self.params[0] else 0
+    else:
+      draw = lambda: int (random.lognormvariate (math.log (max (self.params[0], 1)), self.params[1]))
+    return [min (draw (), self.max) for _ in range (num)]
+
+  def payloads (self, num):
+    ''' num payloads of drawn sizes '''
+    pool = self.pool
+    sizes = self.draw (num)
+    if numpy is not None:
+      starts = numpy.random.randint (0, len (pool) - self.max + 1, num).tolist ()
+    else:
+      starts = [random.randrange (len (pool) - self.max + 1) for _ in range (num)]
+    return [pool[start:start + size] for start, size in zip (starts, sizes)]
+
+def random_string (length):
+  ''' length random ascii letters '''
+  if numpy is not None:
+    return numpy.random.randint (ord ("a"), ord ("z") + 1, length, dtype=numpy.uint8).tobytes ().decode ("ascii")
+  return "".join (random.choices (string.ascii_lowercase, k=length))
+
+##################################
+#       Load generator
+#
+# Sample k is due at start + the sum of the first k gaps, which are 1/rate
+# apart (fixed) or exponentially distributed with that mean (poisson). The
+# publisher calls take () from its invoke_operation upcall and sends
+# everything that is due; timeout () tells it when to come back. Unlike the
+# PublicationScheduler nothing is ever skipped: what is due goes out however
+# late, and behind keeps the furthest the generator got behind.
+##################################
+class LoadGenerator ():
+
+  def __init__ (self, topics, rate, arrivals="poisson", weights=None, sizes=None, values=None, batch=BATCH):
+    ''' topics: what we publish on; rate: samples a second over all of them;
+    weights: their popularity (default all alike); sizes: the PayloadSizes of
+    our payloads, or values: a function that gives the value of a sample of
+    a topic '''
+    if rate <= 0:
+      raise ValueError ("Publication rate must be positive, got {}".format (rate))
+    if arrivals not in ARRIVALS:
+      raise ValueError ("Unknown arrival process {}; choose from {}".format (arrivals, ", ".join (ARRIVALS)))
+    if sizes is None and values is None:
+      raise ValueError ("A load generator needs payload sizes or values")
+    self.topics = list (topics)
+    self.period = 1.0 / rate  # mean seconds between samples
+    self.arrivals = arrivals
+    total = float (sum (weights)) if weights else 0.0
+    self.probabilities = [weight / total for weight in weights] if total else None
+    self.cumulative = list (itertools.accumulate (self.probabilities)) if total else None
+    self.sizes = sizes
+    self.values = values
+    self.batch = batch
+    self.start_time = None  # monotonic time the first gap starts
+    self.start_ns = None  # the same in ns since the epoch, for the timestamps
+    self.last = 0.0  # offset of the last sample drawn from the start, in seconds
+    self.due = []  # offsets of the samples drawn and not yet taken
+    self.picked = []  # and their topics
+    self.payloads = []  # and their values
+    self.next = 0  # index of the next sample in the above
+    self.generated = 0  # samples taken so far
+    self.behind = 0.0  # furthest behind the schedule we found ourselves, in seconds
+
+  def start (self, now=None):
+    self.start_time = time.monotonic () if now is None else now
+    self.start_ns = time.time_ns () - int ((time.monotonic () - self.start_time) * 1e9)
+    self.last = 0.0
+    self.due, self.picked, self.payloads, self.next = [], [], [], 0
+    self.generated = 0
+    self.behind = 0.0
+    self.refill ()
+
+  ########################################
+  # draw the next batch of samples
+  ########################################
+  def refill (self):
+    num = self.batch
+    if numpy is not None:
+      rng = numpy.random
+      gaps = rng.exponential (self.period, num) if self.arrivals == "poisson" else numpy.full (num, self.period)
+      due = (self.last + numpy.cumsum (gaps)).tolist ()
+      if len (self.topics) == 1:
+        picked = self.topics * num
+      elif self.probabilities is None:
+        picked = [self.topics[i] for i in rng.randint (0, len (self.topics), num).tolist ()]
+      else:
+        picked = [self.topics[i] for i in rng.choice (len (self.topics), num, p=self.probabilities).tolist ()]
+    else:
+      if self.arrivals == "poisson":
+        gaps = [random.expovariate (1.0 / self.period) for _ in range (num)]
+      else:
+        gaps = [self.period] * num
+      due = list (itertools.accumulate (gaps, initial=self.last))[1:]
+      if self.cumulative is None:
+        picked = random.choices (self.topics, k=num)
+      else:
+        picked = random.choices (self.topics, cum_weights=self.cumulative, k=num)
+    if self.sizes is not None:
+      payloads = self.sizes.payloads (num)
+    else:
+      payloads = [self.values (topic) for topic in picked]
+    self.due, self.picked, self.payloads, self.next = due, picked, payloads, 0
+    self.last = due[-1]
+
+  ########################################
+  # the samples due by now
+  ########################################
+  def take (self, limit=None, now=None):
+    ''' (topic, value, timestamp in ns since the epoch) of up to limit
+    samples that are due '''
+    if now is None:
+      now = time.monotonic ()
+    elapsed = now - self.start_time
+    taken = []
+    while limit is None or len (taken) < limit:
+      if self.next == len (self.due):
+        self.refill ()
+      # all of this batch that is due, as far as the limit lets us
+      end = bisect.bisect_right (self.due, elapsed, self.next)
+      if limit is not None:
+        end = min (end, self.next + limit - len (taken))
+      if end == self.next:
+        break
+      start_ns = self.start_ns
+      for i in range (self.next, end):
+        taken.append ((self.picked[i], self.payloads[i], start_ns + int (self.due[i] * 1e9)))
+      self.behind = max (self.behind, elapsed - self.due[self.next])
+      self.next = end
+    self.generated += len (taken)
+    return taken
+
+  def next_deadline (self):
+    ''' monotonic time the next sample is due '''
+    if self.next == len (self.due):
+      self.refill ()
+    return self.start_time + self.due[self.next]
+
+  def timeout (self):
+    ''' msec until the next sample, as an upcall returns it to the event loop '''
+    return max (0.0, (self.next_deadline () - time.monotonic ()) * 1000.0)
@@ -0,0 +1,733 @@
+###############################################
+#
+# Purpose: Microbenchmark for the discovery message serialization used by
+# the middleware objects
+#
+# For every discovery message type, it measures how many messages per second
+# can be built and serialized the way the middleware used to do it (allocate
+# the nested message, allocate the outer one, CopyFrom) and the way it does it
+# now through the DiscoveryCodec in CS6381_MW/Common.py. The decode rows are
+# there to keep an eye on parsing, which the codec leaves as a plain parse.
+#
+# The data path is measured the same way: the "topic:value" UTF-8 string the
+# publishers used to send against the two frame Publication format.
+#
+# Finally, samples are pushed through a real PUB/SUB pair over loopback TCP,
+# one message per sample and then batched, to show what batching buys in
+# throughput. What it costs is latency: a sample can sit in its batch for up
+# to the linger time (PublisherAppln --linger).
+#
+# The same goes through a BrokerMW in between, once forwarding in its event
+# loop (proxy) and once on its XSUB/XPUB device thread (device).
+#
+# Last, a SubscriberMW takes queued samples off its SUB socket the way its
+# event loop does, poll and then receive_from_pub, with each of the drain
+# budgets given by -u (1 = one message per wakeup, as it used to be).
+#
+# The transport table pushes samples through a PUB/SUB pair over each of
+# the transports the middleware picks from (see Transports in Common.py):
+# tcp over loopback, which is what peers on the same host used to talk over,
+# ipc and inproc. It gives the throughput and the one way latency of a lone
+# sample, sent only once the previous one has arrived.
+#
+# The logging table shows what one per message log statement costs the
+# sending thread: guarded, eagerly and lazily formatted below the level,
+# and emitted through a plain stream handler, the LogUtil queue and the
+# queue with rate sampling, all writing to /dev/null. On a sink that fast
+# the queue costs more than writing directly. The last two rows write to a
+# slow sink, a pipe that is read only now and then, where the stream
+# handler blocks and the queue does not.
+#
+###############################################
+
+import argparse # for argument parsing
+import logging # for logging. Use it in place of print statements.
+import logging.handlers # queue handler and listener
+import os # for the null device
+import queue # between the queue handler and listener
+import time   # for the clock
+import threading  # publisher and broker run next to the subscriber
+import zmq  # ZMQ sockets
+
+from CS6381_MW import discovery_pb2
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.SubscriberMW import SubscriberMW
+from CS6381_MW.Common import DiscoveryCodec, PublicationCodec, PublicationBatcher, BATCH_TAG, topic_id
+from CS6381_MW.Common import parse_transports, local_endpoints, bind_endpoints
+from CS6381_MW.LogUtil import Lazy, RateSampler, hot_path
+
+##################################
+# Stands in for the SubscriberAppln upcalls
+##################################
+class SampleCounter ():
+
+  def __init__ (self):
+    self.count = 0 # samples handed up so far
+    self.upcalls = 0 # data_receive upcalls so far
+
+  def data_receive (self, samples):
+    self.count += len (samples)
+    self.upcalls += 1
+    return None
+
+##################################
+# The builders as the middleware used to have them
+##################################
+def legacy_register_req (name, addr, port, topiclist):
+  reg_info = discovery_pb2.RegistrantInfo ()
+  reg_info.id = name
+  reg_info.addr = addr
+  reg_info.port = port
+  register_req = discovery_pb2.RegisterReq ()
+  register_req.role = discovery_pb2.ROLE_PUBLISHER
+  register_req.info.CopyFrom (reg_info)
+  register_req.topiclist[:] = topiclist
+  disc_req = discovery_pb2.DiscoveryReq ()
+  disc_req.msg_type = discovery_pb2.TYPE_REGISTER
+  disc_req.node_type = discovery_pb2.TYPE_INITIAL
+  disc_req.register_req.CopyFrom (register_req)
+  return disc_req.SerializeToString ()
+
+def legacy_isready_req ():
+  isready_req = discovery_pb2.IsReadyReq ()
+  disc_req = discovery_pb2.DiscoveryReq ()
+  disc_req.msg_type = discovery_pb2.TYPE_ISREADY
+  disc_req.node_type = discovery_pb2.TYPE_INITIAL
+  disc_req.isready_req.CopyFrom (isready_req)
+  return disc_req.SerializeToString ()
+
+def legacy_lookup_req (topiclist):
+  lookup_req = discovery_pb2.LookupPubByTopicReq ()
+  lookup_req.topiclist[:] = topiclist
+  disc_req = discovery_pb2.DiscoveryReq ()
+  disc_req.msg_type = discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC
+  disc_req.node_type = discovery_pb2.TYPE_INITIAL
+  disc_req.lookup_req.CopyFrom (lookup_req)
+  return disc_req.SerializeToString ()
+
+def legacy_register_resp (status, reason):
+  register_resp = discovery_pb2.RegisterResp ()
+  register_resp.status = status
+  if reason is not None:
+    register_resp.reason = reason
+  disc_resp = discovery_pb2.DiscoveryResp ()
+  disc_resp.msg_type = discovery_pb2.TYPE_REGISTER
+  disc_resp.register_resp.CopyFrom (register_resp)
+  return disc_resp.SerializeToString ()
+
+def legacy_isready_resp (is_ready):
+  isready_resp = discovery_pb2.IsReadyResp ()
+  isready_resp.status = is_ready
+  disc_resp = discovery_pb2.DiscoveryResp ()
+  disc_resp.msg_type = discovery_pb2.TYPE_ISREADY
+  disc_resp.isready_resp.CopyFrom (isready_resp)
+  return disc_resp.SerializeToString ()
+
+def legacy_lookup_resp (publisherInfos):
+  # the appln handed over RegistrantInfo objects which got copied once more
+  infos = []
+  for pubid, addr, port in publisherInfos:
+    info = discovery_pb2.RegistrantInfo ()
+    info.id = pubid
+    info.addr = addr
+    info.port = port
+    infos.append (info)
+  lookup_resp = discovery_pb2.LookupPubByTopicResp ()
+  lookup_resp.status = discovery_pb2.STATUS_SUCCESS
+  for publisherInfo in infos:
+    newPublisherInfo = discovery_pb2.RegistrantInfo ()
+    newPublisherInfo.id = publisherInfo.id
+    newPublisherInfo.addr = publisherInfo.addr
+    newPublisherInfo.port = publisherInfo.port
+    lookup_resp.publisherInfos.append (newPublisherInfo)
+  disc_resp = discovery_pb2.DiscoveryResp ()
+  disc_resp.msg_type = discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC
+  disc_resp.lookup_resp.CopyFrom (lookup_resp)
+  return disc_resp.SerializeToString ()
+
+def legacy_decode_resp (buf):
+  disc_resp = discovery_pb2.DiscoveryResp ()
+  disc_resp.ParseFromString (buf)
+  return disc_resp
+
+def legacy_decode_req (buf):
+  disc_req = discovery_pb2.DiscoveryReq ()
+  disc_req.ParseFromString (buf)
+  return disc_req
+
+def legacy_publication (topic, value):
+  # what PublisherMW.disseminate used to put on the wire
+  return bytes (topic + ":" + str (value), "utf-8")
+
+def legacy_receive (buf):
+  # and what SubscriberAppln.data_receive did with it
+  return str (buf, "utf-8").split (':')
+
+##################################
+#       Benchmark class
+##################################
+class MWBenchmark ():
+
+  ########################################
+  # constructor
+  ########################################
+  def __init__ (self, logger):
+    self.logger = logger  # internal logger for print statements
+    self.iters = None # messages per measurement
+    self.repeat = None # measurements per case, the best one is kept
+    self.topiclist = None # topics carried in register/lookup messages
+    self.publisherInfos = None # publishers carried in lookup responses
+    self.batches = None # batch sizes to push through PUB/SUB
+    self.results = [] # (message, legacy msgs/s, codec msgs/s)
+    self.pipeline_results = [] # (batch size, messages sent, samples/s)
+    self.port = None # first of the ports the broker cases bind to
+    self.broker_results = [] # (forwarding, samples received, samples/s)
+    self.budgets = None # drain budgets to run the SubscriberMW with
+    self.drain_results = [] # (budget, upcalls, samples/s)
+    self.transports = None # transports to compare PUB/SUB over
+    self.transport_results = [] # (transport, samples/s, p50 usec, p99 usec)
+    self.log_results = [] # (case, nsec per log statement)
+
+  ########################################
+  # configure/initialize
+  ########################################
+  def configure (self, args):
+    ''' Initialize the object '''
+
+    try:
+      self.logger.info ("MWBenchmark::configure")
+      self.iters = args.iters
+      self.repeat = args.repeat
+      self.batches = [int (size) for size in args.batches.split (",")]
+      self.budgets = [int (budget) for budget in args.budgets.split (",")]
+      self.port = args.port
+      self.transports = ["tcp"] + parse_transports (args.transports)
+      self.topiclist = ["topic{}".format (i) for i in range (args.num_topics)]
+      self.publisherInfos = [("pub{}".format (i), "10.0.0.{}".format (i % 250 + 1), 5570 + i) for i in range (args.num_pubs)]
+      self.logger.info ("MWBenchmark::configure completed")
+
+    except Exception as e:
+      raise e
+
+  ########################################
+  # best messages/s of a callable over the configured repetitions
+  ########################################
+  def rate (self, func, iters=None):
+    iters = iters or self.iters
+    best = None
+    for _ in range (self.repeat):
+      start = time.perf_counter ()
+      for _ in range (iters):
+        func ()
+      elapsed = time.perf_counter () - start
+      if best is None or elapsed < best:
+        best = elapsed
+    return iters / best
+
+  def measure (self, name, legacy, codec):
+    ''' run one case and remember its numbers '''
+    legacy_rate = self.rate (legacy)
+    codec_rate = self.rate (codec)
+    self.results.append ((name, legacy_rate, codec_rate))
+    self.logger.debug ("MWBenchmark::measure - {} done".format (name))
+
+  ########################################
+  # samples/s through a PUB/SUB pair for a batch size (1 = no batching)
+  ########################################
+  def pipeline (self, batch):
+    context = zmq.Context.instance ()
+    pub = context.socket (zmq.PUB)
+    sub = context.socket (zmq.SUB)
+    # everything is sent before anything is read, so nothing may be dropped
+    pub.setsockopt (zmq.SNDHWM, 0)
+    sub.setsockopt (zmq.RCVHWM, 0)
+    port = pub.bind_to_random_port ("tcp://127.0.0.1")
+    sub.connect ("tcp://127.0.0.1:{}".format (port))
+    sub.setsockopt (zmq.SUBSCRIBE, b"")
+    time.sleep (0.2)  # let the subscription reach the publisher
+
+    codec = PublicationCodec ()
+    # linger is not what we measure here, so only the batch size sends batches
+    batcher = PublicationBatcher (codec, batch, 1 << 30, 1e9) if batch > 1 else None
+    topics = self.topiclist
+    best = None
+    sent = 0
+    for _ in range (self.repeat):
+      start = time.perf_counter ()
+      sent = 0
+      for i in range (self.iters):
+        topic = topics[i % len (topics)]
+        if batcher is None:
+          pub.send_multipart (codec.encode ("pub1", topic, i))
+          sent += 1
+        else:
+          frames = batcher.add ("pub1", topic, i)
+          if frames is not None:
+            pub.send_multipart (frames)
+            sent += 1
+      if batcher is not None:
+        for frames in batcher.flush ():
+          pub.send_multipart (frames)
+          sent += 1
+
+      received = 0
+      while received < self.iters:
+        frames = sub.recv_multipart (copy=False)
+        if len (frames) == 3 and frames[1].bytes == BATCH_TAG:
+          received += len (PublicationCodec.decode_batch (frames[2].buffer))
+        else:
+          PublicationCodec.decode (frames[1].buffer)
+          received += 1
+      elapsed = time.perf_counter () - start
+      if best is None or elapsed < best:
+        best = elapsed
+
+    pub.close (linger=0)
+    sub.close (linger=0)
+    self.pipeline_results.append ((batch, sent, self.iters / best))
+    self.logger.debug ("MWBenchmark::pipeline - batch {} done".format (batch))
+
+  ########################################
+  # samples/s from a publisher through a broker to a subscriber
+  ########################################
+  def broker (self, forwarding, port):
+    context = zmq.Context.instance ()
+    pub = context.socket (zmq.PUB)
+    pub.setsockopt (zmq.SNDHWM, 0)
+    pub.bind ("tcp://127.0.0.1:{}".format (port))
+
+    args = argparse.Namespace (port=port + 1, addr="127.0.0.1", discovery="127.0.0.1:{}".format (port + 2), forwarding=forwarding, budget=100, egress="pub", hwm=1000, log_dir=None, transports="tcp")
+    brk = BrokerMW (self.logger)
+    brk.configure (args)
+    brk.connect_pub ("tcp://127.0.0.1:{}".format (port))
+    # a lone broker owns every topic
+    brk.set_topics (self.topiclist)
+    running = [True]
+    if forwarding == "proxy":
+      # what the broker event loop does with publications
+      def forward ():
+        while running[0]:
+          if brk.sub.poll (100):
+            brk.proxy ()
+      forwarder = threading.Thread (target=forward, daemon=True)
+      forwarder.start ()
+
+    sub = context.socket (zmq.SUB)
+    sub.connect ("tcp://127.0.0.1:{}".format (port + 1))
+    sub.setsockopt (zmq.SUBSCRIBE, b"")
+    time.sleep (0.5)  # let the subscriptions make their way up
+
+    codec = PublicationCodec ()
+    topics = self.topiclist
+    def publish ():
+      for i in range (self.iters):
+        pub.send_multipart (codec.encode ("pub1", topics[i % len (topics)], i))
+    publisher = threading.Thread (target=publish, daemon=True)
+
+    # whatever the broker drops under load never shows up, so stop once
+    # nothing more has arrived for a while
+    received = 0
+    start = time.perf_counter ()
+    last = start
+    publisher.start ()
+    while received < self.iters and sub.poll (1000):
+      frames = sub.recv_multipart (copy=False)
+      PublicationCodec.decode (frames[1].buffer)
+      received += 1
+      last = time.perf_counter ()
+    publisher.join ()
+
+    running[0] = False
+    if forwarding == "proxy":
+      forwarder.join ()
+      brk.sub.close (linger=0)
+      brk.pub.close (linger=0)
+    else:
+      brk.stop_device ()
+    brk.req.close (linger=0)
+    pub.close (linger=0)
+    sub.close (linger=0)
+    self.broker_results.append ((forwarding, received, received / (last - start)))
+    self.logger.debug ("MWBenchmark::broker - {} done".format (forwarding))
+
+  ########################################
+  # samples/s a SubscriberMW takes off its socket with a drain budget
+  ########################################
+  def drain (self, budget):
+    context = zmq.Context.instance ()
+    pub = context.socket (zmq.PUB)
+    pub.setsockopt (zmq.SNDHWM, 0)
+    port = pub.bind_to_random_port ("tcp://127.0.0.1")
+
+    # nothing answers on the discovery port; the REQ socket is never used
+    args = argparse.Namespace (port=0, addr="127.0.0.1", discovery="127.0.0.1:{}".format (self.port), budget=budget, qos="", predicates="", transports="tcp")
+    mw = SubscriberMW (self.logger)
+    mw.configure (args)
+    mw.sub.setsockopt (zmq.RCVHWM, 0)
+    mw.connect_pub ("tcp://127.0.0.1:{}".format (port))
+    # subscribed to # and told the ids of our topics, as discovery would
+    mw.topics.add ("#", "#")
+    mw.intern ([discovery_pb2.TopicId (topic=topic, id=topic_id (topic)) for topic in self.topiclist])
+    counter = SampleCounter ()
+    mw.set_upcall_handle (counter)
+    time.sleep (0.2)  # let the subscription reach the publisher
+
+    codec = PublicationCodec ()
+    topics = self.topiclist
+    best = None
+    upcalls = 0
+    for _ in range (self.repeat):
+      for i in range (self.iters):
+        pub.send_multipart (codec.encode ("pub1", topics[i % len (topics)], i))
+      counter.count = 0
+      counter.upcalls = 0
+      start = time.perf_counter ()
+      # what the event loop does with each wakeup
+      while counter.count < self.iters:
+        mw.poller.poll ()
+        mw.receive_from_pub (mw.sub)
+      elapsed = time.perf_counter () - start
+      if best is None or elapsed < best:
+        best = elapsed
+        upcalls = counter.upcalls
+
+    pub.close (linger=0)
+    mw.sub.close (linger=0)
+    mw.req.close (linger=0)
+    self.drain_results.append ((budget, upcalls, self.iters / best))
+    self.logger.debug ("MWBenchmark::drain - budget {} done".format (budget))
+
+  ########################################
+  # samples/s and one way latency through a PUB/SUB pair over a transport
+  ########################################
+  def transport (self, transport):
+    context = zmq.Context.instance ()
+    pub = context.socket (zmq.PUB)
+    sub = context.socket (zmq.SUB)
+    pub.setsockopt (zmq.SNDHWM, 0)
+    sub.setsockopt (zmq.RCVHWM, 0)
+    if transport == "tcp":
+      endpoint = "tcp://127.0.0.1:{}".format (pub.bind_to_random_port ("tcp://127.0.0.1"))
+    else:
+      # named the way the middleware names its local endpoints
+      endpoint, = local_endpoints ("127.0.0.1", self.port + 6, [transport])
+      bind_endpoints (pub, [endpoint])
+    sub.connect (endpoint)
+    sub.setsockopt (zmq.SUBSCRIBE, b"")
+    time.sleep (0.2)  # let the subscription reach the publisher
+
+    codec = PublicationCodec ()
+    topics = self.topiclist
+    best = None
+    for _ in range (self.repeat):
+      start = time.perf_counter ()
+      for i in range (self.iters):
+        pub.send_multipart (codec.encode ("pub1", topics[i % len (topics)], i))
+      for _ in range (self.iters):
+        frames = sub.recv_multipart (copy=False)
+        PublicationCodec.decode (frames[1].buffer)
+      elapsed = time.perf_counter () - start
+      if best is None or elapsed < best:
+        best = elapsed
+
+    # one sample in flight at a time
+    latencies = []
+    for i in range (self.iters // 10):
+      start = time.perf_counter_ns ()
+      pub.send_multipart (codec.encode ("pub1", topics[i % len (topics)], i))
+      frames = sub.recv_multipart (copy=False)
+      PublicationCodec.decode (frames[1].buffer)
+      latencies.append (time.perf_counter_ns () - start)
+    latencies.sort ()
+
+    pub.close (linger=0)
+    sub.close (linger=0)
+    p50 = latencies[len (latencies) // 2] / 1000.0
+    p99 = latencies[len (latencies) * 99 // 100] / 1000.0
+    self.transport_results.append ((transport, self.iters / best, p50, p99))
+    self.logger.debug ("MWBenchmark::transport - {} done".format (transport))
+
+  ########################################
+  # nsec one per message log statement costs the caller
+  ########################################
+  def logging_cost (self):
+    log = logging.getLogger ("MWBenchmark.hotpath")
+    log.propagate = False
+    log.setLevel (logging.INFO)
+    devnull = open (os.devnull, "w")
+    buf = PublicationCodec ().encode ("pub1", "weather", "sunny")[1]
+    seq = 42
+
+    def measure (name, func, iters=None):
+      self.log_results.append ((name, 1e9 / self.rate (func, iters)))
+
+    # below the level: only the guard, or the formatting done for nothing
+    trace = hot_path (log)
+    def guarded ():
+      if trace:
+        log.debug ("PublisherMW::disseminate - {} seq {}: {}".format ("weather", seq, buf))
+    measure ("DEBUG guarded", guarded)
+    measure ("DEBUG eager format", lambda: log.debug ("PublisherMW::disseminate - {} seq {}: {}".format ("weather", seq, buf)))
+    measure ("DEBUG Lazy", lambda: log.debug (Lazy ("PublisherMW::disseminate - {} seq {}: {}", "weather", seq, buf)))
+
+    # emitted, the way the processes used to (basicConfig) and through LogUtil
+    emit = lambda: log.info ("PublisherMW::disseminate - {} seq {}: {}".format ("weather", seq, buf))
+    handler = logging.StreamHandler (devnull)
+    handler.setFormatter (logging.Formatter ('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    log.addHandler (handler)
+    measure ("INFO stream handler", emit)
+    log.removeHandler (handler)
+
+    records = queue.SimpleQueue ()
+    listener = logging.handlers.QueueListener (records, handler)
+    queue_handler = logging.handlers.QueueHandler (records)
+    log.addHandler (queue_handler)
+    listener.start ()
+    measure ("INFO queue", emit)
+    queue_handler.addFilter (RateSampler ())
+    measure ("INFO queue sampled", emit)
+    listener.stop ()
+    log.removeHandler (queue_handler)
+    devnull.close ()
+
+    # /dev/null takes every write at once, so there the queue only adds the
+    # put and the hand over to its thread. What it is for is a sink that
+    # cannot keep up, such as a terminal over ssh: here a pipe read 4 KiB
+    # every 5 msec, whose writes block once its buffer is full. Fewer
+    # records, as the queue has to be drained into it afterwards.
+    read_fd, write_fd = os.pipe ()
+    pipe = os.fdopen (write_fd, "w")
+    draining = [True]
+    def reader ():
+      while draining[0]:
+        if not os.read (read_fd, 4096):
+          break
+        time.sleep (0.005)
+    reader_thread = threading.Thread (target=reader, daemon=True)
+    reader_thread.start ()
+    slow = max (1, self.iters // 10)
+    handler = logging.StreamHandler (pipe)
+    handler.setFormatter (logging.Formatter ('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    log.addHandler (handler)
+    measure ("INFO stream, slow sink", emit, slow)
+    log.removeHandler (handler)
+
+    listener = logging.handlers.QueueListener (records, handler)
+    queue_handler = logging.handlers.QueueHandler (records)
+    log.addHandler (queue_handler)
+    listener.start ()
+    measure ("INFO queue, slow sink", emit, slow)
+    listener.stop ()
+    log.removeHandler (queue_handler)
+    draining[0] = False
+    pipe.close ()
+    reader_thread.join ()
+    os.close (read_fd)
+    self.logger.debug ("MWBenchmark::logging_cost done")
+
+  ########################################
+  # driver
+  ########################################
+  def driver (self):
+    ''' Driver program '''
+
+    try:
+      self.logger.info ("MWBenchmark::driver")
+
+      codec = DiscoveryCodec ()
+      topics = self.topiclist
+      infos = self.publisherInfos
+
+      # requests sent by publishers, subscribers and the broker
+      self.measure ("RegisterReq",
+                    lambda: legacy_register_req ("pub1", "10.0.0.1", 5570, topics),
+                    lambda: codec.register_req (discovery_pb2.ROLE_PUBLISHER, "pub1", "10.0.0.1", 5570, topics))
+      self.measure ("IsReadyReq", legacy_isready_req, codec.isready_req)
+      self.measure ("LookupPubByTopicReq",
+                    lambda: legacy_lookup_req (topics),
+                    lambda: codec.lookup_req (topics))
+
+      # responses sent by discovery
+      self.measure ("RegisterResp",
+                    lambda: legacy_register_resp (discovery_pb2.STATUS_SUCCESS, None),
+                    lambda: codec.register_resp (discovery_pb2.STATUS_SUCCESS, None))
+      self.measure ("IsReadyResp",
+                    lambda: legacy_isready_resp (True),
+                    lambda: codec.isready_resp (True))
+      self.measure ("LookupPubByTopicResp",
+                    lambda: legacy_lookup_resp (infos),
+                    lambda: codec.lookup_resp (infos))
+
+      # decoding on both sides
+      req_buf = codec.register_req (discovery_pb2.ROLE_PUBLISHER, "pub1", "10.0.0.1", 5570, topics)
+      resp_buf = codec.lookup_resp (infos)
+      self.measure ("decode DiscoveryReq",
+                    lambda: legacy_decode_req (req_buf),
+                    lambda: codec.decode_req (req_buf))
+      self.measure ("decode DiscoveryResp",
+                    lambda: legacy_decode_resp (resp_buf),
+                    lambda: codec.decode_resp (resp_buf))
+
+      # the data path
+      pub_codec = PublicationCodec ()
+      for topic, value in (("location", "Europe"), ("humidity", 61.25), ("altitude", 31000)):
+        self.measure ("Publication enc {}".format (type (value).__name__),
+                      lambda: legacy_publication (topic, value),
+                      lambda: pub_codec.encode ("pub1", topic, value))
+        string_buf = legacy_publication (topic, value)
+        pub_buf = pub_codec.encode ("pub1", topic, value)[1]
+        self.measure ("Publication dec {}".format (type (value).__name__),
+                      lambda: legacy_receive (string_buf),
+                      lambda: PublicationCodec.value (PublicationCodec.decode (pub_buf)))
+
+      # the data path over real sockets
+      for batch in self.batches:
+        self.pipeline (batch)
+
+      # and through a broker
+      self.broker ("proxy", self.port)
+      self.broker ("device", self.port + 3)
+
+      # and off the subscriber's socket
+      for budget in self.budgets:
+        self.drain (budget)
+
+      # and over each transport
+      for transport in self.transports:
+        self.transport (transport)
+
+      # what logging on the hot paths costs
+      self.logging_cost ()
+
+      self.report ()
+      self.logger.info ("MWBenchmark::driver completed")
+
+    except Exception as e:
+      raise e
+
+  ########################################
+  # print the results
+  ########################################
+  def report (self):
+    ''' Pretty print '''
+    try:
+      print ("{:<24} {:>14} {:>14} {:>8}".format ("message", "legacy msg/s", "codec msg/s", "speedup"))
+      for name, legacy_rate, codec_rate in self.results:
+        print ("{:<24} {:>14.0f} {:>14.0f} {:>7.2f}x".format (name, legacy_rate, codec_rate, codec_rate / legacy_rate))
+
+      if self.pipeline_results:
+        print ()
+        print ("{:<24} {:>14} {:>14} {:>8}".format ("PUB/SUB over tcp", "messages", "samples/s", "speedup"))
+        unbatched = self.pipeline_results[0][2]
+        for batch, sent, rate in self.pipeline_results:
+          print ("{:<24} {:>14} {:>14.0f} {:>7.2f}x".format ("batch {}".format (batch), sent, rate, rate / unbatched))
+
+      if self.broker_results:
+        print ()
+        print ("{:<24} {:>14} {:>14} {:>8}".format ("through the broker", "received", "samples/s", "speedup"))
+        proxy_rate = self.broker_results[0][2]
+        for forwarding, received, rate in self.broker_results:
+          print ("{:<24} {:>14} {:>14.0f} {:>7.2f}x".format (forwarding, received, rate, rate / proxy_rate))
+
+      if self.drain_results:
+        print ()
+        print ("{:<24} {:>14} {:>14} {:>8}".format ("SubscriberMW drain", "upcalls", "samples/s", "speedup"))
+        single = self.drain_results[0][2]
+        for budget, upcalls, rate in self.drain_results:
+          print ("{:<24} {:>14} {:>14.0f} {:>7.2f}x".format ("budget {}".format (budget), upcalls, rate, rate / single))
+
+      if self.transport_results:
+        print ()
+        print ("{:<24} {:>14} {:>14} {:>8}".format ("PUB/SUB over", "samples/s", "p50 usec", "p99 usec"))
+        for transport, rate, p50, p99 in self.transport_results:
+          print ("{:<24} {:>14.0f} {:>14.1f} {:>8.1f}".format (transport, rate, p50, p99))
+
+      if self.log_results:
+        print ()
+        print ("{:<24} {:>14}".format ("logging per message", "nsec"))
+        for name, nsec in self.log_results:
+          print ("{:<24} {:>14.0f}".format (name, nsec))
+
+    except Exception as e:
+      raise e
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  # instantiate a ArgumentParser object
+  parser = argparse.ArgumentParser (description="Middleware serialization benchmark")
+
+  parser.add_argument ("-i", "--iters", type=int, default=20000, help="Messages built per measurement, default 20000")
+
+  parser.add_argument ("-r", "--repeat", type=int, default=5, help="Measurements per case, the best is reported, default 5")
+
+  parser.add_argument ("-T", "--num_topics", type=int, default=5, help="Topics in register and lookup messages, default 5")
+
+  parser.add_argument ("-b", "--batches", default="1,10,100", help="Comma separated batch sizes pushed through PUB/SUB, 1 = no batching, default 1,10,100")
+
+  parser.add_argument ("-u", "--budgets", default="1,10,100", help="Comma separated drain budgets for the SubscriberMW, 1 = one message per wakeup, default 1,10,100")
+
+  parser.add_argument ("-p", "--port", type=int, default=5590, help="First of the six local ports the broker cases use (the next one names the local endpoints), default 5590")
+
+  parser.add_argument ("-x", "--transports", default="ipc,inproc", help="Comma separated local transports to compare with tcp over PUB/SUB, default ipc,inproc")
+
+  parser.add_argument ("-P", "--num_pubs", type=int, default=10, help="Publishers in a lookup response, default 10")
+
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args()
+
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  try:
+    # obtain a system wide logger and initialize it to debug level to begin with
+    logging.info ("Main - acquire a child logger and then log messages in the child")
+    logger = logging.getLogger ("MWBenchmark")
+
+    # first parse the arguments
+    logger.debug ("Main: parse command line arguments")
+    args = parseCmdLineArgs ()
+
+    # reset the log level to as specified
+    logger.debug ("Main: resetting log level to {}".format (args.loglevel))
+    logger.setLevel (args.loglevel)
+    logger.debug ("Main: effective log level is {}".format (logger.getEffectiveLevel ()))
+
+    # Obtain the benchmark object
+    logger.debug ("Main: obtain the benchmark object")
+    bench = MWBenchmark (logger)
+
+    # configure the object
+    logger.debug ("Main: configure the benchmark object")
+    bench.configure (args)
+
+    # now invoke the driver program
+    logger.debug ("Main: invoke the benchmark driver")
+    bench.driver ()
+
+  except Exception as e:
+    logger.error ("Exception caught in main - {}".format (e))
+    return
+
+
+###################################
+#
+# Main entry point
+#
+###################################
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+  main ()
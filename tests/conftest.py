@@ -0,0 +1,15 @@
+###############################################
+#
+# Purpose: Unit tests of the middleware building blocks; run with
+#
+#     python -m pytest -q
+#
+# from the top of the tree
+#
+###############################################
+
+import os
+import sys
+
+# the tests import CS6381_MW and the top level modules as the applns do
+sys.path.insert (0, os.path.dirname (os.path.dirname (os.path.abspath (__file__))))
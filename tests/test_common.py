@@ -0,0 +1,122 @@
+###############################################
+#
+# Purpose: Publication codec, batch tags and QoS parsing of Common.py
+#
+###############################################
+
+import os
+import pytest
+
+from CS6381_MW import discovery_pb2
+from CS6381_MW.Common import BATCH_TAG, BATCH_TAGS, COMPRESSION, PublicationBatcher, PublicationCodec
+from CS6381_MW.Common import parse_compression, parse_qos, topic_frame, topic_id
+
+##################################
+#       Publication codec
+##################################
+@pytest.mark.parametrize ("value", ["sunny", 21.5, -7, b"\0\1\2"])
+def test_sample_round_trip (value):
+  codec = PublicationCodec ()
+  frame, buf = codec.encode ("pub1", "sensors/b1/temperature", value, timestamp=1234)
+  assert frame == topic_frame ("sensors/b1/temperature")
+  pub = PublicationCodec.decode (buf)
+  assert PublicationCodec.value (pub) == value
+  assert type (PublicationCodec.value (pub)) is type (value)
+  assert (pub.pub_id, pub.topic_id, pub.seq, pub.timestamp) == ("pub1", topic_id ("sensors/b1/temperature"), 1, 1234)
+  assert codec.size ("pub1", "sensors/b1/temperature", value) == len (frame) + len (buf)
+
+def test_samples_are_numbered_and_stamped ():
+  codec = PublicationCodec ()
+  first = PublicationCodec.decode (codec.encode ("pub1", "light", 1)[1])
+  second = PublicationCodec.decode (codec.encode ("pub1", "weather", 2)[1])
+  assert (first.seq, second.seq) == (1, 2)
+  assert 0 < first.timestamp <= second.timestamp
+
+def test_unsupported_value ():
+  with pytest.raises (ValueError):
+    PublicationCodec ().encode ("pub1", "light", [1, 2])
+
+##################################
+#       Batches and their tags
+##################################
+def unpack (frames):
+  ''' the samples of a batch message, as a subscriber undoes it '''
+  topic, tag, buf = frames
+  compression = BATCH_TAGS[bytes (tag)]
+  return PublicationCodec.decode_batch (buf if compression is None else compression.decompress (buf))
+
+def test_batch_goes_out_at_max_count ():
+  batcher = PublicationBatcher (PublicationCodec (), max_count=3, max_bytes=1 << 20, linger=1000)
+  assert batcher.add ("pub1", "light", 1, timestamp=10) is None
+  assert batcher.add ("pub1", "light", 2, timestamp=11) is None
+  frames = batcher.add ("pub1", "light", 3, timestamp=12)
+  assert frames[0] == topic_frame ("light") and frames[1] == BATCH_TAG
+  pubs = unpack (frames)
+  assert [(PublicationCodec.value (pub), pub.seq, pub.timestamp) for pub in pubs] == [(1, 1, 10), (2, 2, 11), (3, 3, 12)]
+  # and the next one starts over
+  assert batcher.next_deadline () is None
+  assert batcher.add ("pub1", "light", 4) is None
+  assert [PublicationCodec.value (pub) for pub in unpack (batcher.flush ()[0])] == [4]
+  assert batcher.flush () == []
+
+def test_batch_goes_out_at_max_bytes ():
+  batcher = PublicationBatcher (PublicationCodec (), max_count=1000, max_bytes=100, linger=1000)
+  sent = [frames for frames in (batcher.add ("pub1", "weather", "x" * 30) for _ in range (10)) if frames]
+  assert sent and all (len (unpack (frames)) < 10 for frames in sent)
+
+def test_batches_are_kept_per_topic ():
+  batcher = PublicationBatcher (PublicationCodec (), max_count=10, max_bytes=1 << 20, linger=1000)
+  batcher.add ("pub1", "light", 1)
+  batcher.add ("pub1", "weather", "sunny")
+  batcher.add ("pub1", "light", 2)
+  batches = {bytes (frames[0]): [PublicationCodec.value (pub) for pub in unpack (frames)] for frames in batcher.flush ()}
+  assert batches == {topic_frame ("light"): [1, 2], topic_frame ("weather"): ["sunny"]}
+
+def test_linger_expires_batches ():
+  batcher = PublicationBatcher (PublicationCodec (), max_count=10, max_bytes=1 << 20, linger=0)
+  batcher.add ("pub1", "light", 1)
+  assert [PublicationCodec.value (pub) for pub in unpack (batcher.expired ()[0])] == [1]
+  assert batcher.expired () == []
+
+@pytest.mark.parametrize ("name", sorted (COMPRESSION))
+def test_compressed_batch_round_trip (name):
+  compression = COMPRESSION[name]
+  assert BATCH_TAGS[compression.tag] is compression
+  batcher = PublicationBatcher (PublicationCodec (), max_count=50, max_bytes=1 << 20, linger=1000)
+  batcher.compression["weather"] = compression
+  for i in range (49):
+    batcher.add ("pub1", "weather", "sunny and warm")
+  frames = batcher.add ("pub1", "weather", "sunny and warm")
+  assert frames[1] == compression.tag
+  assert [PublicationCodec.value (pub) for pub in unpack (frames)] == ["sunny and warm"] * 50
+  stats = batcher.stats.summary ()["weather"]
+  assert stats["compressed"] == 1 and stats["ratio"] > 1
+
+def test_small_or_incompressible_batches_stay_plain ():
+  batcher = PublicationBatcher (PublicationCodec (), max_count=1, max_bytes=1 << 20, linger=1000, compress_min=1000)
+  batcher.compression["light"] = COMPRESSION["zlib"]
+  assert batcher.add ("pub1", "light", 1)[1] == BATCH_TAG
+  batcher.compress_min = 0
+  frames = batcher.add ("pub1", "light", os.urandom (64))
+  assert frames[1] == BATCH_TAG
+  assert batcher.stats.summary ()["light"]["compressed"] == 0
+
+def test_parse_compression ():
+  assert parse_compression ("zlib, weather=lzma ,light=zlib") == {None: ["zlib"], "weather": ["lzma"], "light": ["zlib"]}
+  with pytest.raises (ValueError):
+    parse_compression ("gzip")
+
+##################################
+#       Subscriber QoS
+##################################
+def test_parse_qos ():
+  assert parse_qos ("") == []
+  assert parse_qos ("conflate, weather=drop-newest:50,sensors/#=drop-oldest:") == [
+    (None, discovery_pb2.QOS_CONFLATE, 0),
+    ("weather", discovery_pb2.QOS_DROP_NEWEST, 50),
+    ("sensors/#", discovery_pb2.QOS_DROP_OLDEST, 0)]
+
+@pytest.mark.parametrize ("spec", ["latest", "weather=drop:5", "conflate:0", "weather=drop-oldest:-1"])
+def test_parse_qos_rejects (spec):
+  with pytest.raises (ValueError):
+    parse_qos (spec)
@@ -0,0 +1,72 @@
+###############################################
+#
+# Purpose: Predicate parsing and the PredicateIndex
+#
+###############################################
+
+import pytest
+
+from CS6381_MW.ContentFilter import PredicateIndex, literal, parse_predicates
+
+def test_literal ():
+  assert literal ("42") == 42 and isinstance (literal ("42"), int)
+  assert literal ("4.5") == 4.5
+  assert literal ("sunny") == "sunny"
+
+def test_parse_predicates ():
+  assert parse_predicates (" temperature>50, weather==sunny ,light.pub_id!=pub2,,") == [
+    ("temperature", "value", ">", 50),
+    ("weather", "value", "==", "sunny"),
+    ("light", "pub_id", "!=", "pub2")]
+  assert parse_predicates ("sensors/b1/humidity <= 0.5") == [("sensors/b1/humidity", "value", "<=", 0.5)]
+  with pytest.raises (ValueError):
+    parse_predicates ("temperature")
+  with pytest.raises (ValueError):
+    parse_predicates ("temperature.seq>1")
+
+@pytest.mark.parametrize ("op, operand, wanted", [
+  ("==", 50, [50]),
+  ("!=", 50, [10, 60]),
+  ("<", 50, [10]),
+  ("<=", 50, [10, 50]),
+  (">", 50, [60]),
+  (">=", 50, [50, 60]),
+])
+def test_each_operator (op, operand, wanted):
+  index = PredicateIndex ()
+  index.add ("s1", "temperature", [("value", op, operand)])
+  assert [value for value in (10, 50, 60) if index.matching ("temperature", value, "pub1")] == wanted
+
+def test_all_predicates_of_a_filter_must_hold ():
+  index = PredicateIndex ()
+  index.add ("s1", "temperature", [("value", ">", 10), ("value", "<", 20), ("pub_id", "==", "pub1")])
+  index.add ("s2", "temperature", [("value", ">=", 15)])
+  assert index.matching ("temperature", 12, "pub1") == {"s1"}
+  assert index.matching ("temperature", 15, "pub1") == {"s1", "s2"}
+  assert index.matching ("temperature", 15, "pub2") == {"s2"}
+  assert index.matching ("temperature", 25, "pub1") == {"s2"}
+  assert index.matching ("temperature", 5, "pub1") == set ()
+
+def test_operands_only_match_values_of_their_kind ():
+  index = PredicateIndex ()
+  index.add ("s1", "weather", [("value", ">", 10)])
+  index.add ("s2", "weather", [("value", "==", "sunny")])
+  assert index.matching ("weather", "sunny", "pub1") == {"s2"}
+  assert index.matching ("weather", 11, "pub1") == {"s1"}
+  assert index.matching ("weather", 10.5, "pub1") == {"s1"}
+
+def test_unfiltered_topics_and_removal ():
+  index = PredicateIndex ()
+  assert index.matching ("temperature", 1, "pub1") is None
+  index.add ("s1", "temperature", [("value", ">", 10)])
+  index.add ("s1", "humidity", [("value", "<", 1)])
+  index.add ("s2", "temperature", [("value", "<", 5)])
+  assert index.filtered ("temperature") and not index.filtered ("light")
+  assert index.has ("s1", "humidity") and not index.has ("s2", "humidity")
+  assert len (index) == 2
+  index.remove ("s1")
+  assert not index.filtered ("humidity")
+  assert index.matching ("temperature", 20, "pub1") == set ()
+  assert index.matching ("temperature", 1, "pub1") == {"s2"}
+  index.remove ("s2")
+  assert len (index) == 0
@@ -0,0 +1,143 @@
+###############################################
+#
+# Purpose: TopicLog segments across rolls, flushes and restarts
+#
+###############################################
+
+import os
+import time
+import zmq
+
+from CS6381_MW.Common import topic_frame, SNAPSHOT_TAG
+from CS6381_MW.TopicLog import TopicLog
+
+TOPIC = topic_frame ("sensors/b1/temperature")
+
+def message (i, topic=TOPIC):
+  ''' the frames of a single sample message, as the broker receives them '''
+  return [zmq.Frame (topic), zmq.Frame ("sample {}".format (i).encode ())]
+
+def payloads (messages):
+  return [bytes (frames[0]) for seq, frames in messages]
+
+def make_log (tmp_path, segment_bytes=64):
+  return TopicLog (str (tmp_path / "log"), segment_bytes, flush_interval=10)
+
+def test_readers_only_see_flushed_messages (tmp_path):
+  log = make_log (tmp_path, segment_bytes=1 << 20)
+  log.append ([message (i) for i in range (3)])
+  assert log.deadline is not None
+  assert log.read (TOPIC, 1, 0, 0, 100) == ([], 1, True)
+  log.flush ()
+  assert log.deadline is None
+  messages, next_seq, caught_up = log.read (TOPIC, 1, 0, 0, 100)
+  assert [seq for seq, frames in messages] == [1, 2, 3]
+  assert payloads (messages) == [b"sample 0", b"sample 1", b"sample 2"]
+  assert (next_seq, caught_up) == (4, True)
+  log.close ()
+
+def test_segments_roll_past_segment_bytes (tmp_path):
+  log = make_log (tmp_path)
+  log.append ([message (i) for i in range (20)])
+  log.flush ()
+  segments = log.segments[TOPIC]
+  assert len (segments) > 1
+  # every segment starts where the one before it ended
+  for before, after in zip (segments, segments[1:]):
+    assert after.base == before.base + before.count
+  assert sorted (os.listdir (log.topic_dir (TOPIC)))[0] == "{:020d}.idx".format (1)
+  messages, next_seq, caught_up = log.read (TOPIC, 1, 0, 0, 100)
+  assert payloads (messages) == [b"sample %d" % i for i in range (20)]
+  assert (next_seq, caught_up) == (21, True)
+  log.close ()
+
+def test_roll_makes_the_sealed_segment_visible (tmp_path):
+  log = make_log (tmp_path)
+  # no flush: rolling over flushes the segment being sealed, not the new one
+  log.append ([message (i) for i in range (20)])
+  segments = log.segments[TOPIC]
+  sealed = sum (segment.count for segment in segments)
+  assert 0 < sealed < 20
+  messages, next_seq, caught_up = log.read (TOPIC, 1, 0, 0, 100)
+  assert [seq for seq, frames in messages] == list (range (1, sealed + 1))
+  assert (next_seq, caught_up) == (sealed + 1, True)
+  log.flush ()
+  messages, next_seq, caught_up = log.read (TOPIC, sealed + 1, 0, 0, 100)
+  assert messages[0][0] == sealed + 1
+  assert next_seq == 21
+  log.close ()
+
+def test_read_pages_across_segments (tmp_path):
+  log = make_log (tmp_path)
+  log.append ([message (i) for i in range (20)])
+  log.flush ()
+  seen = []
+  next_seq, caught_up = 1, False
+  while not caught_up:
+    messages, next_seq, caught_up = log.read (TOPIC, next_seq, 0, 0, 3)
+    assert len (messages) <= 3
+    seen.extend (seq for seq, frames in messages)
+  assert seen == list (range (1, 21))
+  log.close ()
+
+def test_locate_by_sequence_and_time (tmp_path):
+  log = make_log (tmp_path)
+  log.append ([message (i) for i in range (10)])
+  log.flush ()
+  later = log.segments[TOPIC][-1].stamps[0] + 1
+  time.sleep (0.001)
+  log.append ([message (i) for i in range (10, 20)])
+  log.flush ()
+  for seq in (1, 5, 12, 20):
+    n, i = log.locate (TOPIC, seq, 0)
+    assert log.segments[TOPIC][n].base + i == seq
+  assert log.locate (TOPIC, 21, 0) is None
+  # by time: the first message received at or after since
+  n, i = log.locate (TOPIC, 0, later)
+  assert log.segments[TOPIC][n].base + i == 11
+  # until stops short of what came later
+  messages, next_seq, caught_up = log.read (TOPIC, 1, 0, later, 100)
+  assert [seq for seq, frames in messages] == list (range (1, 11))
+  assert (next_seq, caught_up) == (11, True)
+  assert log.locate (b"\0\0\0\0", 1, 0) is None
+  log.close ()
+
+def test_restart_keeps_the_log_and_its_numbering (tmp_path):
+  log = make_log (tmp_path)
+  log.append ([message (i) for i in range (15)])
+  log.close ()
+  log = make_log (tmp_path)
+  messages, next_seq, caught_up = log.read (TOPIC, 1, 0, 0, 100)
+  assert payloads (messages) == [b"sample %d" % i for i in range (15)]
+  assert next_seq == 16
+  log.append ([message (i) for i in range (15, 25)])
+  log.flush ()
+  messages, next_seq, caught_up = log.read (TOPIC, 14, 0, 0, 100)
+  assert [seq for seq, frames in messages] == list (range (14, 26))
+  assert payloads (messages)[-1] == b"sample 24"
+  log.close ()
+
+def test_restart_cuts_back_a_torn_write (tmp_path):
+  log = make_log (tmp_path, segment_bytes=1 << 20)
+  log.append ([message (i) for i in range (3)])
+  log.close ()
+  # the .log lost its last message but the .idx still has its entry
+  segment = log.segments[TOPIC][0]
+  with open (segment.path + ".log", "r+b") as f:
+    f.truncate (segment.offsets[2])
+  log = make_log (tmp_path, segment_bytes=1 << 20)
+  messages, next_seq, caught_up = log.read (TOPIC, 1, 0, 0, 100)
+  assert payloads (messages) == [b"sample 0", b"sample 1"]
+  assert next_seq == 3
+  log.close ()
+
+def test_snapshots_and_batches (tmp_path):
+  log = make_log (tmp_path, segment_bytes=1 << 20)
+  batch = [zmq.Frame (TOPIC), zmq.Frame (b"b"), zmq.Frame (b"batch")]
+  snapshot = [zmq.Frame (TOPIC), zmq.Frame (SNAPSHOT_TAG), zmq.Frame (b"cached")]
+  log.append ([snapshot, batch, message (1)])
+  log.flush ()
+  messages, next_seq, caught_up = log.read (TOPIC, 1, 0, 0, 100)
+  # the cached value is not new data and never makes it into the log
+  assert [[bytes (frame) for frame in frames] for seq, frames in messages] == [[b"b", b"batch"], [b"sample 1"]]
+  log.close ()
@@ -0,0 +1,81 @@
+###############################################
+#
+# Purpose: Wildcard subscriptions and the TopicTrie
+#
+###############################################
+
+import pytest
+
+from CS6381_MW.TopicTrie import TopicTrie, is_pattern, matches, prefix
+
+SUBSCRIPTIONS = [
+  "sensors/b1/temperature",
+  "sensors/*/temperature",
+  "sensors/#",
+  "sensors/b1/#",
+  "*",
+  "#",
+  "light",
+]
+
+TOPICS = [
+  "sensors",
+  "sensors/b1",
+  "sensors/b1/temperature",
+  "sensors/b2/temperature",
+  "sensors/b1/temperature/max",
+  "light",
+  "lighting",
+  "weather/b1/temperature",
+]
+
+def test_is_pattern_and_prefix ():
+  assert is_pattern ("sensors/*/temperature") and is_pattern ("sensors/#")
+  assert not is_pattern ("sensors/b1/temperature") and not is_pattern ("sensors/b#")
+  assert prefix ("sensors/*/temperature") == "sensors"
+  assert prefix ("sensors/b1/#") == "sensors/b1"
+  assert prefix ("#") == ""
+  assert prefix ("light") == "light"
+
+def test_matches ():
+  assert matches ("sensors/*/temperature", "sensors/b1/temperature")
+  assert not matches ("sensors/*/temperature", "sensors/temperature")
+  assert not matches ("sensors/*/temperature", "sensors/b1/temperature/max")
+  # # matches zero levels too
+  assert matches ("sensors/#", "sensors")
+  assert matches ("sensors/#", "sensors/b1/temperature")
+  assert not matches ("sensors/#", "sensorsx")
+  # a plain name is not a prefix match
+  assert not matches ("light", "lighting")
+  assert not matches ("sensors/b1", "sensors")
+
+def test_trie_agrees_with_matches ():
+  trie = TopicTrie ()
+  for subscription in SUBSCRIPTIONS:
+    trie.add (subscription, subscription)
+  assert len (trie) == len (SUBSCRIPTIONS)
+  for topic in TOPICS:
+    assert trie.match (topic) == {subscription for subscription in SUBSCRIPTIONS if matches (subscription, topic)}, topic
+
+def test_trie_values_and_removal ():
+  trie = TopicTrie ()
+  trie.add ("sensors/*/temperature", "s1")
+  trie.add ("sensors/*/temperature", "s2")
+  trie.add ("sensors/*/temperature", "s2")
+  trie.add ("sensors/b1/#", "s3")
+  assert len (trie) == 3
+  assert trie.match ("sensors/b1/temperature") == {"s1", "s2", "s3"}
+  trie.remove ("sensors/*/temperature", "s1")
+  assert trie.match ("sensors/b1/temperature") == {"s2", "s3"}
+  trie.remove ("sensors/*/temperature", "s2")
+  trie.remove ("sensors/b1/#", "s3")
+  assert len (trie) == 0
+  assert trie.match ("sensors/b1/temperature") == set ()
+  # empty branches are pruned
+  assert trie.root.children == {}
+  # removing what is not there is harmless
+  trie.remove ("nothing/here", "s1")
+
+def test_hash_may_only_end_a_subscription ():
+  with pytest.raises (ValueError):
+    TopicTrie ().add ("sensors/#/temperature", "s1")
@@ -17,6 +17,11 @@
 # since we are going to publish or subscribe to a random sampling of topics,
 # we need this package
 import random
+import string
+
+from CS6381_MW.Common import topic_id
+from CS6381_MW.TopicTrie import SEPARATOR
+from load_generator import weighted_sample, zipf_weights
 
 # define a helper class to hold all the topics that we support in our system
 class TopicSelector ():
@@ -30,43 +35,83 @@ class TopicSelector ():
                           "pressure", "temperature", "sound", "altitude", \
                           "location"]
 
+  # How the value of a sample of each kind of topic is made up. Values are
+  # returned in their natural type (str, int or float) as the publication
+  # format carries them typed.
+  generators = {
+    "weather": lambda: random.choice (["sunny", "cloudy", "rainy", "foggy", "icy"]),
+    "humidity": lambda: random.uniform (10.0, 100.0),
+    "airquality": lambda: random.choice (["good", "smog", "poor"]),
+    # in lumens
+    "light": lambda: random.choice ([450, 800, 1100, 1600]),
+    # in millibars (lowest recorded to highest recorded)
+    "pressure": lambda: random.randint (870, 1084),
+    # in fahrenheit
+    "temperature": lambda: random.randint (-100, 100),
+    # in decibels
+    "sound": lambda: random.randint (30, 95),
+    # in feet
+    "altitude": lambda: random.randint (0, 40000),
+    "location": lambda: random.choice (["America", "Europe", "Asia", "Africa", "Australia"]),
+  }
+
+  # There may be more topics to choose from than the kinds above: topic i of
+  # a universe of num is kind i % 9 numbered i // 9, e.g. weather, ...,
+  # location, weather1, humidity1, ... so experiments can have 10k topics and
+  # more. Names whose id (see Topic ids in CS6381_MW/Common.py) an earlier
+  # topic already has are passed over, as discovery would refuse them. The
+  # earlier a topic comes, the more popular it is: with a skew, interest ()
+  # picks topics of rank r with a weight of 1/(r+1)^skew (Zipf), so the top
+  # topics get the most publishers and subscribers.
+  def __init__ (self, num=len (topiclist), skew=0.0):
+    self.skew = skew
+    if num <= len (self.topiclist):
+      self.universe = self.topiclist[:num]
+    else:
+      self.universe = []
+      ids = set ()
+      index = 0
+      while len (self.universe) < num:
+        topic = self.topiclist[index % len (self.topiclist)] + (str (index // len (self.topiclist)) if index >= len (self.topiclist) else "")
+        index += 1
+        id = topic_id (topic)
+        if id not in ids:
+          ids.add (id)
+          self.universe.append (topic)
+    self.ranks = {topic: rank for rank, topic in enumerate (self.universe)}
+
+  # Topics may be hierarchical, such as sensors/building1/temperature, where
+  # the last level is one of the names above and what comes before it says
+  # where the sample comes from (see CS6381_MW/TopicTrie.py for wildcard
+  # subscriptions to them). The kind of a topic is its last level, without
+  # the number it has in a larger universe.
+  def kind (self, topic):
+    return topic.rsplit (SEPARATOR, 1)[-1].rstrip (string.digits)
+
+  # place topics under a prefix such as sensors/building1
+  def qualify (self, prefix, topics):
+    if not prefix:
+      return list (topics)
+    return [prefix.rstrip (SEPARATOR) + SEPARATOR + topic for topic in topics]
+
   # return a random subset of topics from this list, which becomes our interest
   # A publisher or subscriber application logic will invoke this method to get their
   # interest. 
   def interest (self, num=1):
-    # here we just randomly create a subset from this list and return it
-    #return random.sample (self.topiclist, random.randint (1, len (self.topiclist)))
-    return random.sample (self.topiclist, num)
-
-  # generate a publication on a given topic
-  def gen_publication (self, topic):
-    if (topic == "weather"):
-      return random.choice (["sunny", "cloudy", "rainy", "foggy", "icy"])
-    elif (topic == "humidity"):
-      return str (random.uniform (10.0, 100.0))
-    elif (topic == "airquality"):
-      return random.choice (["good", "smog", "poor"])
-    elif (topic == "light"):
-      # in lumens
-      return random.choice (["450", "800", "1100", "1600"])
-    elif (topic == "pressure"):
-      # in millibars (lowest recorded to highest recorded)
-      return str (random.randint (870, 1084))
-    elif (topic == "temperature"):
-      # in fahrenheit
-      return str (random.randint (-100, 100))
-    elif (topic == "sound"):
-      # in decibels
-      return str (random.randint (30, 95))
-    elif (topic == "altitude"):
-      # in feet
-      return str (random.randint (0, 40000))
-    elif (topic == "location"):
-      return random.choice (["America", "Europe", "Asia", "Africa", "Australia"])
-                            
-        
-
+    if num > len (self.universe):
+      raise ValueError ("Cannot choose {} topics out of {}".format (num, len (self.universe)))
+    if not self.skew:
+      # here we just randomly create a subset from this list and return it
+      #return random.sample (self.topiclist, random.randint (1, len (self.topiclist)))
+      return random.sample (self.universe, num)
+    return weighted_sample (self.universe, self.popularity (self.universe), num)
 
+  # Zipf weights of topics of the universe, qualified or not, which a load
+  # generator picks the topic of each sample by
+  def popularity (self, topics):
+    return zipf_weights ([self.ranks[topic.rsplit (SEPARATOR, 1)[-1]] for topic in topics], self.skew)
 
-
-    
+  # generate a publication on a given topic. Values are returned in their natural
+  # type (str, int or float) as the publication format carries them typed.
+  def gen_publication (self, topic):
+    return self.generators[self.kind (topic)] ()